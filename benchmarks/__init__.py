@@ -0,0 +1 @@
+"""Бенчмарки: микробенчмарки сервисов и нагрузочные сценарии API."""
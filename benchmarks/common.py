@@ -0,0 +1,129 @@
+"""Общие утилиты бенчмарков: замеры, перцентили и запись результатов в JSON."""
+
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль q (0–100) с линейной интерполяцией."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(name: str, durations: list[float], elapsed: float, **params) -> dict:
+    """Сводка замеров: пропускная способность и перцентили задержки.
+
+    Args:
+        name: Имя замера.
+        durations: Длительности отдельных операций, секунды.
+        elapsed: Общее время выполнения всех операций, секунды.
+        **params: Параметры замера (бэкенд, число записей и т.п.).
+    """
+    count = len(durations)
+    return {
+        "name": name,
+        **params,
+        "ops": count,
+        "elapsed_s": round(elapsed, 6),
+        "throughput_ops_s": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(durations) / count * 1000, 4) if count else 0.0,
+        "p50_ms": round(percentile(durations, 50) * 1000, 4),
+        "p95_ms": round(percentile(durations, 95) * 1000, 4),
+        "p99_ms": round(percentile(durations, 99) * 1000, 4),
+    }
+
+
+def measure(name: str, operation: Callable[[int], object], count: int, **params) -> dict:
+    """Выполняет operation(i) count раз и возвращает сводку замеров."""
+    durations = []
+    started = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        operation(i)
+        durations.append(time.perf_counter() - start)
+    return summarize(name, durations, time.perf_counter() - started, **params)
+
+
+def make_jpeg(rng: random.Random, size: int = 320) -> bytes:
+    """Создаёт уникальное JPEG-изображение из шума (воспроизводимо по seed)."""
+    from PIL import Image
+
+    noise = bytes(rng.getrandbits(8) for _ in range(size * size * 3 // 64))
+    img = Image.frombytes("RGB", (size // 8, size // 8), noise).resize((size, size))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(suite: str, parameters: dict, results: list[dict], output: Optional[str]) -> str:
+    """Записывает результаты прогона в JSON и возвращает путь к файлу.
+
+    По умолчанию файл создаётся в benchmarks/results/ с именем
+    <suite>-<время запуска>.json, чтобы прогоны можно было сравнивать.
+    """
+    started_at = datetime.now()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{started_at:%Y%m%d-%H%M%S}.json")
+    payload = {
+        "suite": suite,
+        "created_at": started_at.isoformat(timespec="seconds"),
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "git_commit": _git_commit(),
+        },
+        "parameters": parameters,
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return output
+
+
+_METRIC_KEYS = {
+    "name", "ops", "elapsed_s", "throughput_ops_s", "mean_ms", "p50_ms", "p95_ms", "p99_ms",
+    "errors", "error_rate", "items", "throughput_items_s", "max_ms",
+}
+
+
+def print_table(results: list[dict]) -> None:
+    """Выводит сводку результатов в консоль."""
+    for result in results:
+        params = ", ".join(
+            f"{key}={value}" for key, value in result.items()
+            if key not in _METRIC_KEYS
+        )
+        print(
+            f"{result['name']:<32} {params:<40} "
+            f"{result['throughput_ops_s']:>12.1f} оп/с  "
+            f"p50 {result['p50_ms']:>9.3f} мс  p95 {result['p95_ms']:>9.3f} мс  "
+            f"p99 {result['p99_ms']:>9.3f} мс"
+        )
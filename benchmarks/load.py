@@ -0,0 +1,201 @@
+"""Нагрузочные сценарии: приложение FastAPI in-process против заглушки HF API.
+
+Приложение запускается в этом же процессе (httpx.ASGITransport, с lifespan),
+распознавание идёт через tools.stub_hf_server с заданными задержкой, долей
+ошибок и лимитом одновременных запросов. Хранилища создаются во временном
+каталоге, поэтому прогоны не зависят друг от друга.
+
+Запуск:
+    python -m benchmarks.load --requests 200 --concurrency 16 --latency 0.05 --error-rate 0.02
+
+Сценарии:
+    upload_batch     POST /upload/batch с --files-per-request уникальными JPEG
+    inference_batch  POST /inference/batch по загруженным ранее ID
+    stats            GET /visualization/stats
+
+Результаты записываются в benchmarks/results/load-<время>.json (или в --output).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+from benchmarks.common import make_jpeg, percentile, print_table, summarize, write_results
+
+SCENARIOS = ("upload_batch", "inference_batch", "stats")
+
+
+def _configure_environment(workdir: str, stub_url: str, backend: str) -> None:
+    """Настраивает сервисы через переменные окружения до импорта приложения."""
+    os.environ.update({
+        "METADATA_BACKEND": backend,
+        "METADATA_DB": os.path.join(workdir, "metadata.db"),
+        "METADATA_FILE": os.path.join(workdir, "metadata.json"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "PREDICTION_CACHE_DB": os.path.join(workdir, "prediction_cache.db"),
+        "JOBS_DIR": os.path.join(workdir, "jobs"),
+        "CLASSIFIER_BACKEND": "hf",
+        "HF_API_URL": stub_url,
+        "HF_API_TOKEN": "stub",
+    })
+
+
+async def _drive(
+    name: str,
+    count: int,
+    concurrency: int,
+    request: Callable[[int], Awaitable[tuple[bool, int]]],
+    **params,
+) -> dict:
+    """Выполняет request(i) count раз не более чем concurrency одновременно.
+
+    request возвращает признак успеха и число обработанных элементов
+    (файлов или изображений) — из них считается пропускная способность по элементам.
+    """
+    durations: list[float] = []
+    errors = 0
+    items = 0
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal errors, items, next_index
+        while next_index < count:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                ok, processed = await request(index)
+            except Exception:
+                ok, processed = False, 0
+            durations.append(time.perf_counter() - start)
+            items += processed
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(concurrency, 1))))
+    elapsed = time.perf_counter() - started
+    result = summarize(name, durations, elapsed, concurrency=concurrency, **params)
+    result.update({
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "items": items,
+        "throughput_items_s": round(items / elapsed, 2) if elapsed else 0.0,
+        "max_ms": round(percentile(durations, 100) * 1000, 4),
+    })
+    return result
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    """Поднимает заглушку HF API и приложение, прогоняет выбранные сценарии."""
+    import httpx
+    from aiohttp import web
+
+    from tools.stub_hf_server import build_app
+
+    stub = web.AppRunner(build_app(args.latency, args.error_rate, args.max_concurrent, args.retry_after))
+    await stub.setup()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    await web.SockSite(stub, sock).start()
+
+    rng = random.Random(args.seed)
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory(prefix="cars-load-") as workdir:
+        _configure_environment(workdir, f"http://127.0.0.1:{port}/models/stub", args.backend)
+        import main
+
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with main.lifespan(main.app), httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=None,
+            ) as client:
+                results = await _run_scenarios(client, args, rng)
+        finally:
+            await stub.cleanup()
+    return results
+
+
+async def _run_scenarios(client, args: argparse.Namespace, rng: random.Random) -> list[dict]:
+    params = {"backend": args.backend, "latency_s": args.latency, "error_rate_stub": args.error_rate}
+    per_request = args.files_per_request
+    images = [make_jpeg(rng) for _ in range(args.requests * per_request)]
+    uploaded_ids: list[int] = []
+
+    async def upload(index: int) -> tuple[bool, int]:
+        batch = images[index * per_request:(index + 1) * per_request]
+        response = await client.post("/upload/batch", files=[
+            ("files", (f"car_{index}_{n}.jpg", data, "image/jpeg")) for n, data in enumerate(batch)
+        ])
+        if response.status_code != 200:
+            return False, 0
+        files = response.json()["files"]
+        uploaded_ids.extend(item["id"] for item in files)
+        return True, len(files)
+
+    async def recognize(index: int) -> tuple[bool, int]:
+        batch = uploaded_ids[index * per_request:(index + 1) * per_request]
+        response = await client.post("/inference/batch", json=batch)
+        if response.status_code != 200:
+            return False, 0
+        return True, sum(1 for item in response.json() if item["error"] is None)
+
+    async def stats(index: int) -> tuple[bool, int]:
+        response = await client.get("/visualization/stats")
+        return response.status_code == 200, 1
+
+    results = []
+    # Распознавание и статистика идут по данным сценария загрузки, поэтому он выполняется всегда
+    upload_result = await _drive("upload_batch", args.requests, args.concurrency, upload,
+                                 files_per_request=per_request, **params)
+    if "upload_batch" in args.scenarios:
+        results.append(upload_result)
+    if "inference_batch" in args.scenarios:
+        uploaded_ids.sort()
+        batches = (len(uploaded_ids) + per_request - 1) // per_request
+        results.append(await _drive("inference_batch", batches, args.concurrency, recognize,
+                                    files_per_request=per_request, **params))
+    if "stats" in args.scenarios:
+        results.append(await _drive("stats", args.requests, args.concurrency, stats, **params))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии приложения")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="Число запросов в сценарии")
+    parser.add_argument("--concurrency", type=int, default=8, help="Одновременные запросы клиента")
+    parser.add_argument("--files-per-request", type=int, default=4,
+                        help="Файлов (ID) в одном пакетном запросе")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite",
+                        help="Бэкенд хранилища метаданных")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка заглушки HF, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500 заглушки")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="Лимит одновременных запросов заглушки, сверх него 429 (0 — без лимита)")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After ответов 429, секунды")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+
+    # Ошибки заглушки при --error-rate ожидаемы: в выводе остаются только итоги
+    logging.disable(logging.ERROR)
+
+    results = asyncio.run(run(args))
+    print_table(results)
+    for result in results:
+        print(f"{result['name']}: ошибок {result['errors']}, "
+              f"элементов {result['items']} ({result['throughput_items_s']:.1f}/с)")
+    path = write_results("load", vars(args), results, args.output)
+    print(f"Результаты: {path}")
+
+
+if __name__ == "__main__":
+    main()
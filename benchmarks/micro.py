@@ -0,0 +1,213 @@
+"""Микробенчмарки: хранилище метаданных, проверка изображений, кеш предсказаний и поиск.
+
+Запуск:
+    python -m benchmarks.micro --sizes 1000 10000 100000 --backends sqlite json
+
+Каждый прогон работает во временном каталоге и записывает результаты
+в benchmarks/results/micro-<время>.json (или в файл из --output).
+"""
+
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import make_jpeg, measure, print_table, summarize, write_results
+
+
+def _configure_store(backend: str, records: int, workdir: str) -> None:
+    """Направляет metadata_store на чистое хранилище во временном каталоге."""
+    from services import metadata_store
+
+    metadata_store.close()
+    metadata_store.METADATA_BACKEND = backend
+    metadata_store.METADATA_DB = os.path.join(workdir, f"metadata-{records}.db")
+    metadata_store.METADATA_FILE = os.path.join(workdir, f"metadata-{records}.json")
+    # Без фонового сворачивания журнала, чтобы замеры были воспроизводимыми
+    metadata_store.METADATA_FLUSH_INTERVAL = 0
+
+
+def bench_metadata_store(backend: str, records: int, rng: random.Random, workdir: str) -> list[dict]:
+    """Операции metadata_store на хранилище из records записей."""
+    from models.schemas import Prediction
+    from services import metadata_store, stats
+    from services.storage import ImageQuery
+
+    _configure_store(backend, records, workdir)
+    labels = [f"Make{i} Model{i} {2000 + i % 20}" for i in range(50)]
+    params = {"backend": backend, "records": records}
+    results = [measure(
+        "metadata_store.add_image",
+        lambda i: metadata_store.add_image(
+            filename=f"{i}.jpg", path=f"/tmp/{i}.jpg", mime_type="image/jpeg",
+            size_bytes=rng.randint(10_000, 5_000_000), sha256=f"{rng.getrandbits(256):064x}",
+        ),
+        records, **params,
+    )]
+
+    sample = min(records, 2000)
+    ids = [rng.randint(1, records) for _ in range(sample)]
+    predictions = [
+        [Prediction(label=rng.choice(labels), confidence=round(rng.random(), 4)) for _ in range(3)]
+        for _ in range(sample)
+    ]
+    results.append(measure(
+        "metadata_store.update_results",
+        lambda i: metadata_store.update_results(ids[i], predictions[i]), sample, **params,
+    ))
+    results.append(measure(
+        "metadata_store.get_by_id", lambda i: metadata_store.get_by_id(ids[i]), sample, **params,
+    ))
+    results.append(measure(
+        "metadata_store.query_images[100]",
+        lambda i: metadata_store.query_images(ImageQuery(
+            processed=True, sort="confidence", descending=True, limit=100,
+        )),
+        50, **params,
+    ))
+    results.append(measure(
+        "metadata_store.query_images[label]",
+        lambda i: metadata_store.query_images(ImageQuery(label=labels[i % len(labels)], limit=100)),
+        50, **params,
+    ))
+    results.append(measure("stats.rebuild", lambda i: stats.rebuild(), 3, **params))
+    results.append(measure("stats.get_summary", lambda i: stats.get_summary(), 1000, **params))
+
+    if backend == "json":
+        # Снимок со всеми записями пишется при закрытии, загрузка — при следующем обращении
+        start = time.perf_counter()
+        metadata_store.close()
+        elapsed = time.perf_counter() - start
+        results.append(summarize("json_backend.flush", [elapsed], elapsed, **params))
+        start = time.perf_counter()
+        metadata_store.get_next_id()
+        elapsed = time.perf_counter() - start
+        results.append(summarize("json_backend.load", [elapsed], elapsed, **params))
+    metadata_store.close()
+    return results
+
+
+def bench_image_processor(rng: random.Random, count: int) -> list[dict]:
+    """Проверка загружаемых файлов и перекодирование для API."""
+    from services import image_processor
+
+    images = [make_jpeg(rng) for _ in range(min(count, 50))]
+    return [
+        measure(
+            "image_processor.validate_file_extension",
+            lambda i: image_processor.validate_file_extension(f"photo_{i}.JPEG"), count,
+        ),
+        measure(
+            "image_processor.validate_image_integrity",
+            lambda i: image_processor.validate_image_integrity(images[i % len(images)]), count,
+        ),
+        measure(
+            "image_processor.encode_for_remote",
+            lambda i: image_processor.encode_for_remote(images[i % len(images)]),
+            min(count, 200),
+        ),
+        measure(
+            "image_processor.perceptual_hash",
+            lambda i: image_processor.perceptual_hash(images[i % len(images)]),
+            min(count, 200),
+        ),
+    ]
+
+
+def bench_prediction_cache(rng: random.Random, count: int, workdir: str) -> list[dict]:
+    """In-memory LRU и персистентный уровень кеша предсказаний hf_client."""
+    from models.schemas import Prediction
+    from services import hf_client, prediction_cache
+
+    prediction_cache.close()
+    prediction_cache.PREDICTION_CACHE_DB = os.path.join(workdir, "prediction_cache.db")
+    cache = prediction_cache.get_cache("benchmark")
+    keys = [f"{rng.getrandbits(256):064x}" for _ in range(count)]
+    value = [Prediction(label="Make Model 2012", confidence=0.9)] * 3
+
+    results = [
+        measure("hf_client._put_cache", lambda i: hf_client._put_cache(keys[i], value), count),
+        measure("hf_client._get_cached", lambda i: hf_client._get_cached(keys[i]), count),
+        measure("prediction_cache.put", lambda i: cache.put(keys[i], value), count),
+        measure("prediction_cache.get[hit]", lambda i: cache.get(keys[i]), count),
+        measure("prediction_cache.get[miss]", lambda i: cache.get(f"miss-{i}"), count),
+    ]
+    hf_client.clear_cache()
+    prediction_cache.close()
+    return results
+
+
+def bench_search_index(records: int, rng: random.Random, count: int) -> list[dict]:
+    """Поиск по марке и модели в индексе на records изображений с top-3 предсказаниями."""
+    from services.search_index import SearchIndex
+
+    makes = ["Aston Martin", "Audi", "BMW", "Chevrolet", "Dodge", "Ford", "Hyundai", "Mercedes-Benz"]
+    labels = [
+        f"{make} Model{i} {body} {2000 + i % 13}"
+        for make in makes for i in range(25) for body in ("Sedan", "Coupe")
+    ]
+    index = SearchIndex()
+    for image_id in range(1, records + 1):
+        confidences = sorted((rng.random() for _ in range(3)), reverse=True)
+        index.apply(None, {
+            "id": image_id,
+            "processed": True,
+            "results": [
+                {"label": label, "confidence": confidence}
+                for label, confidence in zip(rng.sample(labels, 3), confidences)
+            ],
+        })
+    queries = ["bmw", "aston martin model1", "audi model2 coupe", "2012", "mercedes-benz sedan", "m"]
+    params = {"records": records}
+    return [
+        measure(
+            "search_index.search[limit=50]",
+            lambda i: index.search(queries[i % len(queries)], None, None, 0.0, None, 50, 0),
+            count, **params,
+        ),
+        measure(
+            "search_index.search[top-1, min_confidence=0.5]",
+            lambda i: index.search(queries[i % len(queries)], None, None, 0.5, 1, 50, 0),
+            count, **params,
+        ),
+        measure(
+            "search_index.matching_labels[prefix]",
+            lambda i: index.matching_labels(queries[i % len(queries)][:2]), count, **params,
+        ),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки сервисов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Размеры хранилища метаданных")
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "json"])
+    parser.add_argument("--iterations", type=int, default=2000,
+                        help="Число операций в замерах image_processor и кеша")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+
+    # Сообщения INFO от сервисов на каждую операцию исказили бы замеры
+    logging.disable(logging.INFO)
+
+    rng = random.Random(args.seed)
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory(prefix="cars-bench-") as workdir:
+        for backend in args.backends:
+            for size in args.sizes:
+                results.extend(bench_metadata_store(backend, size, rng, workdir))
+        results.extend(bench_image_processor(rng, args.iterations))
+        results.extend(bench_prediction_cache(rng, args.iterations, workdir))
+        for size in args.sizes:
+            results.extend(bench_search_index(size, rng, args.iterations))
+
+    print_table(results)
+    path = write_results("micro", vars(args), results, args.output)
+    print(f"Результаты: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Стресс-тест хранилища метаданных при нескольких процессах.
+
+Режимы:
+    store   процессы-воркеры параллельно добавляют записи и сохраняют
+            результаты распознавания напрямую через metadata_store;
+    server  uvicorn с --workers N (классификатор dummy), клиенты в отдельных
+            процессах загружают изображения и распознают их через HTTP.
+
+После прогона проверяется, что ни одна запись не потеряна, ID не
+повторяются, все записи обработаны, а статистика каждого воркера
+совпадает с хранилищем.
+
+Запуск:
+    python -m benchmarks.stress --mode store --backend json --processes 8 --operations 200
+    python -m benchmarks.stress --mode server --backend sqlite --workers 4 --processes 8 --operations 50
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import make_jpeg, print_table, summarize, write_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _environment(workdir: str, backend: str) -> dict:
+    return {
+        "METADATA_BACKEND": backend,
+        "METADATA_DB": os.path.join(workdir, "metadata.db"),
+        "METADATA_FILE": os.path.join(workdir, "metadata.json"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "PREDICTION_CACHE_DB": os.path.join(workdir, "prediction_cache.db"),
+        "JOBS_DIR": os.path.join(workdir, "jobs"),
+        "CLASSIFIER_BACKEND": "dummy",
+    }
+
+
+def _store_worker(args: tuple[int, int, dict]) -> tuple[list[int], list[float]]:
+    """Добавляет записи и сохраняет для них предсказания; возвращает ID и длительности."""
+    index, operations, environment = args
+    os.environ.update(environment)
+    logging.disable(logging.INFO)
+    from models.schemas import Prediction
+    from services import metadata_store
+
+    ids: list[int] = []
+    durations: list[float] = []
+    for n in range(operations):
+        start = time.perf_counter()
+        record = metadata_store.add_image(
+            filename=f"{index}_{n}.jpg", path=f"/tmp/{index}_{n}.jpg", mime_type="image/jpeg",
+            size_bytes=1000, sha256=f"{index:08x}{n:056x}",
+        )
+        metadata_store.update_results(
+            record.id, [Prediction(label=f"Make{n % 7} Model {2010 + n % 5}", confidence=0.5)],
+        )
+        durations.append(time.perf_counter() - start)
+        ids.append(record.id)
+    metadata_store.close()
+    return ids, durations
+
+
+def _client_worker(args: tuple[int, int, str, int]) -> tuple[list[int], list[float], int]:
+    """Загружает уникальные изображения и распознаёт их; возвращает ID, длительности и ошибки."""
+    index, operations, base_url, seed = args
+    import httpx
+
+    rng = random.Random(seed + index)
+    ids: list[int] = []
+    durations: list[float] = []
+    errors = 0
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        for n in range(operations):
+            start = time.perf_counter()
+            response = client.post("/upload/", files={
+                "file": (f"{index}_{n}.jpg", make_jpeg(rng, 64), "image/jpeg"),
+            })
+            if response.status_code != 200:
+                errors += 1
+                continue
+            image_id = response.json()["files"][0]["id"]
+            if client.post(f"/inference/{image_id}").status_code != 200:
+                errors += 1
+            durations.append(time.perf_counter() - start)
+            ids.append(image_id)
+    return ids, durations, errors
+
+
+def _run_workers(worker, tasks: list[tuple]) -> tuple[list, float]:
+    started = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(len(tasks)) as pool:
+        outcomes = pool.map(worker, tasks)
+    return outcomes, time.perf_counter() - started
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/visualization/stats", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Сервер не запустился")
+
+
+def _verify(expected_ids: list[int], summaries: list[dict]) -> list[str]:
+    """Сверяет хранилище с ID, полученными процессами, и статистику воркеров с хранилищем."""
+    from services import metadata_store
+
+    problems = []
+    if len(set(expected_ids)) != len(expected_ids):
+        problems.append(f"повторяющиеся ID: {len(expected_ids) - len(set(expected_ids))}")
+    records = {record.id: record for record in metadata_store.get_all()}
+    missing = set(expected_ids) - set(records)
+    if missing:
+        problems.append(f"потеряно записей: {len(missing)}")
+    unprocessed = [image_id for image_id, record in records.items() if not record.processed]
+    if unprocessed:
+        problems.append(f"необработанных записей: {len(unprocessed)}")
+    for summary in summaries:
+        if (summary["total_files"], summary["processed_files"]) != (len(records), len(records)):
+            problems.append(
+                f"статистика воркера: {summary['total_files']}/{summary['processed_files']}, "
+                f"в хранилище {len(records)}"
+            )
+    metadata_store.close()
+    return problems
+
+
+def run_store(args: argparse.Namespace, workdir: str) -> tuple[dict, list[str]]:
+    environment = _environment(workdir, args.backend)
+    outcomes, elapsed = _run_workers(
+        _store_worker, [(index, args.operations, environment) for index in range(args.processes)],
+    )
+    os.environ.update(environment)
+    from services import stats
+
+    ids = [image_id for worker_ids, _ in outcomes for image_id in worker_ids]
+    durations = [duration for _, worker_durations in outcomes for duration in worker_durations]
+    problems = _verify(ids, [stats.get_summary()])
+    result = summarize("stress.store", durations, elapsed, backend=args.backend,
+                       processes=args.processes, operations=args.operations)
+    return result, problems
+
+
+def run_server(args: argparse.Namespace, workdir: str) -> tuple[dict, list[str]]:
+    import httpx
+
+    environment = _environment(workdir, args.backend)
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **environment},
+    )
+    try:
+        _wait_ready(base_url)
+        outcomes, elapsed = _run_workers(_client_worker, [
+            (index, args.operations, base_url, args.seed) for index in range(args.processes)
+        ])
+        # Запросы распределяются между воркерами: опрашиваем статистику несколько раз
+        summaries = [httpx.get(f"{base_url}/visualization/stats").json() for _ in range(args.workers * 4)]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    os.environ.update(environment)
+    ids = [image_id for worker_ids, _, _ in outcomes for image_id in worker_ids]
+    durations = [duration for _, worker_durations, _ in outcomes for duration in worker_durations]
+    errors = sum(worker_errors for _, _, worker_errors in outcomes)
+    problems = _verify(ids, summaries)
+    if errors:
+        problems.append(f"ошибок HTTP: {errors}")
+    result = summarize("stress.server", durations, elapsed, backend=args.backend, workers=args.workers,
+                       processes=args.processes, operations=args.operations)
+    result["errors"] = errors
+    return result, problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Стресс-тест хранилища при нескольких процессах")
+    parser.add_argument("--mode", choices=["store", "server"], default="store")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--processes", type=int, default=8, help="Параллельные процессы-клиенты")
+    parser.add_argument("--operations", type=int, default=100, help="Записей на процесс")
+    parser.add_argument("--workers", type=int, default=4, help="Воркеры uvicorn (режим server)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix="cars-stress-") as workdir:
+        runner = run_store if args.mode == "store" else run_server
+        result, problems = runner(args, workdir)
+
+    print_table([result])
+    result["problems"] = problems
+    path = write_results("stress", vars(args), [result], args.output)
+    print(f"Результаты: {path}")
+    if problems:
+        print("Нарушена согласованность: " + "; ".join(problems))
+        sys.exit(1)
+    print("Согласованность: OK")
+
+
+if __name__ == "__main__":
+    main()
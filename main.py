@@ -6,6 +6,7 @@
 
 import logging
 import os
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
@@ -15,7 +16,9 @@ from fastapi.staticfiles import StaticFiles
 
 load_dotenv()
 
-from routers import inference, management, upload, visualization
+from routers import inference, management, search, upload, visualization
+from routers import metrics as metrics_router
+from services import classifier, job_queue, metadata_store, metrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,10 +27,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Жизненный цикл приложения: общие ресурсы создаются при старте и освобождаются при остановке."""
+    await classifier.startup()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await classifier.shutdown()
+    metadata_store.close()
+
+
 app = FastAPI(
     title="Cars Recognizer API",
     description="API для распознавания марок и моделей автомобилей по фотографиям",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware
@@ -39,11 +55,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики задержки по маршрутам (см. GET /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Подключение роутеров
 app.include_router(upload.router)
 app.include_router(inference.router)
 app.include_router(management.router)
 app.include_router(visualization.router)
+app.include_router(search.router)
+app.include_router(metrics_router.router)
 
 
 @app.get("/")
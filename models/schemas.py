@@ -22,6 +22,8 @@ class ImageMetadata(BaseModel):
     results: Optional[list[Prediction]] = None
     mime_type: str
     size_bytes: int
+    sha256: Optional[str] = None
+    phash: Optional[str] = None
 
 
 class UploadResponse(BaseModel):
@@ -30,6 +32,20 @@ class UploadResponse(BaseModel):
     files: list[ImageMetadata]
 
 
+class FilesPage(BaseModel):
+    """Страница списка файлов."""
+    items: list[dict]
+    next_cursor: Optional[str] = None
+
+
+class IngestResult(BaseModel):
+    """Итог загрузки и распознавания одного файла (строка NDJSON-потока)."""
+    filename: str
+    id: Optional[int] = None
+    predictions: list[Prediction] = []
+    error: Optional[str] = None
+
+
 class InferenceResponse(BaseModel):
     """Ответ на запрос распознавания."""
     id: int
@@ -37,12 +53,106 @@ class InferenceResponse(BaseModel):
     predictions: list[Prediction]
 
 
+class BatchInferenceItem(BaseModel):
+    """Результат распознавания одного изображения в пакете."""
+    id: int
+    filename: Optional[str] = None
+    predictions: list[Prediction] = []
+    error: Optional[str] = None
+
+
+class JobCreateRequest(BaseModel):
+    """Запрос на создание задания распознавания."""
+    image_ids: Optional[list[int]] = None
+    all_unprocessed: bool = False
+
+
+class BulkRequest(BaseModel):
+    """Запрос массовой операции: список ID (без него — записи по фильтрам запроса).
+
+    Чтобы применить операцию ко всем записям без ID и фильтров, нужно явно передать all=true.
+    """
+    ids: Optional[list[int]] = None
+    all: bool = False
+
+
+class BulkItemResult(BaseModel):
+    """Исход массовой операции для одной записи."""
+    id: int
+    status: str
+    error: Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    """Итог массовой операции."""
+    requested: int
+    succeeded: int
+    failed: int
+    items: list[BulkItemResult]
+
+
+class SearchResult(BaseModel):
+    """Найденное изображение и лучшее из совпавших предсказаний."""
+    id: int
+    label: str
+    make: str
+    model: str
+    year: Optional[int] = None
+    confidence: float
+    rank: int
+
+
+class SearchResponse(BaseModel):
+    """Страница результатов поиска."""
+    results: list[SearchResult]
+    next_offset: Optional[int] = None
+
+
+class SearchSuggestion(BaseModel):
+    """Подсказка автодополнения: метка и число изображений с ней в top-1."""
+    label: str
+    make: str
+    model: str
+    year: Optional[int] = None
+    count: int
+
+
+class DuplicateCluster(BaseModel):
+    """Группа почти одинаковых изображений (по перцептивному хешу)."""
+    size: int
+    images: list[ImageMetadata]
+
+
+class DuplicatesResponse(BaseModel):
+    """Группы почти одинаковых изображений."""
+    max_distance: int
+    total_clusters: int
+    clusters: list[DuplicateCluster]
+
+
+class JobStatus(BaseModel):
+    """Состояние задания фонового распознавания."""
+    id: str
+    status: str
+    created_at: datetime
+    updated_at: datetime
+    image_ids: list[int]
+    total: int
+    completed: int = 0
+    failed: int = 0
+    results: list[BatchInferenceItem] = []
+    error: Optional[str] = None
+
+
 class StatsResponse(BaseModel):
     """Статистика по загруженным файлам."""
     total_files: int
     processed_files: int
     unprocessed_files: int
     top_brands: list[dict]
+    distinct_labels: int = 0
+    confidence_histogram: list[dict] = []
+    uploads_per_day: list[dict] = []
 
 
 class ErrorResponse(BaseModel):
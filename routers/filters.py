@@ -0,0 +1,29 @@
+"""Общие параметры фильтрации записей для эндпоинтов списков и экспорта."""
+
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import Query
+
+from services.storage import ImageQuery
+
+
+def image_filters(
+    processed: Optional[bool] = Query(None, description="Только обработанные / необработанные"),
+    label: Optional[str] = Query(None, description="Top-1 метка"),
+    uploaded_from: Optional[datetime] = Query(None, description="Загружены не раньше"),
+    uploaded_to: Optional[datetime] = Query(None, description="Загружены не позже"),
+    min_confidence: Optional[float] = Query(None, ge=0, le=1, description="Минимальная уверенность top-1"),
+    sort: Literal["id", "upload_date", "confidence", "size"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+) -> ImageQuery:
+    """Собирает параметры запроса в ImageQuery."""
+    return ImageQuery(
+        processed=processed,
+        label=label,
+        uploaded_from=uploaded_from.isoformat() if uploaded_from else None,
+        uploaded_to=uploaded_to.isoformat() if uploaded_to else None,
+        min_confidence=min_confidence,
+        sort=sort,
+        descending=order == "desc",
+    )
@@ -1,58 +1,141 @@
 """Эндпоинты для распознавания изображений."""
 
+import json
 import logging
+from typing import AsyncIterator
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
-from models.schemas import InferenceResponse
-from services import hf_client, metadata_store
+from models.schemas import BatchInferenceItem, InferenceResponse, JobCreateRequest, JobStatus
+from services import classifier, hf_client, job_queue, metadata_store, recognition
+from services.resilience import CircuitOpenError
+from services.storage import ImageQuery
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/inference", tags=["Inference"])
 
 
-@router.post("/batch", response_model=list[InferenceResponse])
-async def recognize_batch(image_ids: list[int]) -> list[InferenceResponse]:
+@router.get("/pool")
+async def pool_stats() -> dict:
+    """Метрики пула соединений с HF API (открытые, простаивающие, ожидание в очереди)."""
+    return hf_client.get_pool_stats()
+
+
+@router.get("/cache")
+async def cache_stats() -> dict:
+    """Статистика кеша предсказаний: in-memory LRU и персистентный уровень."""
+    return hf_client.get_cache_stats()
+
+
+@router.get("/coalescing")
+async def coalescing_stats() -> dict:
+    """Счётчики объединения конкурентных запросов для одинаковых изображений."""
+    return hf_client.get_coalescing_stats()
+
+
+@router.get("/breaker")
+async def breaker_state() -> dict:
+    """Состояние выключателя HF API (closed/open/half_open), счётчики отказов и параметры повторов."""
+    return hf_client.get_breaker_state()
+
+
+@router.post("/breaker/reset")
+async def reset_breaker() -> dict:
+    """Принудительно замыкает выключатель HF API."""
+    return hf_client.reset_breaker()
+
+
+@router.get("/batcher")
+async def batcher_stats() -> dict:
+    """Статистика микробатчинга локальной модели: заполнение пакетов и задержка в очереди."""
+    return classifier.get_batcher_stats()
+
+
+@router.post("/batch", response_model=list[BatchInferenceItem])
+async def recognize_batch(image_ids: list[int]) -> list[BatchInferenceItem]:
     """Пакетное распознавание нескольких изображений.
 
+    Изображения обрабатываются конкурентно (не более INFERENCE_MAX_IN_FLIGHT
+    одновременно); результаты возвращаются в порядке входных ID, ошибки —
+    в поле error соответствующего элемента.
+
     Args:
         image_ids: Список ID изображений.
 
     Returns:
         Список результатов распознавания.
     """
-    results: list[InferenceResponse] = []
-
-    for image_id in image_ids:
-        image = metadata_store.get_by_id(image_id)
-        if not image:
-            logger.warning("Изображение id=%d не найдено, пропущено", image_id)
-            continue
+    results = await recognition.recognize_many(image_ids)
 
-        try:
-            predictions = await hf_client.classify_image(image.path)
-        except RuntimeError as e:
-            logger.error("Ошибка распознавания id=%d: %s", image_id, str(e))
-            continue
-
-        metadata_store.update_results(image_id, predictions)
-
-        results.append(InferenceResponse(
-            id=image.id,
-            filename=image.filename,
-            predictions=predictions,
-        ))
-
-    if not results:
+    processed = sum(1 for item in results if item.error is None)
+    if not processed:
+        errors = "; ".join(f"id={item.id}: {item.error}" for item in results)
         raise HTTPException(
             status_code=400,
-            detail="Ни одно изображение не было успешно обработано.",
+            detail=f"Ни одно изображение не было успешно обработано. {errors}".strip(),
         )
 
-    logger.info("Пакетное распознавание: обработано %d из %d", len(results), len(image_ids))
+    logger.info("Пакетное распознавание: обработано %d из %d", processed, len(image_ids))
     return results
 
 
+@router.post("/jobs", response_model=JobStatus, status_code=202)
+async def create_job(request: JobCreateRequest) -> JobStatus:
+    """Создание фонового задания распознавания.
+
+    Возвращает задание сразу; прогресс доступен через GET /inference/jobs/{job_id}
+    и поток событий GET /inference/jobs/{job_id}/events.
+
+    Args:
+        request: Список ID изображений или флаг all_unprocessed.
+    """
+    if request.all_unprocessed:
+        image_ids = [image.id for image in metadata_store.iter_images(ImageQuery(processed=False))]
+    else:
+        image_ids = request.image_ids or []
+    if not image_ids:
+        raise HTTPException(status_code=400, detail="Нет изображений для распознавания.")
+    return await job_queue.submit(image_ids)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str) -> JobStatus:
+    """Состояние задания: прогресс и частичные результаты.
+
+    Args:
+        job_id: ID задания.
+    """
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """Поток событий задания (Server-Sent Events) до его завершения.
+
+    Args:
+        job_id: ID задания.
+    """
+    if not await job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+
+    async def stream() -> AsyncIterator[str]:
+        async for event, data in job_queue.events(job_id):
+            if event == "keepalive":
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/{image_id}", response_model=InferenceResponse)
 async def recognize_single(image_id: int) -> InferenceResponse:
     """Распознавание одного изображения по ID.
@@ -68,7 +151,12 @@ async def recognize_single(image_id: int) -> InferenceResponse:
         raise HTTPException(status_code=404, detail="Изображение не найдено.")
 
     try:
-        predictions = await hf_client.classify_image(image.path)
+        predictions = await recognition.classify(image)
+    except CircuitOpenError as e:
+        logger.warning("Распознавание id=%d отклонено: %s", image_id, str(e))
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(max(int(e.retry_in), 1))}
+        )
     except RuntimeError as e:
         logger.error("Ошибка распознавания id=%d: %s", image_id, str(e))
         raise HTTPException(status_code=502, detail=str(e))
@@ -1,21 +1,230 @@
 """Эндпоинты для управления загруженными файлами."""
 
+import asyncio
+import base64
+import binascii
+import json
 import logging
 import os
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Iterator, Literal, Optional, Union
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 
-from models.schemas import ImageMetadata
-from services import metadata_store
+from models.schemas import (
+    BulkItemResult,
+    BulkRequest,
+    BulkResult,
+    DuplicateCluster,
+    DuplicatesResponse,
+    FilesPage,
+    ImageMetadata,
+)
+from routers.filters import image_filters
+from routers.responses import FileRangeResponse, not_modified, requested_range
+from services import file_storage, metadata_store, phash_index, recognition, thumbnails
+from services.storage import ImageQuery
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/files", tags=["Management"])
 
+MAX_PAGE_SIZE = 1000
 
-@router.get("/", response_model=list[ImageMetadata])
-async def list_files() -> list[ImageMetadata]:
-    """Получение списка всех загруженных файлов с метаданными."""
-    return metadata_store.get_all()
+# Кеширование изображений, запрошенных с версией содержимого (v=<префикс SHA-256>)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Минимальная длина префикса SHA-256 в параметре v
+_MIN_VERSION_LENGTH = 8
+
+
+async def _release_file(image: ImageMetadata) -> None:
+    """Удаляет файл изображения, если на его содержимое не ссылаются другие записи."""
+    await file_storage.release(image.path, image.sha256)
+
+
+async def _release_files(images: list[ImageMetadata]) -> None:
+    """Удаляет файлы удалённых записей, на содержимое которых больше нет ссылок."""
+    if images:
+        await file_storage.release_many([(image.path, image.sha256) for image in images])
+
+
+def _bulk_ids(request: Optional[BulkRequest], query: ImageQuery) -> list[int]:
+    """ID для массовой операции: из тела запроса, а без него — по фильтрам.
+
+    Raises:
+        HTTPException: 400, если не заданы ни ID, ни фильтры, ни all=true —
+            пустой запрос не должен затрагивать весь архив.
+    """
+    if request is not None and request.ids is not None:
+        return list(dict.fromkeys(request.ids))
+    if not query.filtered and (request is None or not request.all):
+        raise HTTPException(
+            status_code=400,
+            detail="Укажите ids, хотя бы один фильтр или all=true для всех записей.",
+        )
+    return metadata_store.select_ids(query)
+
+
+def _bulk_result(ids: list[int], done: set[int], status: str) -> BulkResult:
+    items = [
+        BulkItemResult(id=image_id, status=status)
+        if image_id in done
+        else BulkItemResult(id=image_id, status="not_found", error="Изображение не найдено.")
+        for image_id in ids
+    ]
+    return BulkResult(requested=len(ids), succeeded=len(done), failed=len(ids) - len(done), items=items)
+
+
+def _encode_cursor(query: ImageQuery, key: tuple) -> str:
+    payload = json.dumps([query.sort, query.descending, *key])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, query: ImageQuery) -> tuple:
+    """Восстанавливает ключ позиции из курсора, проверяя совпадение сортировки."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort, descending, value, image_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор.")
+    if sort != query.sort or descending != query.descending:
+        raise HTTPException(status_code=400, detail="Курсор получен для другой сортировки.")
+    return value, image_id
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[set[str]]:
+    """Разбирает список полей проекции (через запятую)."""
+    if not fields:
+        return None
+    selected = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = selected - set(ImageMetadata.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестные поля: {', '.join(sorted(unknown))}.",
+        )
+    return selected
+
+
+def _stream_array(images: Iterator[ImageMetadata], include: Optional[set[str]]) -> Iterator[str]:
+    """Выдаёт записи JSON-массивом по частям, не собирая его в памяти целиком."""
+    yield "["
+    for index, image in enumerate(images):
+        yield ("," if index else "") + image.model_dump_json(include=include)
+    yield "]"
+
+
+@router.get("/", response_model=FilesPage)
+async def list_files(
+    query: ImageQuery = Depends(image_filters),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+    fields: Optional[str] = Query(None, description="Поля ответа через запятую"),
+) -> Union[FilesPage, StreamingResponse]:
+    """Получение списка загруженных файлов с фильтрами и сортировкой.
+
+    С параметром limit (или cursor) возвращается страница и курсор
+    следующей страницы; без них — все подходящие записи потоковым
+    JSON-массивом.
+    """
+    include = _parse_fields(fields)
+
+    if limit is None and cursor is None:
+        return StreamingResponse(
+            _stream_array(metadata_store.iter_images(query), include),
+            media_type="application/json",
+        )
+
+    query.limit = limit or MAX_PAGE_SIZE
+    if cursor is not None:
+        query.after = _decode_cursor(cursor, query)
+    images, next_key = metadata_store.query_images(query)
+    return FilesPage(
+        items=[image.model_dump(mode="json", include=include) for image in images],
+        next_cursor=_encode_cursor(query, next_key) if next_key else None,
+    )
+
+
+@router.get("/duplicates", response_model=DuplicatesResponse)
+async def list_duplicates(
+    max_distance: int = Query(8, ge=0, le=32, description="Максимальное расстояние Хэмминга pHash"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE, description="Максимум групп в ответе"),
+) -> DuplicatesResponse:
+    """Группы почти одинаковых изображений.
+
+    Изображения попадают в одну группу, если их перцептивные хеши связаны
+    цепочкой соседей на расстоянии не больше max_distance. Записи без
+    перцептивного хеша не учитываются. Крупные группы идут первыми.
+    """
+    groups = phash_index.clusters(max_distance)
+    shown = groups[:limit]
+    images = {
+        image.id: image
+        for image in metadata_store.get_many([image_id for ids in shown for image_id in ids])
+    }
+    clusters = []
+    for ids in shown:
+        members = [images[image_id] for image_id in ids if image_id in images]
+        clusters.append(DuplicateCluster(size=len(members), images=members))
+    return DuplicatesResponse(max_distance=max_distance, total_clusters=len(groups), clusters=clusters)
+
+
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete(
+    request: Optional[BulkRequest] = None,
+    query: ImageQuery = Depends(image_filters),
+) -> BulkResult:
+    """Массовое удаление файлов и метаданных.
+
+    Записи удаляются одной транзакцией хранилища, файлы без оставшихся
+    ссылок — конкурентно в пуле потоков. Без ids в теле удаляются все
+    записи, подходящие под фильтры запроса (например, ?processed=false
+    или ?uploaded_to=2024-01-01T00:00:00); без ids и фильтров — только
+    с {"all": true}.
+    """
+    ids = _bulk_ids(request, query)
+    deleted = metadata_store.delete_many(ids)
+    await _release_files(deleted)
+    logger.info("Массовое удаление: %d из %d", len(deleted), len(ids))
+    return _bulk_result(ids, {image.id for image in deleted}, "deleted")
+
+
+@router.post("/bulk/reprocess", response_model=BulkResult)
+async def bulk_reprocess(
+    request: Optional[BulkRequest] = None,
+    query: ImageQuery = Depends(image_filters),
+) -> BulkResult:
+    """Массовый сброс результатов для повторной обработки (одной транзакцией).
+
+    Без ids в теле сбрасываются записи, подходящие под фильтры запроса.
+    """
+    ids = _bulk_ids(request, query)
+    reset = metadata_store.reset_results_many(ids)
+    logger.info("Массовый сброс результатов: %d из %d", len(reset), len(ids))
+    return _bulk_result(ids, {image.id for image in reset}, "reset")
+
+
+@router.post("/bulk/recognize", response_model=BulkResult)
+async def bulk_recognize(
+    request: Optional[BulkRequest] = None,
+    query: ImageQuery = Depends(image_filters),
+) -> BulkResult:
+    """Массовое повторное распознавание.
+
+    Изображения распознаются конкурентно, результаты сохраняются одной
+    транзакцией. Без ids в теле распознаются записи, подходящие под
+    фильтры запроса. Для больших объёмов используйте POST /inference/jobs.
+    """
+    ids = _bulk_ids(request, query)
+    results = await recognition.recognize_bulk(ids)
+    items = [
+        BulkItemResult(id=item.id, status="recognized" if item.error is None else "failed", error=item.error)
+        for item in results
+    ]
+    succeeded = sum(1 for item in results if item.error is None)
+    logger.info("Массовое распознавание: %d из %d", succeeded, len(ids))
+    return BulkResult(requested=len(ids), succeeded=succeeded, failed=len(ids) - succeeded, items=items)
 
 
 @router.get("/{image_id}", response_model=ImageMetadata)
@@ -31,16 +240,74 @@ async def get_file(image_id: int) -> ImageMetadata:
     return image
 
 
+def _image_etag(image: ImageMetadata, size: str, stat: os.stat_result) -> str:
+    """Сильный ETag: блобы адресуются по SHA-256, их содержимое по пути не меняется."""
+    if image.sha256:
+        return f'"{image.sha256[:32]}-{size}-{stat.st_size:x}"'
+    return f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+@router.api_route("/{image_id}/image", methods=["GET", "HEAD"])
+async def get_image(
+    request: Request,
+    image_id: int,
+    size: Literal["original", "small", "medium", "large"] = Query(
+        "original", description="Оригинал или миниатюра (по длинной стороне: 160, 480, 1024 px)"
+    ),
+    v: Optional[str] = Query(None, description="Версия содержимого — префикс SHA-256 изображения"),
+) -> Response:
+    """Изображение или его миниатюра.
+
+    Поддерживаются условные запросы (ETag, If-None-Match → 304) и
+    диапазоны байт (Range, If-Range → 206). Если в v передан префикс
+    SHA-256 изображения, ответ кешируется как неизменяемый; иначе клиент
+    перепроверяет его по ETag.
+    """
+    image = metadata_store.get_by_id(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Изображение не найдено.")
+
+    if size == "original":
+        # mime_type записи угадан по имени файла и может не совпадать с содержимым блоба
+        path, media_type = image.path, file_storage.media_type(image.path)
+    else:
+        try:
+            path = await thumbnails.ensure(image.path, size)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Миниатюра недоступна.")
+        media_type = thumbnails.media_type()
+    try:
+        stat = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл изображения не найден.")
+
+    etag = _image_etag(image, size, stat)
+    modified_at = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    versioned = (
+        v is not None and len(v) >= _MIN_VERSION_LENGTH
+        and image.sha256 is not None and image.sha256.startswith(v)
+    )
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(modified_at, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if versioned else "no-cache",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if not_modified(request, etag, modified_at):
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = requested_range(request, etag, stat.st_size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+    return FileRangeResponse(path, stat.st_size, byte_range, headers=headers, media_type=media_type)
+
+
 @router.delete("/")
 async def delete_all_files() -> dict:
-    """Удаление всех файлов и их метаданных."""
-    images = metadata_store.get_all()
-    count = 0
-    for image in images:
-        if os.path.exists(image.path):
-            os.remove(image.path)
-        metadata_store.delete_by_id(image.id)
-        count += 1
+    """Удаление всех файлов и их метаданных (одной транзакцией хранилища)."""
+    deleted = metadata_store.delete_many(metadata_store.select_ids())
+    await _release_files(deleted)
+    count = len(deleted)
     logger.info("Удалено всех файлов: %d", count)
     return {"message": f"Удалено {count} файл(ов)."}
 
@@ -56,13 +323,9 @@ async def delete_file(image_id: int) -> dict:
     if not image:
         raise HTTPException(status_code=404, detail="Изображение не найдено.")
 
-    # Удаляем файл с диска
-    if os.path.exists(image.path):
-        os.remove(image.path)
-        logger.info("Удалён файл: %s", image.path)
-
-    # Удаляем метаданные
+    # Удаляем метаданные, затем файл — если на него больше нет ссылок
     metadata_store.delete_by_id(image_id)
+    await _release_file(image)
     return {"message": f"Файл '{image.filename}' удалён."}
 
 
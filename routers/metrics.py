@@ -0,0 +1,16 @@
+"""Эндпоинт метрик в формате Prometheus."""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from services import metrics
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Метрики приложения в текстовом формате Prometheus."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Метрики отключены (METRICS_ENABLED=false).")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,129 @@
+"""Общие HTTP-помощники: условные запросы, диапазоны байт и отдача файлов."""
+
+import os
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+import anyio
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+def not_modified(request: Request, etag: str, modified_at: Optional[datetime] = None) -> bool:
+    """Проверяет условные заголовки запроса (If-None-Match имеет приоритет)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and modified_at is not None:
+        try:
+            return modified_at <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def requested_range(request: Request, etag: str, size: int) -> Optional[tuple[int, int]]:
+    """Диапазон байт из заголовка Range (включительно) или None — отдать файл целиком.
+
+    Поддерживается один диапазон (bytes=a-b, bytes=a-, bytes=-n); несколько
+    диапазонов и некорректный заголовок обслуживаются целым файлом, как и
+    Range с If-Range, не совпадающим с текущим ETag.
+
+    Raises:
+        ValueError: Если диапазон лежит за пределами файла (ответ 416).
+    """
+    header = request.headers.get("range")
+    if header is None:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, separator, last = spec.strip().partition("-")
+    if (
+        not separator or not (first or last)
+        or (first and not first.isdigit()) or (last and not last.isdigit())
+    ):
+        return None
+    if not first:
+        # Последние n байт
+        if int(last) == 0:
+            raise ValueError("Пустой диапазон")
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("Диапазон за пределами файла")
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """Файл целиком или один диапазон байт.
+
+    Если ASGI-сервер поддерживает расширения http.response.pathsend или
+    http.response.zerocopysend, файл передаётся сервером без копирования
+    через Python (sendfile); иначе читается частями в пуле потоков.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        byte_range: Optional[tuple[int, int]] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        self.start, self.end = byte_range if byte_range is not None else (0, size - 1)
+        self.status_code = 206 if byte_range is not None else 200
+        self.full = byte_range is None
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        extensions = scope.get("extensions") or {}
+        if self.full and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            return
+        async with await anyio.open_file(self.path, "rb") as file:
+            count = self.end - self.start + 1
+            if "http.response.zerocopysend" in extensions:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.wrapped,
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+                return
+            await file.seek(self.start)
+            if count <= 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            while count > 0:
+                chunk = await file.read(min(self.chunk_size, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+            if count > 0:
+                # Файл укоротился во время отдачи: завершаем ответ
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,67 @@
+"""Эндпоинты поиска изображений по марке, модели и году."""
+
+from typing import Optional
+
+from fastapi import APIRouter, Query
+
+from models.schemas import SearchResponse, SearchResult, SearchSuggestion
+from services import search_index
+
+router = APIRouter(prefix="/search", tags=["Search"])
+
+MAX_RESULTS = 500
+
+
+@router.get("/", response_model=SearchResponse)
+async def search(
+    q: str = Query("", description="Марка, модель, год; последнее слово — префикс"),
+    make: Optional[str] = Query(None, description="Точная марка"),
+    year: Optional[int] = Query(None, description="Год модели"),
+    min_confidence: float = Query(0.0, ge=0, le=1, description="Минимальная уверенность предсказания"),
+    max_rank: Optional[int] = Query(None, ge=1, description="Учитывать первые N предсказаний (1 — только top-1)"),
+    limit: int = Query(50, ge=1, le=MAX_RESULTS, description="Размер страницы"),
+    offset: int = Query(0, ge=0, description="Смещение от начала результатов"),
+) -> SearchResponse:
+    """Поиск изображений по предсказанным меткам.
+
+    Ищутся все предсказания top-k каждого изображения; результаты
+    упорядочены по убыванию уверенности совпавшего предсказания, для
+    изображения возвращается лучшее совпадение.
+    """
+    hits = search_index.search(
+        q, make=make, year=year, min_confidence=min_confidence,
+        max_rank=max_rank, limit=limit + 1, offset=offset,
+    )
+    results = [
+        SearchResult(
+            id=hit.id,
+            label=hit.label.label,
+            make=hit.label.make,
+            model=hit.label.model,
+            year=hit.label.year,
+            confidence=hit.confidence,
+            rank=hit.rank,
+        )
+        for hit in hits[:limit]
+    ]
+    return SearchResponse(results=results, next_offset=offset + limit if len(hits) > limit else None)
+
+
+@router.get("/suggest", response_model=list[SearchSuggestion])
+async def suggest(
+    prefix: str = Query(..., min_length=1, description="Начало запроса"),
+    limit: int = Query(10, ge=1, le=50, description="Максимум подсказок"),
+) -> list[SearchSuggestion]:
+    """Автодополнение: метки, подходящие под начатый запрос, от частых к редким."""
+    return [
+        SearchSuggestion(
+            label=label.label, make=label.make, model=label.model, year=label.year, count=count,
+        )
+        for label, count in search_index.suggest(prefix, limit)
+    ]
+
+
+@router.get("/index")
+async def index_state() -> dict:
+    """Размер поискового индекса: метки, токены и вхождения."""
+    return search_index.get_state()
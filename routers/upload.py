@@ -1,13 +1,16 @@
 """Эндпоинты для загрузки изображений."""
 
+import asyncio
 import logging
 import os
-import shutil
+from functools import partial
+from typing import AsyncIterator, Optional, Union
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 
-from models.schemas import ImageMetadata, UploadResponse
-from services import image_processor, metadata_store
+from models.schemas import BatchInferenceItem, ImageMetadata, IngestResult, UploadResponse
+from services import file_storage, image_processor, metadata_store, recognition
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/upload", tags=["Upload"])
@@ -20,15 +23,121 @@ def _ensure_upload_dir() -> None:
     os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
+def _add_image(filename: str, stored: file_storage.StoredFile) -> ImageMetadata:
+    """Добавляет запись о сохранённом файле (под блокировкой его блоба)."""
+    return metadata_store.add_image(
+        filename=filename,
+        path=stored.path,
+        mime_type=image_processor.get_mime_type(filename),
+        size_bytes=stored.size_bytes,
+        sha256=stored.sha256,
+        phash=stored.phash,
+    )
+
+
+async def _store(file: UploadFile) -> ImageMetadata:
+    """Проверяет и сохраняет файл пакетной загрузки.
+
+    Raises:
+        file_storage.UploadRejected: С описанием причины, если файл отклонён.
+    """
+    if not file.filename:
+        raise file_storage.UploadRejected("Пропущен файл без имени.")
+
+    if not image_processor.validate_file_extension(file.filename):
+        raise file_storage.UploadRejected(f"{file.filename}: недопустимый формат.")
+
+    try:
+        return await file_storage.save_upload(file, UPLOAD_DIR, partial(_add_image, file.filename))
+    except file_storage.FileTooLargeError:
+        raise file_storage.UploadRejected(f"{file.filename}: превышен лимит размера.")
+    except file_storage.CorruptImageError:
+        raise file_storage.UploadRejected(f"{file.filename}: файл повреждён.")
+
+
+def _ndjson(result: IngestResult) -> str:
+    return result.model_dump_json() + "\n"
+
+
+async def _ingest_stream(files: list[UploadFile]) -> StreamingResponse:
+    """Конвейер «сохранение → распознавание» с потоковой выдачей результатов.
+
+    Каждый файл передаётся на распознавание сразу после сохранения, пока
+    следующие ещё проверяются и записываются на диск. Итог по каждому файлу
+    выдаётся отдельной строкой NDJSON: сначала отклонённые файлы, затем
+    результаты распознавания в порядке готовности.
+    """
+    stored_ids: asyncio.Queue[Optional[int]] = asyncio.Queue()
+    results: asyncio.Queue[Optional[BatchInferenceItem]] = asyncio.Queue()
+
+    async def pending_ids() -> AsyncIterator[int]:
+        while (image_id := await stored_ids.get()) is not None:
+            yield image_id
+
+    async def classify_stored() -> None:
+        try:
+            async for item in recognition.recognize_stream(pending_ids()):
+                results.put_nowait(item)
+        finally:
+            results.put_nowait(None)
+
+    pipeline = asyncio.create_task(classify_stored())
+    rejected: list[IngestResult] = []
+    filenames: dict[int, str] = {}
+    # Файлы сохраняются до возврата из обработчика: после него Starlette их закрывает
+    try:
+        for file in files:
+            try:
+                metadata = await _store(file)
+            except file_storage.UploadRejected as e:
+                rejected.append(IngestResult(filename=file.filename or "", error=str(e)))
+                continue
+            filenames[metadata.id] = metadata.filename
+            stored_ids.put_nowait(metadata.id)
+    except BaseException:
+        pipeline.cancel()
+        raise
+    stored_ids.put_nowait(None)
+
+    async def stream() -> AsyncIterator[str]:
+        processed = 0
+        try:
+            for result in rejected:
+                yield _ndjson(result)
+            while (item := await results.get()) is not None:
+                if item.error is None:
+                    processed += 1
+                yield _ndjson(IngestResult(
+                    filename=filenames.get(item.id, ""),
+                    id=item.id,
+                    predictions=item.predictions,
+                    error=item.error,
+                ))
+        finally:
+            # Клиент мог отключиться, не дочитав поток
+            pipeline.cancel()
+        logger.info(
+            "Загрузка с распознаванием: %d файлов, сохранено %d, распознано %d",
+            len(files), len(filenames), processed,
+        )
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @router.post("/", response_model=UploadResponse)
-async def upload_single(file: UploadFile = File(...)) -> UploadResponse:
+async def upload_single(
+    file: UploadFile = File(...),
+    classify: bool = Query(False, description="Сразу распознать и вернуть результат потоком NDJSON"),
+) -> Union[UploadResponse, StreamingResponse]:
     """Загрузка одного изображения.
 
     Args:
         file: Загружаемый файл.
+        classify: Распознать изображение сразу после сохранения.
 
     Returns:
-        Информация о загруженном файле.
+        Информация о загруженном файле либо поток NDJSON с результатом
+        распознавания (при classify=true).
     """
     _ensure_upload_dir()
 
@@ -41,82 +150,68 @@ async def upload_single(file: UploadFile = File(...)) -> UploadResponse:
             detail="Недопустимый формат файла. Допустимы: jpg, jpeg, png.",
         )
 
-    data = await file.read()
-
-    if not image_processor.validate_file_size(data):
+    try:
+        metadata = await file_storage.save_upload(file, UPLOAD_DIR, partial(_add_image, file.filename))
+    except file_storage.FileTooLargeError:
         raise HTTPException(
             status_code=400,
             detail=f"Файл слишком большой. Максимум: {image_processor.MAX_FILE_SIZE_MB} МБ.",
         )
-
-    if not image_processor.validate_image_integrity(data):
+    except file_storage.CorruptImageError:
         raise HTTPException(
             status_code=400,
             detail="Файл повреждён или не является изображением.",
         )
 
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(data)
+    logger.info("Загружен файл: %s (%d байт)", file.filename, metadata.size_bytes)
+    if classify:
+        return _classify_stored(metadata)
+    return UploadResponse(message="Файл успешно загружен.", files=[metadata])
 
-    mime_type = image_processor.get_mime_type(file.filename)
-    metadata = metadata_store.add_image(
-        filename=file.filename,
-        path=file_path,
-        mime_type=mime_type,
-        size_bytes=len(data),
-    )
 
-    logger.info("Загружен файл: %s (%d байт)", file.filename, len(data))
-    return UploadResponse(message="Файл успешно загружен.", files=[metadata])
+def _classify_stored(metadata: ImageMetadata) -> StreamingResponse:
+    """Распознаёт уже сохранённый файл и выдаёт результат строкой NDJSON."""
+
+    async def stream() -> AsyncIterator[str]:
+        item = await recognition.recognize_many([metadata.id])
+        yield _ndjson(IngestResult(
+            filename=metadata.filename,
+            id=metadata.id,
+            predictions=item[0].predictions,
+            error=item[0].error,
+        ))
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 @router.post("/batch", response_model=UploadResponse)
-async def upload_batch(files: list[UploadFile] = File(...)) -> UploadResponse:
+async def upload_batch(
+    files: list[UploadFile] = File(...),
+    classify: bool = Query(False, description="Распознавать файлы по мере сохранения, результаты — потоком NDJSON"),
+) -> Union[UploadResponse, StreamingResponse]:
     """Загрузка нескольких изображений.
 
     Args:
         files: Список загружаемых файлов.
+        classify: Передавать каждый файл на распознавание сразу после
+            сохранения и выдавать итог по файлам потоком NDJSON.
 
     Returns:
-        Информация о загруженных файлах.
+        Информация о загруженных файлах либо поток NDJSON (при classify=true).
     """
     _ensure_upload_dir()
 
+    if classify:
+        return await _ingest_stream(files)
+
     uploaded: list[ImageMetadata] = []
     errors: list[str] = []
 
     for file in files:
-        if not file.filename:
-            errors.append("Пропущен файл без имени.")
-            continue
-
-        if not image_processor.validate_file_extension(file.filename):
-            errors.append(f"{file.filename}: недопустимый формат.")
-            continue
-
-        data = await file.read()
-
-        if not image_processor.validate_file_size(data):
-            errors.append(f"{file.filename}: превышен лимит размера.")
-            continue
-
-        if not image_processor.validate_image_integrity(data):
-            errors.append(f"{file.filename}: файл повреждён.")
-            continue
-
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(data)
-
-        mime_type = image_processor.get_mime_type(file.filename)
-        metadata = metadata_store.add_image(
-            filename=file.filename,
-            path=file_path,
-            mime_type=mime_type,
-            size_bytes=len(data),
-        )
-        uploaded.append(metadata)
+        try:
+            uploaded.append(await _store(file))
+        except file_storage.UploadRejected as e:
+            errors.append(str(e))
 
     if not uploaded and errors:
         raise HTTPException(status_code=400, detail="; ".join(errors))
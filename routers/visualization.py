@@ -1,154 +1,170 @@
 """Эндпоинты для визуализации и экспорта результатов."""
 
-import csv
-import io
 import logging
-from collections import Counter
+import math
+import os
+from dataclasses import replace
+from email.utils import format_datetime
+from typing import Iterator, Literal
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 from models.schemas import StatsResponse
-from services import metadata_store
+from routers.filters import image_filters
+from routers.responses import not_modified
+from services import export, metadata_store, stats
+from services.storage import ImageQuery
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/visualization", tags=["Visualization"])
 
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
+# Размер порции потокового вывода отчёта, символов
+REPORT_CHUNK_CHARS = 16 * 1024
+
+# Шаблон компилируется один раз при импорте модуля
+_templates = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(["html"]),
+)
+_report_template = _templates.get_template("report.html")
+
 
 @router.get("/stats", response_model=StatsResponse)
 async def get_stats() -> StatsResponse:
-    """Получение статистики по загруженным файлам."""
-    all_files = metadata_store.get_all()
-    total = len(all_files)
-    processed = sum(1 for f in all_files if f.processed)
-    unprocessed = total - processed
-
-    # Подсчёт популярных марок (по top-1 предсказанию)
-    brand_counter: Counter = Counter()
-    for f in all_files:
-        if f.results and len(f.results) > 0:
-            brand_counter[f.results[0].label] += 1
-
-    top_brands = [
-        {"label": label, "count": count}
-        for label, count in brand_counter.most_common(10)
-    ]
-
-    return StatsResponse(
-        total_files=total,
-        processed_files=processed,
-        unprocessed_files=unprocessed,
-        top_brands=top_brands,
-    )
+    """Получение статистики по загруженным файлам.
 
+    Значения берутся из инкрементально поддерживаемых агрегатов и не
+    требуют чтения всех записей.
+    """
+    return StatsResponse(**stats.get_summary())
 
-@router.get("/export/csv")
-async def export_csv() -> StreamingResponse:
-    """Экспорт результатов в CSV-файл."""
-    all_files = metadata_store.get_all()
-    processed_files = [f for f in all_files if f.processed and f.results]
 
-    if not processed_files:
+@router.post("/stats/rebuild")
+async def rebuild_stats() -> dict:
+    """Перестроение агрегатов статистики с проверкой согласованности."""
+    result = stats.rebuild()
+    logger.info("Агрегаты статистики перестроены, согласованы: %s", result["consistent"])
+    return result
+
+
+def _export_query(query: ImageQuery) -> ImageQuery:
+    """Фильтры экспорта: по умолчанию только обработанные файлы."""
+    if query.processed is None:
+        query.processed = True
+    if not metadata_store.query_images(replace(query, limit=1))[0]:
         raise HTTPException(
             status_code=404,
             detail="Нет обработанных файлов для экспорта.",
         )
+    return query
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["filename", "top_prediction", "confidence", "all_predictions"])
 
-    for f in processed_files:
-        top = f.results[0]
-        all_preds = ", ".join(
-            f"{r.label} ({r.confidence})" for r in f.results
+@router.get("/export/csv")
+async def export_csv(
+    query: ImageQuery = Depends(image_filters),
+    gzip: bool = Query(False, description="Сжать файл gzip"),
+) -> StreamingResponse:
+    """Экспорт результатов в CSV-файл.
+
+    Записи читаются из хранилища порциями и сразу отдаются клиенту.
+    Поддерживаются те же фильтры, что и у списка файлов.
+    """
+    query = _export_query(query)
+    chunks = export.csv_chunks(metadata_store.iter_records(query))
+    if gzip:
+        return StreamingResponse(
+            export.gzip_chunks(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": "attachment; filename=results.csv.gz"},
         )
-        writer.writerow([f.filename, top.label, top.confidence, all_preds])
-
-    output.seek(0)
     return StreamingResponse(
-        iter([output.getvalue()]),
+        chunks,
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=results.csv"},
     )
 
 
+@router.get("/export/{fmt}")
+async def export_columnar(
+    fmt: Literal["parquet", "arrow"],
+    query: ImageQuery = Depends(image_filters),
+) -> StreamingResponse:
+    """Экспорт результатов в колоночном формате: Parquet или Arrow IPC (поток).
+
+    Требует пакета pyarrow. Поддерживаются те же фильтры, что и у списка файлов.
+    """
+    query = _export_query(query)
+    try:
+        chunks = export.columnar_chunks(metadata_store.iter_records(query), fmt)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    media_type = (
+        "application/vnd.apache.parquet" if fmt == "parquet"
+        else "application/vnd.apache.arrow.stream"
+    )
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=results.{fmt}"},
+    )
+
+
+def _render_chunks(context: dict) -> Iterator[str]:
+    """Отдаёт отрендеренный шаблон порциями около REPORT_CHUNK_CHARS символов."""
+    buffer: list[str] = []
+    size = 0
+    for piece in _report_template.generate(**context):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= REPORT_CHUNK_CHARS:
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
 @router.get("/report", response_class=HTMLResponse)
-async def visualization_page() -> HTMLResponse:
-    """HTML-страница с визуализацией результатов."""
-    all_files = metadata_store.get_all()
-    total = len(all_files)
-    processed = sum(1 for f in all_files if f.processed)
-
-    # Формируем строки таблицы
-    rows = ""
-    for f in all_files:
-        status = "Обработано" if f.processed else "Не обработано"
-        if f.results and len(f.results) > 0:
-            top_pred = f"{f.results[0].label} ({f.results[0].confidence})"
-        else:
-            top_pred = "—"
-        rows += f"""
-        <tr>
-            <td>{f.id}</td>
-            <td>{f.filename}</td>
-            <td>{status}</td>
-            <td>{top_pred}</td>
-            <td>{f.size_bytes} Б</td>
-        </tr>"""
-
-    html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Cars Recognizer — Отчёт</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }}
-        h1 {{ color: #333; }}
-        .stats {{ display: flex; gap: 20px; margin: 20px 0; }}
-        .stat-card {{ background: white; padding: 20px; border-radius: 8px;
-                      box-shadow: 0 2px 4px rgba(0,0,0,0.1); min-width: 150px; }}
-        .stat-card h3 {{ margin: 0 0 8px; color: #666; font-size: 14px; }}
-        .stat-card .value {{ font-size: 32px; font-weight: bold; color: #2196F3; }}
-        table {{ width: 100%; border-collapse: collapse; background: white;
-                 border-radius: 8px; overflow: hidden;
-                 box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-        th {{ background: #2196F3; color: white; padding: 12px; text-align: left; }}
-        td {{ padding: 10px 12px; border-bottom: 1px solid #eee; }}
-        tr:hover {{ background: #f0f7ff; }}
-    </style>
-</head>
-<body>
-    <h1>Cars Recognizer — Отчёт</h1>
-    <div class="stats">
-        <div class="stat-card">
-            <h3>Всего файлов</h3>
-            <div class="value">{total}</div>
-        </div>
-        <div class="stat-card">
-            <h3>Обработано</h3>
-            <div class="value">{processed}</div>
-        </div>
-        <div class="stat-card">
-            <h3>Не обработано</h3>
-            <div class="value">{total - processed}</div>
-        </div>
-    </div>
-    <table>
-        <thead>
-            <tr>
-                <th>ID</th>
-                <th>Файл</th>
-                <th>Статус</th>
-                <th>Предсказание</th>
-                <th>Размер</th>
-            </tr>
-        </thead>
-        <tbody>
-            {rows if rows else '<tr><td colspan="5" style="text-align:center;padding:20px;">Нет загруженных файлов</td></tr>'}
-        </tbody>
-    </table>
-</body>
-</html>"""
-    return HTMLResponse(content=html)
+async def visualization_page(
+    request: Request,
+    page: int = Query(1, ge=1, description="Номер страницы"),
+    per_page: int = Query(100, ge=1, le=500, description="Файлов на странице"),
+) -> Response:
+    """HTML-страница с визуализацией результатов.
+
+    Страница рендерится из шаблона потоком. ETag и Last-Modified
+    вычисляются по версии хранилища метаданных, поэтому для неизменённых
+    данных возвращается 304 без чтения записей и рендеринга.
+    """
+    version, modified_at = metadata_store.get_version()
+    modified_at = modified_at.replace(microsecond=0)
+    etag = f'"{version}-{page}-{per_page}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(modified_at, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if not_modified(request, etag, modified_at):
+        return Response(status_code=304, headers=headers)
+
+    summary = stats.get_summary(top_labels=0)
+    total = summary["total_files"]
+    pages = max(math.ceil(total / per_page), 1)
+    if page > pages:
+        raise HTTPException(status_code=404, detail="Страница не найдена.")
+    files, _ = metadata_store.query_images(
+        ImageQuery(limit=per_page, offset=(page - 1) * per_page)
+    )
+
+    context = {
+        "total": total,
+        "processed": summary["processed_files"],
+        "files": files,
+        "page": page,
+        "pages": pages,
+        "per_page": per_page,
+    }
+    return StreamingResponse(_render_chunks(context), media_type="text/html", headers=headers)
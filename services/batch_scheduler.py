@@ -0,0 +1,224 @@
+"""Планировщик пакетной обработки с ограничением параллелизма.
+
+Элементы пакета обрабатываются конкурентно, но не более чем
+max_in_flight одновременно. Лимит адаптивный (AIMD): при ответе 429
+он уменьшается вдвое и обработка приостанавливается на время из
+Retry-After (или на экспоненциально растущую паузу), а после серии
+успешных запросов лимит снова растёт на единицу.
+
+run_bounded обрабатывает заранее известный список фиксированным пулом
+из max_in_flight обработчиков, iter_bounded — элементы из асинхронного
+источника по мере их поступления. Освобождённый слот будит только
+столько ожидающих, сколько слотов свободно, поэтому накладные расходы
+планировщика линейны по числу элементов.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from services.hf_client import RateLimitError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_BACKOFF_BASE_SECONDS = 1.0
+_BACKOFF_MAX_SECONDS = 30.0
+
+
+@dataclass
+class BatchOutcome:
+    """Результат обработки одного элемента пакета."""
+    value: Any = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class AdaptiveLimiter:
+    """Адаптивный ограничитель числа одновременных запросов."""
+
+    def __init__(self, max_limit: int, min_limit: int = 1) -> None:
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.limit = self.max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._backoff = _BACKOFF_BASE_SECONDS
+        self._resume_at = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        """Ожидает свободный слот с учётом текущего лимита и паузы после 429."""
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            while True:
+                delay = self._resume_at - loop.time()
+                if delay <= 0 and self._in_flight < self.limit:
+                    break
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=delay if delay > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            self._in_flight += 1
+
+    async def release(
+        self,
+        success: bool = False,
+        rate_limited: bool = False,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        """Освобождает слот и корректирует лимит по исходу запроса."""
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            self._in_flight -= 1
+            if rate_limited:
+                self.limit = max(self.min_limit, self.limit // 2)
+                pause = retry_after if retry_after is not None else self._backoff
+                self._resume_at = max(self._resume_at, loop.time() + pause)
+                self._backoff = min(self._backoff * 2, _BACKOFF_MAX_SECONDS)
+                self._successes = 0
+                logger.warning(
+                    "Получен 429: лимит параллелизма снижен до %d, пауза %.1f с",
+                    self.limit, pause,
+                )
+            elif success:
+                self._backoff = _BACKOFF_BASE_SECONDS
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            # Будим по одному ожидающему на свободный слот, а не всех сразу:
+            # иначе каждое освобождение стоит O(число ожидающих)
+            free = self.limit - self._in_flight
+            if free > 0:
+                self._cond.notify(free)
+
+
+async def _process(
+    limiter: AdaptiveLimiter,
+    item: T,
+    worker: Callable[[T], Awaitable[Any]],
+    max_retries: int,
+) -> BatchOutcome:
+    """Обрабатывает один элемент с повторами после ответа 429."""
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        try:
+            value = await worker(item)
+        except RateLimitError as e:
+            await limiter.release(rate_limited=True, retry_after=e.retry_after)
+            attempt += 1
+            if attempt > max_retries:
+                return BatchOutcome(error=str(e))
+            continue
+        except Exception as e:
+            await limiter.release()
+            logger.error("Ошибка обработки элемента пакета %r: %s", item, str(e))
+            return BatchOutcome(error=str(e))
+        await limiter.release(success=True)
+        return BatchOutcome(value=value)
+
+
+async def run_bounded(
+    items: list[T],
+    worker: Callable[[T], Awaitable[Any]],
+    max_in_flight: int,
+    max_retries: int = 3,
+    on_result: Optional[Callable[[int, BatchOutcome], None]] = None,
+) -> list[BatchOutcome]:
+    """Обрабатывает элементы конкурентно с адаптивным ограничением.
+
+    Args:
+        items: Элементы пакета.
+        worker: Корутина обработки одного элемента.
+        max_in_flight: Максимальное число одновременных вызовов worker.
+        max_retries: Число повторов элемента после ответа 429.
+        on_result: Вызывается с индексом и результатом элемента по мере готовности.
+
+    Returns:
+        Результаты в порядке входных элементов; ошибки не отбрасываются,
+        а возвращаются в поле error соответствующего элемента.
+    """
+    limiter = AdaptiveLimiter(max_in_flight)
+    outcomes: list[BatchOutcome] = [BatchOutcome() for _ in items]
+    pending = iter(enumerate(items))
+
+    async def run_worker() -> None:
+        # Обработчики разбирают общий итератор: корутин столько, сколько
+        # слотов, а не по одной на элемент
+        for index, item in pending:
+            outcomes[index] = await _process(limiter, item, worker, max_retries)
+            if on_result is not None:
+                on_result(index, outcomes[index])
+
+    await asyncio.gather(*(run_worker() for _ in range(min(limiter.max_limit, len(items)))))
+    return outcomes
+
+
+async def iter_bounded(
+    items: AsyncIterable[T],
+    worker: Callable[[T], Awaitable[Any]],
+    max_in_flight: int,
+    max_retries: int = 3,
+) -> AsyncIterator[tuple[T, BatchOutcome]]:
+    """Обрабатывает элементы по мере их поступления и выдаёт результаты по готовности.
+
+    В отличие от run_bounded, элементы не обязаны быть известны заранее:
+    обработка очередного элемента начинается сразу, как только источник
+    его выдал, параллельно с получением следующих.
+
+    Args:
+        items: Асинхронный источник элементов.
+        worker: Корутина обработки одного элемента.
+        max_in_flight: Максимальное число одновременных вызовов worker.
+        max_retries: Число повторов элемента после ответа 429.
+
+    Yields:
+        Пары (элемент, результат) в порядке завершения.
+    """
+    limiter = AdaptiveLimiter(max_in_flight)
+    done: asyncio.Queue = asyncio.Queue()
+    tasks: set[asyncio.Task] = set()
+
+    async def run_one(item: T) -> None:
+        outcome = await _process(limiter, item, worker, max_retries)
+        done.put_nowait(("result", (item, outcome)))
+
+    async def feed() -> None:
+        count = 0
+        try:
+            async for item in items:
+                task = asyncio.create_task(run_one(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                count += 1
+        except Exception as e:
+            done.put_nowait(("error", e))
+            return
+        done.put_nowait(("fed", count))
+
+    feeder = asyncio.create_task(feed())
+    expected: Optional[int] = None
+    received = 0
+    try:
+        while expected is None or received < expected:
+            kind, payload = await done.get()
+            if kind == "fed":
+                expected = payload
+            elif kind == "error":
+                raise payload
+            else:
+                received += 1
+                yield payload
+    finally:
+        # Потребитель мог прекратить чтение досрочно (например, клиент отключился)
+        feeder.cancel()
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(feeder, *tasks, return_exceptions=True)
@@ -0,0 +1,71 @@
+"""Выбор бэкенда классификации изображений.
+
+Бэкенд задаётся переменной окружения CLASSIFIER_BACKEND:
+hf (по умолчанию) — Hugging Face Inference API, onnx/torch/dummy —
+локальный CPU-инференс (services.local_inference), работающий без сети.
+"""
+
+import logging
+import os
+
+from models.schemas import Prediction
+from services import hf_client, metrics
+
+logger = logging.getLogger(__name__)
+
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "hf")
+
+_CLASSIFY_SECONDS = metrics.histogram(
+    "classifier_duration_seconds", "Длительность классификации одного изображения", ("backend",)
+)
+
+
+def is_local() -> bool:
+    """Возвращает True, если используется локальная модель."""
+    return CLASSIFIER_BACKEND != "hf"
+
+
+def _local():
+    """Импортирует модуль локального инференса (numpy/Pillow нужны только ему)."""
+    from services import local_inference
+
+    return local_inference
+
+
+async def startup() -> None:
+    """Подготавливает выбранный бэкенд при старте приложения."""
+    if is_local():
+        _local().load(CLASSIFIER_BACKEND)
+    else:
+        await hf_client.startup()
+    logger.info("Бэкенд классификации: %s", CLASSIFIER_BACKEND)
+
+
+async def shutdown() -> None:
+    """Освобождает ресурсы бэкенда при остановке приложения."""
+    if is_local():
+        await _local().unload()
+    await hf_client.shutdown()
+
+
+def get_batcher_stats() -> dict:
+    """Возвращает статистику микробатчера локальной модели (пусто для hf)."""
+    return _local().get_batcher_stats() if is_local() else {}
+
+
+async def classify_image(image_path: str) -> list[Prediction]:
+    """Классифицирует изображение выбранным бэкендом.
+
+    Args:
+        image_path: Путь к файлу изображения.
+
+    Returns:
+        Список из top-3 предсказаний, отсортированных по убыванию confidence.
+
+    Raises:
+        RuntimeError: При ошибке распознавания.
+    """
+    with _CLASSIFY_SECONDS.labels(CLASSIFIER_BACKEND).time():
+        if is_local():
+            return await _local().classify_image(image_path)
+        return await hf_client.classify_image(image_path)
@@ -0,0 +1,165 @@
+"""Потоковый экспорт результатов распознавания.
+
+Записи читаются из хранилища страницами и сразу кодируются в выходной
+формат, поэтому память не растёт с размером архива. CSV можно сжимать
+gzip на лету; колоночные форматы Parquet и Arrow IPC (для загрузки в
+pandas) требуют пакета pyarrow и пишутся группами строк.
+"""
+
+import csv
+import io
+import logging
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Число строк в одной порции вывода (и в группе строк Parquet)
+CHUNK_ROWS = 1000
+
+CSV_HEADER = ["filename", "top_prediction", "confidence", "all_predictions"]
+
+
+def _batches(records: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    batch: list[dict] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(records: Iterable[dict]) -> Iterator[bytes]:
+    """Кодирует записи в CSV порциями по CHUNK_ROWS строк."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for batch in _batches(records, CHUNK_ROWS):
+        for record in batch:
+            results = record.get("results") or []
+            top = results[0] if results else {"label": "", "confidence": ""}
+            all_preds = ", ".join(f"{r['label']} ({r['confidence']})" for r in results)
+            writer.writerow([record["filename"], top["label"], top["confidence"], all_preds])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Сжимает поток порций в формат gzip на лету."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    """Приёмник для писателей pyarrow: копит байты до выдачи и считает позицию."""
+
+    closed = False
+
+    def __init__(self) -> None:
+        self._parts: list[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Для экспорта в Parquet/Arrow установите пакет pyarrow.")
+    return pa
+
+
+def columnar_chunks(records: Iterable[dict], fmt: str) -> Iterator[bytes]:
+    """Кодирует записи в Parquet или Arrow IPC (поток) группами по CHUNK_ROWS строк.
+
+    Args:
+        records: Записи в формате бэкенда.
+        fmt: "parquet" или "arrow".
+
+    Raises:
+        RuntimeError: Если pyarrow не установлен (проверяется до начала выдачи).
+    """
+    pa = _import_pyarrow()
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("filename", pa.string()),
+        ("upload_date", pa.timestamp("us")),
+        ("processed", pa.bool_()),
+        ("top_label", pa.string()),
+        ("top_confidence", pa.float64()),
+        ("labels", pa.list_(pa.string())),
+        ("confidences", pa.list_(pa.float64())),
+        ("mime_type", pa.string()),
+        ("size_bytes", pa.int64()),
+        ("sha256", pa.string()),
+    ])
+
+    def to_batch(batch: list[dict]):
+        columns: dict[str, list] = {name: [] for name in schema.names}
+        for record in batch:
+            results = record.get("results") or []
+            columns["id"].append(record["id"])
+            columns["filename"].append(record["filename"])
+            columns["upload_date"].append(datetime.fromisoformat(str(record["upload_date"])))
+            columns["processed"].append(bool(record.get("processed")))
+            columns["top_label"].append(results[0]["label"] if results else None)
+            columns["top_confidence"].append(results[0]["confidence"] if results else None)
+            columns["labels"].append([r["label"] for r in results])
+            columns["confidences"].append([r["confidence"] for r in results])
+            columns["mime_type"].append(record["mime_type"])
+            columns["size_bytes"].append(record["size_bytes"])
+            columns["sha256"].append(record.get("sha256"))
+        return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+    def generate() -> Iterator[bytes]:
+        sink = _ChunkSink()
+        if fmt == "parquet":
+            writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        rows = 0
+        for batch in _batches(records, CHUNK_ROWS):
+            if fmt == "parquet":
+                writer.write_table(pa.Table.from_batches([to_batch(batch)]))
+            else:
+                writer.write_batch(to_batch(batch))
+            rows += len(batch)
+            data = sink.drain()
+            if data:
+                yield data
+        writer.close()
+        yield sink.drain()
+        logger.info("Экспорт %s: %d строк", fmt, rows)
+
+    return generate()
@@ -0,0 +1,361 @@
+"""Потоковое сохранение загружаемых файлов в контентно-адресуемое хранилище.
+
+Файл читается частями фиксированного размера: лимит размера проверяется
+по мере поступления данных (с досрочным прерыванием), магические байты —
+по первой части, SHA-256 считается инкрементально. Пиковая память на одну
+загрузку ограничена размером части независимо от размера файла.
+
+Файлы хранятся под своим SHA-256 в шардированных каталогах
+(<UPLOAD_DIR>/ab/cd/<sha256>.jpg), поэтому одинаковое содержимое лежит на
+диске один раз. Записи метаданных ссылаются на блоб по хешу; блоб
+удаляется, когда удалена последняя ссылающаяся на него запись. Запись
+идёт во временный файл в пуле потоков, не блокируя event loop, после чего
+файл атомарно переименовывается.
+
+Для сохранённого файла вычисляется перцептивный хеш (поиск почти
+одинаковых изображений, services.phash_index) и ставится в фоновый пул
+создание миниатюр (services.thumbnails); миниатюры удаляются вместе с блобом.
+При повторной загрузке того же содержимого хеш берётся из записи, уже
+ссылающейся на блоб, а миниатюры не создаются заново.
+
+Проверка наличия блоба с добавлением записи и подсчёт ссылок с удалением
+блоба выполняются под блокировкой каталога блоба (flock на файл .lock,
+общий для всех воркеров; без fcntl — в пределах процесса), поэтому блоб
+не удаляется между проверкой и добавлением ссылающейся на него записи.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from fastapi import UploadFile
+
+from services import image_processor, metadata_store, metrics, thumbnails
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+_UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Принятые байты загрузок")
+_UPLOAD_SIZE = metrics.histogram(
+    "upload_size_bytes", "Размер принятых файлов", buckets=metrics.SIZE_BUCKETS
+)
+_SCAN_SECONDS = metrics.histogram(
+    "upload_validation_duration_seconds", "Проверка и хеширование загружаемого файла"
+)
+_WRITE_SECONDS = metrics.histogram(
+    "upload_write_duration_seconds", "Запись загружаемого файла на диск"
+)
+_UPLOADS = metrics.counter("uploads_total", "Загрузки по исходу", ("result",))
+_PHASH_SECONDS = metrics.histogram(
+    "upload_phash_duration_seconds", "Вычисление перцептивного хеша загруженного файла"
+)
+
+# Пул потоков для удаления файлов при массовых операциях
+REMOVE_THREADS = 8
+_remove_pool = ThreadPoolExecutor(max_workers=REMOVE_THREADS, thread_name_prefix="file-remove")
+
+# MIME-типы блобов по расширению (.jpeg — файлы, сохранённые до контентной адресации)
+_MEDIA_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+# Файл блокировки в каталоге шарда: одна блокировка на блобы каталога
+_LOCK_NAME = ".lock"
+# Без fcntl блокировка действует только внутри процесса
+_local_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+class UploadRejected(ValueError):
+    """Загружаемый файл не прошёл проверку."""
+
+
+class FileTooLargeError(UploadRejected):
+    """Размер файла превышает MAX_FILE_SIZE_BYTES."""
+
+
+class CorruptImageError(UploadRejected):
+    """Файл повреждён или не является изображением."""
+
+
+@dataclass
+class StoredFile:
+    """Сохранённый на диск файл."""
+    path: str
+    size_bytes: int
+    sha256: str
+    deduplicated: bool = False
+    phash: Optional[str] = None
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_if_exists(path: str) -> bool:
+    """Удаляет файл и его миниатюры; возвращает, был ли файл."""
+    try:
+        os.remove(path)
+        removed = True
+    except FileNotFoundError:
+        removed = False
+    # Миниатюры — после оригинала: фоновая генерация проверяет оригинал
+    # после записи миниатюры, поэтому записанная сейчас будет удалена здесь или ею
+    for derived in thumbnails.derived_paths(path):
+        _remove_quietly(derived)
+    return removed
+
+
+def _lock_blob(path: str) -> int:
+    """Захватывает блокировку каталога блоба, дожидаясь её освобождения."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(os.path.join(directory, _LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        _local_lock.acquire()
+    return fd
+
+
+def _unlock_blob(fd: int) -> None:
+    if fcntl is None:
+        _local_lock.release()
+    # Закрытие файла снимает flock
+    os.close(fd)
+
+
+@contextmanager
+def _blob_locked(path: str) -> Iterator[None]:
+    fd = _lock_blob(path)
+    try:
+        yield
+    finally:
+        _unlock_blob(fd)
+
+
+@asynccontextmanager
+async def _blob_locked_async(path: str) -> AsyncIterator[None]:
+    """Блокировка каталога блоба для корутины: ожидание — в пуле потоков."""
+    acquiring = asyncio.ensure_future(asyncio.to_thread(_lock_blob, path))
+    try:
+        fd = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # Поток всё равно дождётся блокировки: снимаем её сразу после захвата
+        def unlock(done: asyncio.Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                _unlock_blob(done.result())
+
+        acquiring.add_done_callback(unlock)
+        raise
+    try:
+        yield
+    finally:
+        _unlock_blob(fd)
+
+
+def _extension(first_chunk: bytes) -> str:
+    """Определяет расширение блоба по магическим байтам."""
+    return ".png" if first_chunk[:4] == b"\x89PNG" else ".jpg"
+
+
+def media_type(path: str) -> str:
+    """MIME-тип файла по расширению блоба (выбранному по магическим байтам, а не по имени загрузки)."""
+    ext = os.path.splitext(path)[1].lower()
+    return _MEDIA_TYPES.get(ext, "application/octet-stream")
+
+
+async def _phash(path: str) -> Optional[str]:
+    """Перцептивный хеш сохранённого файла или None, если изображение не декодируется."""
+    try:
+        with _PHASH_SECONDS.time():
+            return await image_processor.perceptual_hash_async(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось вычислить перцептивный хеш %s: %s", path, str(e))
+        return None
+
+
+def blob_path(upload_dir: str, sha256: str, ext: str) -> str:
+    """Возвращает путь блоба: <upload_dir>/<ab>/<cd>/<sha256><ext>."""
+    return os.path.join(upload_dir, sha256[:2], sha256[2:4], f"{sha256}{ext}")
+
+
+async def _scan(file: UploadFile) -> tuple[int, str, str]:
+    """Первый проход: проверка магических байт и размера, подсчёт SHA-256.
+
+    Returns:
+        Размер, хеш и расширение по содержимому.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    ext = ""
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if size == 0:
+            if not image_processor.validate_image_integrity(chunk):
+                raise CorruptImageError(file.filename)
+            ext = _extension(chunk)
+        size += len(chunk)
+        if size > image_processor.MAX_FILE_SIZE_BYTES:
+            raise FileTooLargeError(file.filename)
+        hasher.update(chunk)
+    if size == 0:
+        raise CorruptImageError(file.filename)
+    return size, hasher.hexdigest(), ext
+
+
+async def _write(file: UploadFile, dest_path: str) -> Optional[str]:
+    """Второй проход: запись во временный файл и атомарное переименование.
+
+    Перцептивный хеш считается по временному файлу до переименования:
+    если обработка прервётся, на диске не останется блоба без записи.
+
+    Returns:
+        Перцептивный хеш файла или None.
+    """
+    await asyncio.to_thread(os.makedirs, os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    out = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        with _WRITE_SECONDS.time():
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                await asyncio.to_thread(out.write, chunk)
+            await asyncio.to_thread(out.close)
+        phash = await _phash(tmp_path)
+        await asyncio.to_thread(os.replace, tmp_path, dest_path)
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(_remove_quietly, tmp_path)
+        raise
+    return phash
+
+
+async def save_upload(
+    file: UploadFile, upload_dir: str, register: Callable[[StoredFile], T]
+) -> T:
+    """Потоково сохраняет загружаемый файл в контентно-адресуемое хранилище.
+
+    Файл сохраняется под своим SHA-256 (blob_path). Если блоб с таким
+    содержимым уже есть, запись на диск не выполняется.
+
+    Args:
+        file: Загружаемый файл.
+        upload_dir: Корень хранилища.
+        register: Добавляет запись, ссылающуюся на сохранённый файл.
+            Вызывается под блокировкой блоба, поэтому release не удалит
+            блоб между проверкой его наличия и добавлением записи.
+
+    Returns:
+        Результат register.
+
+    Raises:
+        FileTooLargeError: Если превышен лимит размера.
+        CorruptImageError: Если магические байты не соответствуют изображению.
+    """
+    try:
+        with _SCAN_SECONDS.time():
+            size, sha256, ext = await _scan(file)
+    except FileTooLargeError:
+        _UPLOADS.labels("too_large").inc()
+        raise
+    except CorruptImageError:
+        _UPLOADS.labels("corrupt").inc()
+        raise
+    _UPLOAD_BYTES.inc(size)
+    _UPLOAD_SIZE.observe(size)
+
+    path = blob_path(upload_dir, sha256, ext)
+    async with _blob_locked_async(path):
+        if await asyncio.to_thread(os.path.exists, path):
+            logger.info("Содержимое уже хранится (sha256=%s...), запись пропущена", sha256[:12])
+            _UPLOADS.labels("deduplicated").inc()
+            existing = await asyncio.to_thread(metadata_store.get_by_hash, sha256)
+            if existing is not None:
+                phash = existing.phash
+            else:
+                # Блоб без записей (например, остался после сбоя): хеш и миниатюры заново
+                phash = await _phash(path)
+                thumbnails.schedule(path)
+            stored = StoredFile(path=path, size_bytes=size, sha256=sha256, deduplicated=True, phash=phash)
+        else:
+            await file.seek(0)
+            phash = await _write(file, path)
+            _UPLOADS.labels("stored").inc()
+            thumbnails.schedule(path)
+            stored = StoredFile(path=path, size_bytes=size, sha256=sha256, phash=phash)
+        return register(stored)
+
+
+def _release(path: str, sha256: Optional[str]) -> bool:
+    """Удаляет файл, если на его содержимое не ссылается ни одна запись."""
+    if not sha256:
+        return _remove_if_exists(path)
+    with _blob_locked(path):
+        if metadata_store.count_by_hash(sha256) > 0:
+            return False
+        return _remove_if_exists(path)
+
+
+async def release(path: str, sha256: Optional[str]) -> bool:
+    """Удаляет файл изображения, если на него больше не ссылается ни одна запись.
+
+    Ссылки считаются под блокировкой блоба, поэтому загрузка того же
+    содержимого не добавит запись между подсчётом и удалением.
+
+    Args:
+        path: Путь к файлу.
+        sha256: Хеш содержимого (None для файлов, сохранённых до перехода
+            на контентную адресацию — они принадлежат одной записи).
+
+    Returns:
+        True если файл был удалён.
+    """
+    if not await asyncio.to_thread(_release, path, sha256):
+        return False
+    logger.info("Удалён файл: %s", path)
+    return True
+
+
+async def release_many(files: list[tuple[str, Optional[str]]]) -> dict[str, bool]:
+    """Удаляет файлы, на содержимое которых больше нет ссылок, конкурентно в пуле потоков.
+
+    Args:
+        files: Пары (путь к файлу, хеш содержимого или None), см. release.
+
+    Returns:
+        Путь -> признак того, что файл был удалён; ошибки удаления
+        логируются, а файл считается не удалённым.
+    """
+    loop = asyncio.get_running_loop()
+    unique = list(dict.fromkeys(files))
+    outcomes = await asyncio.gather(
+        *(loop.run_in_executor(_remove_pool, _release, path, sha256) for path, sha256 in unique),
+        return_exceptions=True,
+    )
+    removed = {}
+    for (path, _), outcome in zip(unique, outcomes):
+        if isinstance(outcome, OSError):
+            logger.error("Не удалось удалить файл %s: %s", path, str(outcome))
+        removed[path] = outcome is True
+    logger.info("Удалено файлов: %d из %d", sum(removed.values()), len(unique))
+    return removed
@@ -2,26 +2,159 @@
 
 import asyncio
 import hashlib
+import json
 import logging
 import os
+import time
 from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Optional
 
 import aiohttp
 
 from models.schemas import Prediction
+from services import image_processor, metrics, prediction_cache
+from services.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
 default_model = "google/vit-base-patch16-224"
 
-API_URL = f"https://router.huggingface.co/hf-inference/models/{os.getenv('HF_MODEL', default_model)}"
+MODEL_ID = os.getenv("HF_MODEL", default_model)
+API_URL = os.getenv("HF_API_URL", f"https://router.huggingface.co/hf-inference/models/{MODEL_ID}")
 API_TOKEN = os.getenv("HF_API_TOKEN", "")
 TIMEOUT_SECONDS = 30
 
+# Параметры общего пула соединений
+HF_POOL_SIZE = int(os.getenv("HF_POOL_SIZE", "100"))
+HF_POOL_PER_HOST = int(os.getenv("HF_POOL_PER_HOST", "32"))
+HF_KEEPALIVE_SECONDS = float(os.getenv("HF_KEEPALIVE_SECONDS", "30"))
+HF_DNS_CACHE_TTL = int(os.getenv("HF_DNS_CACHE_TTL", "300"))
+
+# Повторы при 5xx, таймаутах и ошибках соединения
+HF_RETRY_MAX_ATTEMPTS = int(os.getenv("HF_RETRY_MAX_ATTEMPTS", "4"))
+HF_RETRY_BASE_SECONDS = float(os.getenv("HF_RETRY_BASE_SECONDS", "0.5"))
+HF_RETRY_MAX_SECONDS = float(os.getenv("HF_RETRY_MAX_SECONDS", "20"))
+HF_RETRY_DEADLINE_SECONDS = float(os.getenv("HF_RETRY_DEADLINE_SECONDS", "60"))
+# Выключатель: порог подряд идущих отказов и время до пробной попытки
+HF_BREAKER_FAILURE_THRESHOLD = int(os.getenv("HF_BREAKER_FAILURE_THRESHOLD", "5"))
+HF_BREAKER_RESET_SECONDS = float(os.getenv("HF_BREAKER_RESET_SECONDS", "30"))
+# Отдавать устаревшие (по TTL) записи персистентного кеша, пока API недоступен
+HF_SERVE_STALE = os.getenv("HF_SERVE_STALE", "true").lower() in ("1", "true", "yes")
+
+# Общая для процесса сессия; создаётся в lifespan приложения (или лениво)
+_session: Optional[aiohttp.ClientSession] = None
+# Запросы к API, выполняющиеся прямо сейчас: ключ — SHA-256 хеш файла.
+# Конкурентные вызовы для одинакового содержимого ждут один общий запрос.
+_inflight: dict[str, asyncio.Future] = {}
+_coalescing_stats = {"upstream_requests": 0, "coalesced_requests": 0}
+
+_pool_stats = {
+    "connections_created": 0,
+    "connections_reused": 0,
+    "queued_requests": 0,
+    "queue_wait_total_seconds": 0.0,
+    "queue_wait_max_seconds": 0.0,
+}
+
 # In-memory кеш результатов: ключ — SHA-256 хеш файла, значение — список предсказаний.
+# Промахи проверяются во втором, персистентном уровне (services.prediction_cache).
 _CACHE_MAX_SIZE = 128
 _cache: OrderedDict[str, list[Prediction]] = OrderedDict()
 
+_retry_policy = RetryPolicy(
+    max_attempts=HF_RETRY_MAX_ATTEMPTS,
+    base_seconds=HF_RETRY_BASE_SECONDS,
+    max_seconds=HF_RETRY_MAX_SECONDS,
+    deadline_seconds=HF_RETRY_DEADLINE_SECONDS,
+)
+_breaker = CircuitBreaker("HF API", HF_BREAKER_FAILURE_THRESHOLD, HF_BREAKER_RESET_SECONDS)
+
+_CLASSIFY_SECONDS = metrics.histogram(
+    "hf_classify_duration_seconds",
+    "Длительность classify_image по пути обслуживания запроса",
+    ("path",),
+)
+_UPSTREAM_SECONDS = metrics.histogram(
+    "hf_upstream_request_duration_seconds",
+    "Ожидание ответа HF API по HTTP-статусу",
+    ("status",),
+)
+_RETRY_WAIT_SECONDS = metrics.counter(
+    "hf_retry_wait_seconds_total", "Суммарное время ожидания перед повторами запросов к HF API"
+)
+_RETRIES = metrics.counter(
+    "hf_retries_total", "Повторы запросов к HF API по причине", ("reason",)
+)
+_BREAKER_REJECTIONS = metrics.counter(
+    "hf_circuit_rejections_total", "Вызовы, отклонённые разомкнутым выключателем HF API"
+)
+_STALE_SERVED = metrics.counter(
+    "hf_stale_predictions_served_total", "Устаревшие предсказания из кеша, отданные при недоступности API"
+)
+metrics.gauge(
+    "hf_circuit_state",
+    "Состояние выключателя HF API: 0 — замкнут, 1 — пробная попытка, 2 — разомкнут",
+    callback=lambda: {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1}.get(_breaker.state, 2),
+)
+_CACHE_LOOKUPS = metrics.counter(
+    "prediction_cache_lookups_total", "Обращения к кешу предсказаний", ("tier", "result")
+)
+metrics.gauge(
+    "hf_inflight_requests",
+    "Выполняющиеся запросы к HF API (после объединения одинаковых)",
+    callback=lambda: len(_inflight),
+)
+
+
+def _cache_hit_ratio() -> float:
+    # Каждый запрос сначала проверяет in-memory уровень, поэтому его обращения — знаменатель
+    lookups = _CACHE_LOOKUPS.get("memory", "hit") + _CACHE_LOOKUPS.get("memory", "miss")
+    hits = _CACHE_LOOKUPS.get("memory", "hit") + _CACHE_LOOKUPS.get("persistent", "hit")
+    return hits / lookups if lookups else 0.0
+
+
+metrics.gauge(
+    "prediction_cache_hit_ratio",
+    "Доля запросов распознавания, обслуженных из кеша (любого уровня)",
+    callback=_cache_hit_ratio,
+)
+
+
+class RateLimitError(RuntimeError):
+    """API ответил 429: превышен лимит запросов.
+
+    Attributes:
+        retry_after: Рекомендованная пауза из заголовка Retry-After (секунды) или None.
+    """
+
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamError(RuntimeError):
+    """Временный отказ API (5xx, таймаут, ошибка соединения), который имеет смысл повторить.
+
+    Attributes:
+        retry_after: Рекомендованная пауза перед повтором (секунды) или None.
+    """
+
+    def __init__(self, message: str, reason: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """Разбирает заголовок Retry-After, заданный в секундах."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
 
 def _compute_file_hash(data: bytes) -> str:
     """Вычисляет SHA-256 хеш содержимого файла."""
@@ -45,6 +178,132 @@ def _put_cache(file_hash: str, predictions: list[Prediction]) -> None:
         _cache.popitem(last=False)
 
 
+async def _on_queued_start(
+    session: aiohttp.ClientSession, ctx: SimpleNamespace, params: aiohttp.TraceConnectionQueuedStartParams
+) -> None:
+    ctx.queued_at = asyncio.get_running_loop().time()
+
+
+async def _on_queued_end(
+    session: aiohttp.ClientSession, ctx: SimpleNamespace, params: aiohttp.TraceConnectionQueuedEndParams
+) -> None:
+    wait = asyncio.get_running_loop().time() - ctx.queued_at
+    _pool_stats["queued_requests"] += 1
+    _pool_stats["queue_wait_total_seconds"] += wait
+    _pool_stats["queue_wait_max_seconds"] = max(_pool_stats["queue_wait_max_seconds"], wait)
+
+
+async def _on_connection_create_end(
+    session: aiohttp.ClientSession, ctx: SimpleNamespace, params: aiohttp.TraceConnectionCreateEndParams
+) -> None:
+    _pool_stats["connections_created"] += 1
+
+
+async def _on_connection_reuse(
+    session: aiohttp.ClientSession, ctx: SimpleNamespace, params: aiohttp.TraceConnectionReuseconnParams
+) -> None:
+    _pool_stats["connections_reused"] += 1
+
+
+def _create_session() -> aiohttp.ClientSession:
+    """Создаёт сессию с пулом keep-alive соединений и кешем DNS."""
+    connector = aiohttp.TCPConnector(
+        limit=HF_POOL_SIZE,
+        limit_per_host=HF_POOL_PER_HOST,
+        keepalive_timeout=HF_KEEPALIVE_SECONDS,
+        use_dns_cache=True,
+        ttl_dns_cache=HF_DNS_CACHE_TTL,
+    )
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(_on_queued_start)
+    trace_config.on_connection_queued_end.append(_on_queued_end)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuse)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=TIMEOUT_SECONDS),
+        trace_configs=[trace_config],
+    )
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Возвращает общую сессию, создавая её при первом обращении."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+async def startup() -> None:
+    """Создаёт общую сессию при старте приложения."""
+    _get_session()
+    logger.info(
+        "Пул соединений HF API: limit=%d, per_host=%d, keepalive=%.0f с",
+        HF_POOL_SIZE, HF_POOL_PER_HOST, HF_KEEPALIVE_SECONDS,
+    )
+
+
+async def shutdown() -> None:
+    """Закрывает общую сессию, все соединения пула и персистентный кеш."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    prediction_cache.close()
+
+
+def get_pool_stats() -> dict:
+    """Возвращает метрики пула соединений для подбора его размера."""
+    stats = dict(_pool_stats)
+    queued = stats["queued_requests"]
+    stats["queue_wait_avg_seconds"] = stats["queue_wait_total_seconds"] / queued if queued else 0.0
+    stats.update(limit=HF_POOL_SIZE, limit_per_host=HF_POOL_PER_HOST, open_connections=0,
+                 idle_connections=0, active_connections=0)
+    if _session is None or _session.closed:
+        return stats
+    connector = _session.connector
+    # У TCPConnector нет публичного API для состояния пула — читаем внутренние структуры
+    idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    active = len(getattr(connector, "_acquired", ()))
+    stats.update(open_connections=idle + active, idle_connections=idle, active_connections=active)
+    return stats
+
+
+def get_cache_stats() -> dict:
+    """Возвращает статистику обоих уровней кеша предсказаний."""
+    return {
+        "memory": {"entries": len(_cache), "max_entries": _CACHE_MAX_SIZE},
+        "persistent": prediction_cache.get_cache(MODEL_ID).get_stats(),
+    }
+
+
+def get_breaker_state() -> dict:
+    """Возвращает состояние выключателя HF API и параметры повторов."""
+    return {
+        **_breaker.get_state(),
+        "serve_stale": HF_SERVE_STALE,
+        "stale_served": int(_STALE_SERVED.get()),
+        "retry": {
+            "max_attempts": _retry_policy.max_attempts,
+            "base_seconds": _retry_policy.base_seconds,
+            "max_seconds": _retry_policy.max_seconds,
+            "deadline_seconds": _retry_policy.deadline_seconds,
+        },
+    }
+
+
+def reset_breaker() -> dict:
+    """Принудительно замыкает выключатель HF API."""
+    _breaker.reset()
+    logger.info("Выключатель HF API сброшен вручную")
+    return get_breaker_state()
+
+
+def get_coalescing_stats() -> dict:
+    """Возвращает счётчики объединения одинаковых конкурентных запросов."""
+    return {**_coalescing_stats, "in_flight": len(_inflight)}
+
+
 def clear_cache() -> None:
     """Очищает кеш результатов."""
     _cache.clear()
@@ -54,7 +313,12 @@ def clear_cache() -> None:
 async def classify_image(image_path: str) -> list[Prediction]:
     """Отправляет изображение в Hugging Face API для классификации.
 
-    Результаты кешируются по хешу содержимого файла.
+    Результаты кешируются по хешу содержимого файла (в памяти и в
+    персистентном кеше на диске), а конкурентные вызовы
+    для одинакового содержимого разделяют один запрос к API и его результат.
+    Временные отказы API повторяются с экспоненциальной паузой; пока API
+    недоступен (выключатель разомкнут или повторы исчерпаны), при
+    HF_SERVE_STALE возвращается устаревшая запись персистентного кеша.
 
     Args:
         image_path: Путь к файлу изображения.
@@ -68,42 +332,223 @@ async def classify_image(image_path: str) -> list[Prediction]:
     if not API_TOKEN:
         raise RuntimeError("HF_API_TOKEN не задан. Установите переменную окружения.")
 
+    start = time.perf_counter()
     with open(image_path, "rb") as f:
         data = f.read()
 
     # Проверяем кеш
     file_hash = _compute_file_hash(data)
     cached = _get_cached(file_hash)
+    _CACHE_LOOKUPS.labels("memory", "hit" if cached is not None else "miss").inc()
     if cached is not None:
+        _CLASSIFY_SECONDS.labels("memory_cache").observe(time.perf_counter() - start)
         return cached
 
+    cached = await prediction_cache.get_async(MODEL_ID, file_hash)
+    _CACHE_LOOKUPS.labels("persistent", "hit" if cached is not None else "miss").inc()
+    if cached is not None:
+        logger.info("Результат найден в персистентном кеше (hash=%s...)", file_hash[:12])
+        _put_cache(file_hash, cached)
+        _CLASSIFY_SECONDS.labels("persistent_cache").observe(time.perf_counter() - start)
+        return cached
+
+    try:
+        predictions, coalesced = await _single_flight(file_hash, data)
+    except (CircuitOpenError, UpstreamError):
+        if not HF_SERVE_STALE:
+            raise
+        stale = await prediction_cache.get_async(MODEL_ID, file_hash, allow_stale=True)
+        if stale is None:
+            raise
+        logger.warning("API недоступен, отдан устаревший результат из кеша (hash=%s...)", file_hash[:12])
+        _STALE_SERVED.inc()
+        _CLASSIFY_SECONDS.labels("stale_cache").observe(time.perf_counter() - start)
+        return stale
+    path = "coalesced" if coalesced else "upstream"
+    _CLASSIFY_SECONDS.labels(path).observe(time.perf_counter() - start)
+    return predictions
+
+
+async def _compact(data: bytes) -> bytes:
+    """Перекодирует изображение в компактный JPEG для отправки в API.
+
+    Если изображение не декодируется, отправляется исходное содержимое —
+    окончательное решение о валидности остаётся за API.
+    """
+    try:
+        compact = await image_processor.encode_for_remote_async(data)
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось перекодировать изображение, отправляется оригинал: %s", str(e))
+        return data
+    if len(compact) >= len(data):
+        return data
+    logger.debug("Изображение сжато для API: %d -> %d байт", len(data), len(compact))
+    return compact
+
+
+async def _single_flight(file_hash: str, data: bytes) -> tuple[list[Prediction], bool]:
+    """Выполняет запрос к API, объединяя конкурентные вызовы с одинаковым хешем.
+
+    Первый вызов отправляет запрос, остальные ждут его результат или ошибку.
+
+    Returns:
+        Предсказания и признак того, что вызов был объединён с выполняющимся.
+    """
+    inflight = _inflight.get(file_hash)
+    if inflight is not None:
+        _coalescing_stats["coalesced_requests"] += 1
+        logger.info("Запрос объединён с выполняющимся (hash=%s...)", file_hash[:12])
+        return await asyncio.shield(inflight), True
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[file_hash] = future
+    _coalescing_stats["upstream_requests"] += 1
+    try:
+        predictions = await _fetch_predictions(await _compact(data))
+    except asyncio.CancelledError:
+        future.set_exception(RuntimeError("Запрос к API был отменён."))
+        future.exception()  # ожидающих может не быть — помечаем исключение полученным
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(file_hash, None)
+
+    # Сначала отдаём результат ожидающим: ошибка записи в кеш не должна их блокировать
+    future.set_result(predictions)
+    try:
+        _put_cache(file_hash, predictions)
+        await prediction_cache.put_async(MODEL_ID, file_hash, predictions)
+    except Exception as e:
+        logger.warning("Не удалось сохранить результат в кеш (hash=%s...): %s", file_hash[:12], str(e))
+    return predictions, False
+
+
+async def _fetch_predictions(data: bytes) -> list[Prediction]:
+    """Запрашивает предсказания с повторами временных отказов через выключатель.
+
+    Raises:
+        CircuitOpenError: Выключатель разомкнут — запрос не отправлялся.
+        UpstreamError: Временный отказ API, повторы исчерпаны.
+        RateLimitError: Ответ 429 (повторы — на стороне планировщика пакета).
+        RuntimeError: Прочие ошибки API.
+    """
+    try:
+        _breaker.before_call()
+    except CircuitOpenError:
+        _BREAKER_REJECTIONS.inc()
+        raise
+
+    started = time.monotonic()
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            try:
+                predictions = await _request_predictions(data)
+            except UpstreamError as e:
+                delay = _retry_policy.next_delay(attempt, started, e.retry_after)
+                if delay is None:
+                    logger.error("HF API недоступен, попыток: %d: %s", attempt, str(e))
+                    _breaker.record_failure()
+                    raise
+                logger.info(
+                    "Повтор запроса к HF API через %.1f с (попытка %d, %s)", delay, attempt + 1, e.reason
+                )
+                _RETRIES.labels(e.reason).inc()
+                _RETRY_WAIT_SECONDS.inc(delay)
+                await asyncio.sleep(delay)
+                continue
+            except RateLimitError:
+                # API отвечает, но ограничивает частоту — это не отказ сервиса
+                _breaker.record_cancel()
+                raise
+            except RuntimeError:
+                # Ошибки запроса (неверный токен, некорректное изображение) не говорят о недоступности
+                _breaker.record_success()
+                raise
+            except Exception:
+                # Непредвиденная ошибка не должна оставить пробную попытку выключателя незавершённой
+                _breaker.record_failure()
+                raise
+            _breaker.record_success()
+            return predictions
+    except asyncio.CancelledError:
+        _breaker.record_cancel()
+        raise
+
+
+def _valid_result(result: Any) -> bool:
+    """Проверяет форму ответа: список словарей с числовым score и строковым label."""
+    return isinstance(result, list) and all(
+        isinstance(item, dict)
+        and isinstance(item.get("label"), str)
+        and isinstance(item.get("score"), (int, float))
+        and not isinstance(item.get("score"), bool)
+        for item in result
+    )
+
+
+async def _request_predictions(data: bytes) -> list[Prediction]:
+    """Отправляет содержимое файла в API (одна попытка) и возвращает top-3 предсказания."""
     headers = {"Authorization": f"Bearer {API_TOKEN}"}
-    timeout = aiohttp.ClientTimeout(total=TIMEOUT_SECONDS)
-
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        try:
-            async with session.post(API_URL, headers=headers, data=data) as response:
-                if response.status == 401:
-                    raise RuntimeError("Неверный HF_API_TOKEN.")
-                if response.status == 503:
-                    body = await response.json()
-                    if "loading" in body.get("error", "").lower():
-                        logger.info("Модель загружается, ждем 5 секунд...")
-                        await asyncio.sleep(5)
-                        return await classify_image(image_path)  # рекурсивный повтор
-                    raise RuntimeError(f"Модель недоступна: {body.get('error')}")
-                if response.status == 429:
-                    raise RuntimeError("Превышен лимит запросов к API. Попробуйте позже.")
-                if response.status != 200:
-                    text = await response.text()
-                    raise RuntimeError(f"Ошибка API (status={response.status}): {text}")
+    session = _get_session()
 
+    start = time.perf_counter()
+    try:
+        async with session.post(API_URL, headers=headers, data=data) as response:
+            _UPSTREAM_SECONDS.labels(response.status).observe(time.perf_counter() - start)
+            if response.status == 401:
+                raise RuntimeError("Неверный HF_API_TOKEN.")
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if response.status == 503:
+                # Прокси и шлюзы отвечают 503 с HTML или текстом — это тоже временный отказ
+                text = await response.text()
+                try:
+                    body = json.loads(text)
+                except ValueError:
+                    body = None
+                error = body.get("error", "") if isinstance(body, dict) else text[:200]
+                if "loading" in error.lower():
+                    # HF сообщает ожидаемое время загрузки модели в estimated_time
+                    if retry_after is None and isinstance(body, dict) and isinstance(body.get("estimated_time"), (int, float)):
+                        retry_after = max(float(body["estimated_time"]), 0.0)
+                    raise UpstreamError("Модель загружается.", "loading", retry_after)
+                raise UpstreamError(f"Модель недоступна: {error}", "unavailable", retry_after)
+            if response.status == 429:
+                raise RateLimitError(
+                    "Превышен лимит запросов к API. Попробуйте позже.",
+                    retry_after=retry_after,
+                )
+            if response.status >= 500:
+                text = await response.text()
+                raise UpstreamError(
+                    f"Ошибка API (status={response.status}): {text}", "server_error", retry_after
+                )
+            if response.status != 200:
+                text = await response.text()
+                raise RuntimeError(f"Ошибка API (status={response.status}): {text}")
+
+            try:
                 result = await response.json()
-                logger.info("Получен ответ от HF API: %d предсказаний", len(result))
+            except (ValueError, aiohttp.ContentTypeError) as e:
+                raise UpstreamError(f"Некорректный ответ API: {str(e)}", "bad_response", retry_after)
+            if not _valid_result(result):
+                raise UpstreamError(
+                    f"Некорректный ответ API: {str(result)[:200]}", "bad_response", retry_after
+                )
+            logger.info("Получен ответ от HF API: %d предсказаний", len(result))
 
-        except aiohttp.ClientError as e:
-            logger.error("Ошибка соединения с HF API: %s", str(e))
-            raise RuntimeError(f"Ошибка соединения с API: {str(e)}")
+    except aiohttp.ClientError as e:
+        _UPSTREAM_SECONDS.labels("error").observe(time.perf_counter() - start)
+        logger.error("Ошибка соединения с HF API: %s", str(e))
+        raise UpstreamError(f"Ошибка соединения с API: {str(e)}", "connection")
+    except asyncio.TimeoutError:
+        _UPSTREAM_SECONDS.labels("timeout").observe(time.perf_counter() - start)
+        logger.error("Превышено время ожидания ответа HF API (%d с)", TIMEOUT_SECONDS)
+        raise UpstreamError("Превышено время ожидания ответа API.", "timeout")
 
     # Сортируем по score по убыванию и берём top-3
     sorted_result = sorted(result, key=lambda x: x["score"], reverse=True)
@@ -113,7 +558,4 @@ async def classify_image(image_path: str) -> list[Prediction]:
         for item in top3
     ]
 
-    # Сохраняем в кеш
-    _put_cache(file_hash, predictions)
-
     return predictions
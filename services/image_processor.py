@@ -1,8 +1,14 @@
 """Сервис валидации и предобработки изображений."""
 
+import asyncio
 import io
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+import numpy as np
+from PIL import Image, ImageOps
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +17,29 @@ ALLOWED_MIME_TYPES = {"image/jpeg", "image/png"}
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "10"))
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 
+# Вход модели ViT (patch16-224): размер и нормализация mean=std=0.5
+MODEL_INPUT_SIZE = 224
+_MEAN = np.array([0.5, 0.5, 0.5], dtype=np.float32).reshape(3, 1, 1)
+_STD = np.array([0.5, 0.5, 0.5], dtype=np.float32).reshape(3, 1, 1)
+
+# Компактный JPEG для удалённого API: меньшая сторона и качество сжатия
+REMOTE_MIN_SIDE = int(os.getenv("REMOTE_MIN_SIDE", "256"))
+REMOTE_JPEG_QUALITY = int(os.getenv("REMOTE_JPEG_QUALITY", "90"))
+# Перцептивный хеш (pHash): сторона уменьшенного изображения и учитываемый блок DCT
+PHASH_IMAGE_SIZE = 32
+PHASH_DCT_SIZE = 8
+PREPROCESS_THREADS = int(os.getenv("PREPROCESS_THREADS", str(min(4, os.cpu_count() or 1))))
+
+_pool = ThreadPoolExecutor(max_workers=PREPROCESS_THREADS, thread_name_prefix="preprocess")
+
+ImageSource = Union[str, bytes]
+
+# Матрица DCT-II размера PHASH_IMAGE_SIZE: 2D-преобразование — _DCT @ X @ _DCT.T
+_DCT = np.cos(
+    np.pi / (2 * PHASH_IMAGE_SIZE)
+    * np.outer(np.arange(PHASH_IMAGE_SIZE), 2 * np.arange(PHASH_IMAGE_SIZE) + 1)
+).astype(np.float32)
+
 
 def validate_file_extension(filename: str) -> bool:
     """Проверяет допустимость расширения файла.
@@ -84,3 +113,115 @@ def get_mime_type(filename: str) -> str:
     if ext == ".png":
         return "image/png"
     return "application/octet-stream"
+
+
+def open_image(source: ImageSource, min_side: int) -> Image.Image:
+    """Декодирует изображение в RGB с учётом EXIF-ориентации.
+
+    Для JPEG используется draft-режим: декодер сразу уменьшает изображение
+    в 2/4/8 раз, пока обе стороны не меньше min_side, и полноразмерная
+    распаковка не выполняется.
+
+    Raises:
+        OSError: Если файл не читается или не декодируется.
+        ValueError: Если изображение отвергнуто как «декомпрессионная бомба»
+            (размер в пикселях больше допустимого Pillow).
+    """
+    try:
+        img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        if img.format == "JPEG":
+            img.draft("RGB", (min_side, min_side))
+        img = ImageOps.exif_transpose(img)
+        return img.convert("RGB")
+    except Image.DecompressionBombError as e:
+        # Наследует Exception, а не OSError/ValueError, которые ждут вызывающие
+        raise ValueError(f"Слишком большое изображение: {str(e)}") from e
+
+
+def _resize_short_side(img: Image.Image, side: int) -> Image.Image:
+    """Уменьшает изображение так, чтобы меньшая сторона стала равна side (без увеличения)."""
+    width, height = img.size
+    scale = side / min(width, height)
+    if scale >= 1:
+        return img
+    size = (max(round(width * scale), side), max(round(height * scale), side))
+    return img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def load_for_model(source: ImageSource, size: int = MODEL_INPUT_SIZE) -> np.ndarray:
+    """Готовит изображение для локальной модели.
+
+    Декодирует, поворачивает по EXIF, уменьшает меньшую сторону до size,
+    вырезает центральный квадрат size×size и нормализует.
+
+    Args:
+        source: Путь к файлу или его содержимое.
+        size: Сторона входа модели.
+
+    Returns:
+        Тензор (3, size, size) float32.
+    """
+    img = _resize_short_side(open_image(source, size), size)
+    img = ImageOps.fit(img, (size, size), Image.BILINEAR) if img.size != (size, size) else img
+    array = np.asarray(img, dtype=np.float32).transpose(2, 0, 1)
+    return (array * (1 / 255.0) - _MEAN) / _STD
+
+
+def load_batch_for_model(sources: list[ImageSource], size: int = MODEL_INPUT_SIZE) -> np.ndarray:
+    """Готовит пакет изображений; результат — тензор (N, 3, size, size) float32."""
+    return np.stack([load_for_model(source, size) for source in sources])
+
+
+def encode_for_remote(source: ImageSource) -> bytes:
+    """Перекодирует изображение в компактный JPEG для удалённого API.
+
+    Пропорции сохраняются, меньшая сторона уменьшается до REMOTE_MIN_SIDE.
+
+    Args:
+        source: Путь к файлу или его содержимое.
+
+    Returns:
+        Содержимое JPEG.
+    """
+    img = _resize_short_side(open_image(source, REMOTE_MIN_SIDE), REMOTE_MIN_SIDE)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=REMOTE_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def perceptual_hash(source: ImageSource) -> str:
+    """Вычисляет 64-битный перцептивный хеш (pHash) изображения.
+
+    Изображение в оттенках серого уменьшается до PHASH_IMAGE_SIZE×PHASH_IMAGE_SIZE,
+    от него берутся низкочастотные коэффициенты DCT (блок PHASH_DCT_SIZE×PHASH_DCT_SIZE);
+    бит хеша — превышает ли коэффициент медиану. Хеш устойчив к масштабированию,
+    перекодированию и удалению EXIF: у таких копий расстояние Хэмминга мало.
+
+    Args:
+        source: Путь к файлу или его содержимое.
+
+    Returns:
+        Хеш — 16 шестнадцатеричных цифр.
+    """
+    img = open_image(source, PHASH_IMAGE_SIZE).convert("L")
+    img = img.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.LANCZOS)
+    pixels = np.asarray(img, dtype=np.float32)
+    block = (_DCT @ pixels @ _DCT.T)[:PHASH_DCT_SIZE, :PHASH_DCT_SIZE].flatten()
+    # Постоянная составляющая (яркость) не участвует в медиане
+    bits = block > np.median(block[1:])
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+
+async def load_for_model_async(source: ImageSource, size: int = MODEL_INPUT_SIZE) -> np.ndarray:
+    """Асинхронная обёртка load_for_model: выполняется в пуле предобработки."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, load_for_model, source, size)
+
+
+async def encode_for_remote_async(source: ImageSource) -> bytes:
+    """Асинхронная обёртка encode_for_remote: выполняется в пуле предобработки."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, encode_for_remote, source)
+
+
+async def perceptual_hash_async(source: ImageSource) -> str:
+    """Асинхронная обёртка perceptual_hash: выполняется в пуле предобработки."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, perceptual_hash, source)
@@ -0,0 +1,420 @@
+"""Фоновые задания распознавания с очередью и опросом состояния.
+
+Задание создаётся сразу и возвращает ID; его обрабатывает пул воркеров
+(asyncio-задачи), распознавая изображения через services.recognition.
+Прогресс и частичные результаты доступны по ID задания, а подписчики
+получают события по мере обработки (для SSE).
+
+Состояние заданий хранится в services.job_store, общем для всех
+процессов: в каталоге JOBS_DIR (очередь в памяти процесса) или в Redis
+(JOB_QUEUE_BACKEND=redis, REDIS_URL). Поэтому задание, созданное одним
+воркером uvicorn, видно и может быть выполнено любым другим, а после
+перезапуска незавершённые задания продолжаются с необработанных
+изображений. Перед обработкой воркер захватывает задание, так что оно
+выполняется одним воркером. Незахваченные незавершённые задания
+(например, владелец процесса завершился) периодически ставятся
+в очередь заново. Завершённые задания хранятся JOB_RETENTION_HOURS.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from models.schemas import BatchInferenceItem, JobStatus
+from services import job_store, metrics, recognition
+from services.job_store import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+# Снимок заданий прежних версий: переносится в JOBS_DIR при старте
+JOBS_FILE = os.getenv("JOBS_FILE", "jobs.json")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Период сохранения прогресса заданий, секунды
+_PERSIST_INTERVAL = 1.0
+# Период поиска брошенных заданий и удаления устаревших, секунды
+_RECOVER_INTERVAL = 30.0
+_PURGE_INTERVAL = 600.0
+# Период опроса хранилища подписчиком задания, которое ведёт другой процесс
+_EVENTS_POLL_INTERVAL = 1.0
+_KEEPALIVE_SECONDS = 15.0
+_REDIS_KEY = "cars-recognizer:jobs"
+
+
+def _redis_client(url: str):
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        raise RuntimeError("Для JOB_QUEUE_BACKEND=redis установите пакет redis.")
+    return redis.from_url(url, decode_responses=True)
+
+
+class InProcessQueue:
+    """Очередь ID заданий в памяти процесса."""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+
+    async def put(self, job_id: str) -> None:
+        await self._queue.put(job_id)
+
+    async def get(self) -> str:
+        return await self._queue.get()
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisQueue:
+    """Очередь ID заданий в списке Redis (LPUSH/BRPOP)."""
+
+    name = "redis"
+
+    def __init__(self, client) -> None:
+        self._client = client
+
+    async def put(self, job_id: str) -> None:
+        await self._client.lpush(_REDIS_KEY, job_id)
+
+    async def get(self) -> str:
+        _, job_id = await self._client.brpop(_REDIS_KEY, timeout=0)
+        return job_id
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+# Задания, которые выполняет этот процесс (живые объекты с результатами)
+_running: dict[str, JobStatus] = {}
+# Задания, поставленные в очередь этим процессом и ещё не взятые воркером
+_queued: set[str] = set()
+_subscribers: dict[str, set[asyncio.Queue]] = {}
+# Несохранённые изменения: ID заданий и их новые результаты
+_dirty: set[str] = set()
+_pending_results: dict[str, list[BatchInferenceItem]] = {}
+_flush_lock: Optional[asyncio.Lock] = None
+_queue = None
+_store = None
+_tasks: list[asyncio.Task] = []
+
+metrics.gauge("jobs_active", "Задания распознавания в обработке", callback=lambda: len(_running))
+metrics.gauge("jobs_queued", "Задания распознавания, ожидающие воркера", callback=lambda: len(_queued))
+
+
+async def _flush() -> None:
+    """Сохраняет новые результаты и сводки изменённых заданий.
+
+    Результаты только дописываются, поэтому стоимость сохранения не
+    зависит от числа уже обработанных изображений.
+    """
+    async with _flush_lock:
+        dirty = list(_dirty)
+        _dirty.clear()
+        for job_id in dirty:
+            items = _pending_results.pop(job_id, [])
+            job = _running.get(job_id)
+            try:
+                await _store.append_results(job_id, items)
+                if job is not None:
+                    await _store.save(job)
+            except Exception:
+                # Повторим при следующем сохранении
+                _pending_results[job_id] = items + _pending_results.get(job_id, [])
+                _dirty.add(job_id)
+                raise
+
+
+def _purge_before() -> datetime:
+    return datetime.now() - timedelta(hours=JOB_RETENTION_HOURS)
+
+
+async def _recover() -> int:
+    """Ставит в очередь незавершённые задания, которые не ведёт ни один воркер.
+
+    С очередью в памяти процесса это и задания в статусе queued: их очередь
+    могла погибнуть вместе с процессом. В Redis такие задания остаются в списке.
+    """
+    resumable = {"running"} if _queue.name == "redis" else {"queued", "running"}
+    resumed = 0
+    for job in await _store.unfinished():
+        if job.status not in resumable or job.id in _running or job.id in _queued:
+            continue
+        if await _store.is_claimed(job.id):
+            continue
+        await _queue.put(job.id)
+        resumed += 1
+    return resumed
+
+
+async def _maintenance_loop() -> None:
+    """Сохранение прогресса, продление захватов, возобновление и удаление заданий."""
+    loop = asyncio.get_running_loop()
+    next_recover = loop.time() + _RECOVER_INTERVAL
+    next_purge = loop.time() + _PURGE_INTERVAL
+    while True:
+        await asyncio.sleep(_PERSIST_INTERVAL)
+        try:
+            if _dirty:
+                await _flush()
+            await _store.refresh_claims()
+            if loop.time() >= next_recover:
+                next_recover = loop.time() + _RECOVER_INTERVAL
+                resumed = await _recover()
+                if resumed:
+                    logger.info("Возобновлено брошенных заданий: %d", resumed)
+            if loop.time() >= next_purge:
+                next_purge = loop.time() + _PURGE_INTERVAL
+                await _store.purge(_purge_before())
+        except Exception as e:
+            logger.error("Ошибка обслуживания заданий: %s", str(e))
+
+
+def _publish(job_id: str, event: str, data: dict) -> None:
+    """Рассылает событие подписчикам задания."""
+    for queue in _subscribers.get(job_id, ()):
+        queue.put_nowait((event, data))
+
+
+def _progress(job: JobStatus) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "failed": job.failed,
+    }
+
+
+async def _set_status(job: JobStatus, status: str, error: Optional[str] = None) -> None:
+    job.status = status
+    job.error = error
+    job.updated_at = datetime.now()
+    _dirty.add(job.id)
+    await _flush()
+    _publish(job.id, "status", _progress(job))
+
+
+async def _run_job(job: JobStatus) -> None:
+    """Обрабатывает необработанные изображения задания."""
+    done_ids = {item.id for item in job.results}
+    pending = [image_id for image_id in job.image_ids if image_id not in done_ids]
+    await _set_status(job, "running")
+    logger.info("Задание %s: старт, осталось %d из %d", job.id, len(pending), job.total)
+
+    def on_result(item: BatchInferenceItem) -> None:
+        job.results.append(item)
+        if item.error is None:
+            job.completed += 1
+        else:
+            job.failed += 1
+        job.updated_at = datetime.now()
+        _pending_results.setdefault(job.id, []).append(item)
+        _dirty.add(job.id)
+        _publish(job.id, "item", {**_progress(job), "item": item.model_dump(mode="json")})
+
+    try:
+        await recognition.recognize_many(pending, on_result=on_result)
+    except Exception as e:
+        logger.error("Задание %s завершилось ошибкой: %s", job.id, str(e))
+        await _set_status(job, "failed", str(e))
+        return
+
+    # Результаты — в порядке входных ID
+    order = {image_id: index for index, image_id in enumerate(job.image_ids)}
+    job.results.sort(key=lambda item: order.get(item.id, len(order)))
+    await _set_status(job, "completed")
+    logger.info("Задание %s: готово, успешно %d, ошибок %d", job.id, job.completed, job.failed)
+
+
+async def _process(job_id: str) -> None:
+    """Захватывает задание и выполняет его, если оно ещё не завершено."""
+    if job_id in _running or not await _store.claim(job_id):
+        # Задание уже ведёт этот или другой воркер
+        return
+    try:
+        job = await _store.load(job_id)
+        if job is None or job.status in TERMINAL_STATUSES:
+            return
+        _running[job_id] = job
+        try:
+            await _run_job(job)
+        finally:
+            _running.pop(job_id, None)
+    finally:
+        await _store.release(job_id)
+
+
+async def _worker() -> None:
+    while True:
+        job_id = await _queue.get()
+        _queued.discard(job_id)
+        try:
+            await _process(job_id)
+        except Exception as e:
+            logger.error("Ошибка обработки задания %s: %s", job_id, str(e))
+
+
+async def _migrate_legacy() -> int:
+    """Переносит задания из снимка JOBS_FILE прежних версий в хранилище заданий."""
+    claimed = f"{JOBS_FILE}.migrating"
+    try:
+        # Переименование выполнит только один из процессов
+        os.replace(JOBS_FILE, claimed)
+    except FileNotFoundError:
+        return 0
+    try:
+        with open(claimed, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        logger.error("Ошибка чтения файла заданий %s", claimed)
+        return 0
+    for item in items:
+        job = JobStatus(**item)
+        await _store.append_results(job.id, job.results)
+        await _store.save(job)
+    os.remove(claimed)
+    return len(items)
+
+
+async def start() -> None:
+    """Подключает хранилище и очередь, запускает воркеров и возобновляет незавершённые задания."""
+    global _queue, _store, _flush_lock
+    _flush_lock = asyncio.Lock()
+    if JOB_QUEUE_BACKEND == "redis":
+        client = _redis_client(REDIS_URL)
+        _queue = RedisQueue(client)
+        _store = job_store.RedisJobStore(client, int(JOB_RETENTION_HOURS * 3600))
+    else:
+        _queue = InProcessQueue()
+        _store = job_store.FileJobStore(JOBS_DIR)
+        migrated = await _migrate_legacy()
+        if migrated:
+            logger.info("Задания из %s перенесены в %s: %d", JOBS_FILE, JOBS_DIR, migrated)
+    await _store.purge(_purge_before())
+    resumed = await _recover()
+    _tasks.extend(asyncio.create_task(_worker()) for _ in range(max(JOB_WORKERS, 1)))
+    _tasks.append(asyncio.create_task(_maintenance_loop()))
+    logger.info(
+        "Очередь заданий: %s, хранилище: %s, воркеров %d, возобновлено заданий %d",
+        _queue.name, _store.name, JOB_WORKERS, resumed,
+    )
+
+
+async def stop() -> None:
+    """Останавливает воркеров и сохраняет состояние (незавершённые задания продолжатся)."""
+    global _queue, _store
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    if _store is not None:
+        try:
+            await _flush()
+        except Exception as e:
+            logger.error("Ошибка сохранения заданий: %s", str(e))
+        await _store.close()
+        _store = None
+    if _queue is not None:
+        await _queue.close()
+        _queue = None
+    _running.clear()
+    _queued.clear()
+
+
+async def submit(image_ids: list[int]) -> JobStatus:
+    """Создаёт задание и ставит его в очередь.
+
+    Args:
+        image_ids: ID изображений для распознавания.
+
+    Returns:
+        Состояние созданного задания.
+    """
+    now = datetime.now()
+    job = JobStatus(
+        id=uuid.uuid4().hex,
+        status="queued",
+        created_at=now,
+        updated_at=now,
+        image_ids=image_ids,
+        total=len(image_ids),
+    )
+    await _store.save(job)
+    _queued.add(job.id)
+    await _queue.put(job.id)
+    logger.info("Создано задание %s: %d изображений", job.id, job.total)
+    return job
+
+
+async def get(job_id: str) -> Optional[JobStatus]:
+    """Возвращает состояние задания (в том числе из другого процесса) или None."""
+    job = _running.get(job_id)
+    if job is not None:
+        return job
+    return await _store.load(job_id)
+
+
+async def events(job_id: str) -> AsyncIterator[tuple[str, dict]]:
+    """Асинхронно выдаёт события задания до его завершения.
+
+    Первым событием выдаётся текущее состояние, последним — событие status
+    с итоговым статусом; при отсутствии событий периодически выдаётся keepalive.
+    Пока задание выполняет этот процесс, события приходят сразу; если его
+    ведёт другой процесс, прогресс и новые результаты читаются из хранилища.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    _subscribers.setdefault(job_id, set()).add(queue)
+    try:
+        job = await get(job_id)
+        if job is None:
+            return
+        yield "status", _progress(job)
+        if job.status in TERMINAL_STATUSES:
+            return
+        last_status = job.status
+        # Позиция в результатах, уже учтённых в первом событии
+        position = (await _store.read_results(job_id, 0))[1]
+        idle = 0.0
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=_EVENTS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                idle += _EVENTS_POLL_INTERVAL
+                if job_id not in _running:
+                    current = await _store.load(job_id, with_results=False)
+                    if current is None:
+                        return
+                    items, position = await _store.read_results(job_id, position)
+                    for item in items:
+                        idle = 0.0
+                        yield "item", {**_progress(current), "item": item.model_dump(mode="json")}
+                    if current.status != last_status:
+                        idle = 0.0
+                        last_status = current.status
+                        yield "status", _progress(current)
+                    if current.status in TERMINAL_STATUSES:
+                        return
+                if idle >= _KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield "keepalive", {}
+                continue
+            idle = 0.0
+            yield event, data
+            if event == "status":
+                last_status = data["status"]
+                if last_status in TERMINAL_STATUSES:
+                    return
+    finally:
+        _subscribers[job_id].discard(queue)
+        if not _subscribers[job_id]:
+            del _subscribers[job_id]
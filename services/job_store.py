@@ -0,0 +1,351 @@
+"""Хранилище состояния фоновых заданий, общее для всех воркеров.
+
+Состояние задания (статус и счётчики) хранится отдельно от его
+результатов: сводка перезаписывается целиком, а результаты по
+изображениям только дописываются, поэтому сохранение прогресса
+не зависит от числа уже обработанных изображений.
+
+Задание выполняет тот воркер, который его захватил (claim). Захват
+снимается при завершении обработки или при смерти процесса, после чего
+незавершённое задание может продолжить другой воркер.
+
+FileJobStore — каталог с файлами заданий на общем диске:
+    <id>.json           сводка (атомарная перезапись)
+    <id>.results.jsonl  результаты, по строке на изображение; недописанная
+                        строка (процесс упал во время записи) отрезается
+                        при захвате задания, до следующей дозаписи
+    <id>.lock           захват (flock; без fcntl — только один процесс)
+
+RedisJobStore — ключи Redis: сводка, список результатов и ключ захвата
+с TTL, который продлевает владелец; у завершённых заданий задаётся срок
+хранения.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import datetime
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from models.schemas import BatchInferenceItem, JobStatus
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed"}
+
+# ID заданий — uuid4().hex; другие значения не превращаются в пути и ключи
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+_REDIS_PREFIX = "cars-recognizer:job"
+_REDIS_UNFINISHED = "cars-recognizer:jobs:unfinished"
+# Время жизни захвата в Redis: владелец продлевает его, пока жив
+CLAIM_TTL_SECONDS = 30
+
+
+def valid_job_id(job_id: str) -> bool:
+    """Проверяет формат ID задания."""
+    return _JOB_ID.fullmatch(job_id) is not None
+
+
+def _summary(job: JobStatus) -> str:
+    return job.model_dump_json(exclude={"results"})
+
+
+def _parse_results(lines: list[str]) -> list[BatchInferenceItem]:
+    """Разбирает строки результатов, пропуская повреждённые."""
+    results = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            results.append(BatchInferenceItem.model_validate_json(line))
+        except ValueError as e:
+            logger.error("Пропущена повреждённая строка результатов задания: %s", str(e))
+    return results
+
+
+def _with_results(summary: dict, lines: list[str]) -> JobStatus:
+    """Собирает задание из сводки и результатов (в порядке входных ID)."""
+    job = JobStatus(**summary)
+    order = {image_id: index for index, image_id in enumerate(job.image_ids)}
+    results = _parse_results(lines)
+    results.sort(key=lambda item: order.get(item.id, len(order)))
+    job.results = results
+    # Счётчики сводки могли не успеть сохраниться (процесс остановлен): источник истины — результаты
+    job.failed = sum(1 for item in results if item.error is not None)
+    job.completed = len(results) - job.failed
+    return job
+
+
+class FileJobStore:
+    """Задания в файлах каталога, доступного всем воркерам."""
+
+    name = "file"
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Открытые файлы захваченных этим процессом заданий
+        self._claims: dict[str, int] = {}
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def _save(self, job_id: str, payload: str) -> None:
+        path = self._path(job_id, ".json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    async def save(self, job: JobStatus) -> None:
+        """Сохраняет сводку задания (без результатов)."""
+        await asyncio.to_thread(self._save, job.id, _summary(job))
+
+    def _append(self, job_id: str, lines: str) -> None:
+        with open(self._path(job_id, ".results.jsonl"), "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def append_results(self, job_id: str, items: list[BatchInferenceItem]) -> None:
+        """Дописывает результаты по изображениям."""
+        if items:
+            await asyncio.to_thread(self._append, job_id, "".join(item.model_dump_json() + "\n" for item in items))
+
+    def _read_summary(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(job_id, ".json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _read_lines(self, job_id: str, position: int) -> tuple[list[str], int]:
+        try:
+            with open(self._path(job_id, ".results.jsonl"), "rb") as f:
+                f.seek(position)
+                data = f.read()
+        except FileNotFoundError:
+            return [], position
+        # Незаконченная строка (запись ещё идёт) будет прочитана в следующий раз
+        complete = data[:data.rfind(b"\n") + 1]
+        return complete.decode("utf-8").splitlines(), position + len(complete)
+
+    def _load(self, job_id: str, with_results: bool) -> Optional[JobStatus]:
+        if not valid_job_id(job_id):
+            return None
+        summary = self._read_summary(job_id)
+        if summary is None:
+            return None
+        if not with_results:
+            return JobStatus(**summary)
+        return _with_results(summary, self._read_lines(job_id, 0)[0])
+
+    async def load(self, job_id: str, with_results: bool = True) -> Optional[JobStatus]:
+        """Загружает задание или None, если его нет (или оно удалено по сроку хранения)."""
+        return await asyncio.to_thread(self._load, job_id, with_results)
+
+    async def read_results(self, job_id: str, position: int) -> tuple[list[BatchInferenceItem], int]:
+        """Результаты, дописанные после position, и новая позиция (смещение в байтах)."""
+        lines, position = await asyncio.to_thread(self._read_lines, job_id, position)
+        return _parse_results(lines), position
+
+    def _summaries(self) -> list[JobStatus]:
+        jobs = []
+        for name in os.listdir(self.directory):
+            job_id, ext = os.path.splitext(name)
+            if ext != ".json" or not valid_job_id(job_id):
+                continue
+            try:
+                summary = self._read_summary(job_id)
+            except (OSError, ValueError) as e:
+                logger.error("Ошибка чтения задания %s: %s", job_id, str(e))
+                continue
+            if summary is not None:
+                jobs.append(JobStatus(**summary))
+        return jobs
+
+    async def unfinished(self) -> list[JobStatus]:
+        """Сводки незавершённых заданий."""
+        jobs = await asyncio.to_thread(self._summaries)
+        return [job for job in jobs if job.status not in TERMINAL_STATUSES]
+
+    def _truncate_partial(self, job_id: str) -> None:
+        """Отрезает недописанную последнюю строку результатов, чтобы дозапись не склеилась с ней."""
+        try:
+            f = open(self._path(job_id, ".results.jsonl"), "r+b")
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            size = end
+            while end > 0:
+                start = max(end - 64 * 1024, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                logger.warning(
+                    "Задание %s: отрезана недописанная строка результатов (%d байт)", job_id, size - end
+                )
+                f.truncate(end)
+
+    def _try_lock(self, job_id: str) -> Optional[int]:
+        fd = os.open(self._path(job_id, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    async def claim(self, job_id: str) -> bool:
+        """Захватывает задание для обработки; False — его ведёт другой воркер."""
+        if job_id in self._claims:
+            return False
+        fd = await asyncio.to_thread(self._try_lock, job_id)
+        if fd is None:
+            return False
+        self._claims[job_id] = fd
+        # Прежний владелец мог упасть посреди записи; теперь дописывает только этот воркер
+        await asyncio.to_thread(self._truncate_partial, job_id)
+        return True
+
+    async def is_claimed(self, job_id: str) -> bool:
+        """Ведёт ли задание какой-либо воркер."""
+        if job_id in self._claims:
+            return True
+        fd = await asyncio.to_thread(self._try_lock, job_id)
+        if fd is None:
+            return True
+        os.close(fd)
+        return False
+
+    async def refresh_claims(self) -> None:
+        """Продлевает захваты (блокировки файлов не истекают)."""
+
+    async def release(self, job_id: str) -> None:
+        """Снимает захват задания."""
+        fd = self._claims.pop(job_id, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _purge(self, before: datetime) -> int:
+        removed = 0
+        for job in self._summaries():
+            if job.status not in TERMINAL_STATUSES or job.updated_at >= before:
+                continue
+            for suffix in (".json", ".results.jsonl", ".lock"):
+                try:
+                    os.remove(self._path(job.id, suffix))
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+    async def purge(self, before: datetime) -> int:
+        """Удаляет завершённые задания, обновлённые раньше before."""
+        return await asyncio.to_thread(self._purge, before)
+
+    async def close(self) -> None:
+        for job_id in list(self._claims):
+            await self.release(job_id)
+
+
+class RedisJobStore:
+    """Задания в ключах Redis, общих для всех воркеров."""
+
+    name = "redis"
+
+    def __init__(self, client, retention_seconds: int) -> None:
+        self._client = client
+        self._retention = max(int(retention_seconds), 1)
+        self._token = uuid.uuid4().hex
+        self._claims: set[str] = set()
+
+    @staticmethod
+    def _key(job_id: str, part: str = "") -> str:
+        return f"{_REDIS_PREFIX}:{job_id}{part}"
+
+    async def save(self, job: JobStatus) -> None:
+        """Сохраняет сводку задания; завершённым задаётся срок хранения."""
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(job.id), _summary(job))
+            if job.status in TERMINAL_STATUSES:
+                pipe.srem(_REDIS_UNFINISHED, job.id)
+                pipe.expire(self._key(job.id), self._retention)
+                pipe.expire(self._key(job.id, ":results"), self._retention)
+            else:
+                pipe.sadd(_REDIS_UNFINISHED, job.id)
+            await pipe.execute()
+
+    async def append_results(self, job_id: str, items: list[BatchInferenceItem]) -> None:
+        """Дописывает результаты по изображениям."""
+        if items:
+            await self._client.rpush(self._key(job_id, ":results"), *(item.model_dump_json() for item in items))
+
+    async def load(self, job_id: str, with_results: bool = True) -> Optional[JobStatus]:
+        """Загружает задание или None, если его нет (или истёк срок хранения)."""
+        if not valid_job_id(job_id):
+            return None
+        summary = await self._client.get(self._key(job_id))
+        if summary is None:
+            return None
+        if not with_results:
+            return JobStatus(**json.loads(summary))
+        return _with_results(json.loads(summary), await self._client.lrange(self._key(job_id, ":results"), 0, -1))
+
+    async def read_results(self, job_id: str, position: int) -> tuple[list[BatchInferenceItem], int]:
+        """Результаты, дописанные после position, и новая позиция (индекс в списке)."""
+        lines = await self._client.lrange(self._key(job_id, ":results"), position, -1)
+        return _parse_results(lines), position + len(lines)
+
+    async def unfinished(self) -> list[JobStatus]:
+        """Сводки незавершённых заданий."""
+        job_ids = sorted(await self._client.smembers(_REDIS_UNFINISHED))
+        if not job_ids:
+            return []
+        summaries = await self._client.mget([self._key(job_id) for job_id in job_ids])
+        return [JobStatus(**json.loads(summary)) for summary in summaries if summary is not None]
+
+    async def claim(self, job_id: str) -> bool:
+        """Захватывает задание для обработки; False — его ведёт другой воркер."""
+        if not await self._client.set(self._key(job_id, ":claim"), self._token, nx=True, ex=CLAIM_TTL_SECONDS):
+            return False
+        self._claims.add(job_id)
+        return True
+
+    async def is_claimed(self, job_id: str) -> bool:
+        """Ведёт ли задание какой-либо воркер."""
+        return bool(await self._client.exists(self._key(job_id, ":claim")))
+
+    async def refresh_claims(self) -> None:
+        """Продлевает захваты этого процесса."""
+        for job_id in list(self._claims):
+            await self._client.expire(self._key(job_id, ":claim"), CLAIM_TTL_SECONDS)
+
+    async def release(self, job_id: str) -> None:
+        """Снимает захват задания, если он ещё принадлежит этому процессу."""
+        self._claims.discard(job_id)
+        key = self._key(job_id, ":claim")
+        if await self._client.get(key) == self._token:
+            await self._client.delete(key)
+
+    async def purge(self, before: datetime) -> int:
+        """Завершённые задания удаляет сам Redis по сроку хранения."""
+        return 0
+
+    async def close(self) -> None:
+        for job_id in list(self._claims):
+            await self.release(job_id)
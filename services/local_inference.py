@@ -0,0 +1,253 @@
+"""Локальный CPU-инференс — альтернатива Hugging Face Inference API.
+
+Модель загружается один раз при старте приложения и выполняется в
+отдельном потоке, чтобы не блокировать event loop; конкурентные запросы
+объединяются в пакеты (services.micro_batcher). Поддерживаемые
+реализации:
+
+- onnx  — ONNX Runtime; модель, экспортированная из HF_MODEL, например
+  `optimum-cli export onnx --model <HF_MODEL> <LOCAL_MODEL_DIR>`
+  (в каталоге должны лежать model.onnx и config.json с id2label);
+- torch — transformers + PyTorch, модель загружается из LOCAL_MODEL_DIR
+  или по имени HF_MODEL;
+- dummy — крошечная детерминированная модель на NumPy для тестов и
+  проверки без весов.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from models.schemas import Prediction
+from services import image_processor
+from services.hf_client import MODEL_ID
+from services.micro_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL_DIR = os.getenv("LOCAL_MODEL_DIR", "")
+LOCAL_NUM_THREADS = int(os.getenv("LOCAL_NUM_THREADS", str(os.cpu_count() or 1)))
+# Микробатчинг: максимальный размер пакета и ожидание его добора
+LOCAL_BATCH_MAX_SIZE = int(os.getenv("LOCAL_BATCH_MAX_SIZE", "16"))
+LOCAL_BATCH_MAX_WAIT_MS = float(os.getenv("LOCAL_BATCH_MAX_WAIT_MS", "10"))
+
+TOP_K = 3
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _load_labels(model_dir: str) -> list[str]:
+    """Читает метки классов из config.json (поле id2label) каталога модели."""
+    with open(os.path.join(model_dir, "config.json"), "r", encoding="utf-8") as f:
+        id2label = json.load(f)["id2label"]
+    return [id2label[str(i)] for i in range(len(id2label))]
+
+
+class LocalClassifier:
+    """Базовый класс локального классификатора."""
+
+    name = "base"
+
+    def __init__(self, num_threads: int) -> None:
+        self.num_threads = num_threads
+        self.labels: list[str] = []
+
+    def load(self) -> None:
+        """Загружает модель в память."""
+        raise NotImplementedError
+
+    def predict_logits(self, batch: np.ndarray) -> np.ndarray:
+        """Выполняет прямой проход по пакету (N, 3, H, W) и возвращает логиты (N, C)."""
+        raise NotImplementedError
+
+    def classify_batch(self, batch: np.ndarray) -> list[list[Prediction]]:
+        """Классифицирует пакет тензоров и возвращает top-3 предсказания для каждого."""
+        probs = _softmax(self.predict_logits(batch))
+        top = np.argsort(-probs, axis=-1)[:, :TOP_K]
+        return [
+            [
+                Prediction(label=self.labels[idx], confidence=round(float(row[idx]), 4))
+                for idx in indices
+            ]
+            for row, indices in zip(probs, top)
+        ]
+
+
+class OnnxClassifier(LocalClassifier):
+    """Классификатор на ONNX Runtime (CPUExecutionProvider)."""
+
+    name = "onnx"
+
+    def __init__(self, num_threads: int, model_dir: str) -> None:
+        super().__init__(num_threads)
+        self.model_dir = model_dir
+        self._session = None
+        self._input_name = ""
+
+    def load(self) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("Для CLASSIFIER_BACKEND=onnx установите пакет onnxruntime.")
+        if not self.model_dir:
+            raise RuntimeError("LOCAL_MODEL_DIR не задан: укажите каталог с model.onnx.")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(
+            os.path.join(self.model_dir, "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_name = self._session.get_inputs()[0].name
+        self.labels = _load_labels(self.model_dir)
+
+    def predict_logits(self, batch: np.ndarray) -> np.ndarray:
+        return self._session.run(None, {self._input_name: batch})[0]
+
+
+class TorchClassifier(LocalClassifier):
+    """Классификатор на PyTorch через transformers."""
+
+    name = "torch"
+
+    def __init__(self, num_threads: int, model_dir: str, model_id: str) -> None:
+        super().__init__(num_threads)
+        self.source = model_dir or model_id
+        self._model = None
+        self._torch = None
+
+    def load(self) -> None:
+        try:
+            import torch
+            from transformers import AutoModelForImageClassification
+        except ImportError:
+            raise RuntimeError("Для CLASSIFIER_BACKEND=torch установите пакеты torch и transformers.")
+
+        torch.set_num_threads(self.num_threads)
+        self._torch = torch
+        self._model = AutoModelForImageClassification.from_pretrained(self.source).eval()
+        id2label = self._model.config.id2label
+        self.labels = [id2label[i] for i in range(len(id2label))]
+
+    def predict_logits(self, batch: np.ndarray) -> np.ndarray:
+        with self._torch.inference_mode():
+            output = self._model(pixel_values=self._torch.from_numpy(batch))
+        return output.logits.numpy()
+
+
+class DummyClassifier(LocalClassifier):
+    """Детерминированная линейная модель над средними по цветовым каналам."""
+
+    name = "dummy"
+
+    LABELS = [
+        "BMW M3 Coupe 2012",
+        "Audi R8 Coupe 2012",
+        "Tesla Model S Sedan 2012",
+        "Ford Mustang Convertible 2007",
+        "Chevrolet Corvette ZR1 2012",
+    ]
+
+    def __init__(self, num_threads: int) -> None:
+        super().__init__(num_threads)
+        self._weights: Optional[np.ndarray] = None
+
+    def load(self) -> None:
+        rng = np.random.default_rng(0)
+        self._weights = rng.standard_normal((3, len(self.LABELS))).astype(np.float32)
+        self.labels = list(self.LABELS)
+
+    def predict_logits(self, batch: np.ndarray) -> np.ndarray:
+        return batch.mean(axis=(2, 3)) @ self._weights * 10.0
+
+
+BACKENDS = ("onnx", "torch", "dummy")
+
+_model: Optional[LocalClassifier] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_batcher: Optional[MicroBatcher] = None
+
+
+def _create(name: str) -> LocalClassifier:
+    if name == "onnx":
+        return OnnxClassifier(LOCAL_NUM_THREADS, LOCAL_MODEL_DIR)
+    if name == "torch":
+        return TorchClassifier(LOCAL_NUM_THREADS, LOCAL_MODEL_DIR, MODEL_ID)
+    if name == "dummy":
+        return DummyClassifier(LOCAL_NUM_THREADS)
+    raise ValueError(f"Неизвестный локальный бэкенд: {name}. Допустимы: {', '.join(BACKENDS)}.")
+
+
+def _run_batch(arrays: list[np.ndarray]) -> list[list[Prediction]]:
+    """Выполняет один пакетный прямой проход по набору тензоров."""
+    return _model.classify_batch(np.stack(arrays))
+
+
+def load(name: str) -> None:
+    """Загружает локальную модель и запускает батчер.
+
+    Вызывается один раз при старте приложения из работающего event loop.
+    """
+    global _model, _executor, _batcher
+    model = _create(name)
+    model.load()
+    _model = model
+    # Один поток исполнения: параллелизм обеспечивают внутренние потоки рантайма
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-inference")
+    _batcher = MicroBatcher(_run_batch, LOCAL_BATCH_MAX_SIZE, LOCAL_BATCH_MAX_WAIT_MS, _executor)
+    _batcher.start()
+    logger.info(
+        "Загружена локальная модель: backend=%s, классов=%d, потоков=%d, пакет до %d за %.1f мс",
+        name, len(model.labels), LOCAL_NUM_THREADS, LOCAL_BATCH_MAX_SIZE, LOCAL_BATCH_MAX_WAIT_MS,
+    )
+
+
+async def unload() -> None:
+    """Останавливает батчер, выгружает модель и поток исполнения."""
+    global _model, _executor, _batcher
+    if _batcher is not None:
+        await _batcher.stop()
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+    _model = None
+    _executor = None
+    _batcher = None
+
+
+def get_batcher_stats() -> dict:
+    """Возвращает статистику микробатчера (заполнение пакетов, задержка в очереди)."""
+    return _batcher.get_stats() if _batcher is not None else {}
+
+
+async def classify_image(image_path: str) -> list[Prediction]:
+    """Классифицирует изображение локальной моделью.
+
+    Декодирование выполняется в пуле предобработки, а прямой проход —
+    пакетом вместе с другими конкурентными запросами (микробатчинг).
+
+    Args:
+        image_path: Путь к файлу изображения.
+
+    Returns:
+        Список из top-3 предсказаний, отсортированных по убыванию confidence.
+
+    Raises:
+        RuntimeError: Если модель не загружена или изображение не читается.
+    """
+    if _model is None or _batcher is None:
+        raise RuntimeError("Локальная модель не загружена.")
+    try:
+        array = await image_processor.load_for_model_async(image_path)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Ошибка локального распознавания: {str(e)}")
+    return await _batcher.submit(array)
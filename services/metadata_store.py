@@ -1,45 +1,156 @@
-"""Сервис для работы с JSON-хранилищем метаданных изображений."""
+"""Сервис для работы с хранилищем метаданных изображений.
+
+Хранилище подключаемое: бэкенд выбирается переменной окружения
+METADATA_BACKEND (sqlite — по умолчанию, json — исторический формат).
+
+Производные структуры (агрегаты статистики, индексы) подписываются на
+изменения через add_listener: слушатель получает запись до и после
+изменения (None для добавления и удаления соответственно).
+
+Слушатели получают изменения из потока изменений бэкенда (sync()), куда
+попадают и изменения других процессов (воркеры uvicorn), поэтому чужие
+изменения применяются к производным структурам так же, как свои, без
+перестроения. Структура строится полным проходом по snapshot(). Слушатели
+сброса (add_reset_listener) вызываются, только если часть чужих изменений
+восстановить нельзя: тогда производные структуры строятся заново.
+"""
 
-import json
 import logging
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from dataclasses import replace
+from typing import Any, Callable, Iterator, Optional
 
 from models.schemas import ImageMetadata, Prediction
+from services import metrics
+from services.storage import ImageQuery, MetadataBackend, create_backend, sort_key
+from services.storage.migrate import migrate_if_needed
 
 logger = logging.getLogger(__name__)
 
+METADATA_BACKEND = os.getenv("METADATA_BACKEND", "sqlite")
 METADATA_FILE = os.getenv("METADATA_FILE", "metadata.json")
+METADATA_DB = os.getenv("METADATA_DB", "metadata.db")
+# Период (в секундах) сворачивания журнала JSON-бэкенда в снимок
+METADATA_FLUSH_INTERVAL = float(os.getenv("METADATA_FLUSH_INTERVAL", "2.0"))
+
+_backend: Optional[MetadataBackend] = None
+
+_OPERATION_SECONDS = metrics.histogram(
+    "metadata_store_operation_duration_seconds",
+    "Длительность операций хранилища метаданных",
+    ("operation",),
+)
+
+# Слушатель изменений: (запись до изменения, запись после изменения)
+ChangeListener = Callable[[Optional[dict], Optional[dict]], None]
+_listeners: list[ChangeListener] = []
+_reset_listeners: list[Callable[[], None]] = []
+# Изменения передаются слушателям одним потоком за раз, в порядке применения
+_sync_lock = threading.RLock()
+
+
+def add_listener(listener: ChangeListener) -> None:
+    """Подписывает слушателя на добавление, изменение и удаление записей."""
+    _listeners.append(listener)
+
+
+def add_reset_listener(listener: Callable[[], None]) -> None:
+    """Подписывает слушателя, сбрасывающего производные структуры, если изменения потеряны."""
+    _reset_listeners.append(listener)
 
 
-def _load_metadata() -> list[dict]:
-    """Загружает метаданные из JSON-файла."""
-    if not os.path.exists(METADATA_FILE):
-        return []
-    try:
-        with open(METADATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        logger.error("Ошибка чтения файла метаданных")
-        return []
+def _deliver(changes: Optional[list[tuple[Optional[dict], Optional[dict]]]]) -> bool:
+    if changes is None:
+        logger.warning("Часть изменений других процессов недоступна: производные структуры будут построены заново")
+        for listener in _reset_listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("Ошибка слушателя сброса метаданных")
+        return True
+    for old, new in changes:
+        _notify(old, new)
+    return bool(changes)
+
+
+def sync() -> bool:
+    """Передаёт слушателям изменения хранилища (своего и других процессов), которых они ещё не получили.
+
+    Returns:
+        True, если изменения были.
+    """
+    with _sync_lock:
+        return _deliver(_get_backend().consume_changes())
+
+
+@contextmanager
+def snapshot() -> Iterator[Iterator[dict]]:
+    """Полный проход по записям для построения производной структуры.
+
+    Изменения, уже вошедшие в снимок, передаются слушателям до входа в блок,
+    а остальные — после выхода из него: структура, построенная внутри блока,
+    получит ровно те изменения, которых в снимке нет.
+    """
+    with _sync_lock:
+        with _get_backend().snapshot() as (position, records):
+            _deliver(_get_backend().consume_changes(until=position))
+            yield records
 
 
-def _save_metadata(data: list[dict]) -> None:
-    """Сохраняет метаданные в JSON-файл."""
-    with open(METADATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+def _notify(old: Optional[dict], new: Optional[dict]) -> None:
+    for listener in _listeners:
+        try:
+            listener(old, new)
+        except Exception:
+            logger.exception("Ошибка слушателя изменений метаданных")
+
+
+def _get_backend() -> MetadataBackend:
+    """Возвращает бэкенд хранилища, создавая его при первом обращении."""
+    global _backend
+    if _backend is None:
+        if METADATA_BACKEND == "json":
+            _backend = create_backend(
+                "json", METADATA_FILE, flush_interval=METADATA_FLUSH_INTERVAL
+            )
+        else:
+            if METADATA_BACKEND == "sqlite":
+                # Существующая установка с metadata.json не должна стартовать с пустой базой
+                migrate_if_needed(METADATA_FILE, METADATA_DB)
+            _backend = create_backend(METADATA_BACKEND, METADATA_DB)
+        logger.info("Хранилище метаданных: %s", _backend.name)
+    return _backend
+
+
+def close() -> None:
+    """Закрывает бэкенд хранилища, сбрасывая на диск отложенные изменения."""
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+
+
+def get_version() -> tuple[str, datetime]:
+    """Возвращает версию данных хранилища и время последнего изменения (UTC)."""
+    return _get_backend().version()
 
 
 def get_next_id() -> int:
     """Возвращает следующий доступный ID."""
-    data = _load_metadata()
-    if not data:
-        return 1
-    return max(item["id"] for item in data) + 1
+    return _get_backend().next_id()
 
 
-def add_image(filename: str, path: str, mime_type: str, size_bytes: int) -> ImageMetadata:
+def add_image(
+    filename: str,
+    path: str,
+    mime_type: str,
+    size_bytes: int,
+    sha256: Optional[str] = None,
+    phash: Optional[str] = None,
+) -> ImageMetadata:
     """Добавляет запись о новом изображении.
 
     Args:
@@ -47,41 +158,122 @@ def add_image(filename: str, path: str, mime_type: str, size_bytes: int) -> Imag
         path: Путь к файлу.
         mime_type: MIME-тип файла.
         size_bytes: Размер файла в байтах.
+        sha256: SHA-256 хеш содержимого.
+        phash: Перцептивный хеш изображения.
 
     Returns:
         Метаданные добавленного изображения.
     """
-    data = _load_metadata()
-    new_id = get_next_id()
-    record = {
-        "id": new_id,
-        "filename": filename,
-        "path": path,
-        "upload_date": datetime.now().isoformat(),
-        "processed": False,
-        "results": None,
-        "mime_type": mime_type,
-        "size_bytes": size_bytes,
-    }
-    data.append(record)
-    _save_metadata(data)
-    logger.info("Добавлено изображение: %s (id=%d)", filename, new_id)
+    with _OPERATION_SECONDS.labels("add").time():
+        record = _get_backend().add({
+            "filename": filename,
+            "path": path,
+            "upload_date": datetime.now().isoformat(),
+            "processed": False,
+            "results": None,
+            "mime_type": mime_type,
+            "size_bytes": size_bytes,
+            "sha256": sha256,
+            "phash": phash,
+        })
+    sync()
+    logger.info("Добавлено изображение: %s (id=%d)", filename, record["id"])
     return ImageMetadata(**record)
 
 
 def get_all() -> list[ImageMetadata]:
     """Возвращает все записи метаданных."""
-    data = _load_metadata()
-    return [ImageMetadata(**item) for item in data]
+    return [ImageMetadata(**item) for item in _get_backend().all()]
+
+
+def iter_records(query: Optional[ImageQuery] = None, batch_size: int = 500) -> Iterator[dict]:
+    """Последовательно выдаёт записи в формате бэкенда, читая их страницами.
+
+    Используется там, где Pydantic-модели не нужны: экспорт, перестроение
+    производных структур (агрегатов, индексов).
+
+    Args:
+        query: Фильтры и сортировка (по умолчанию — все записи по ID).
+        batch_size: Размер страницы чтения из хранилища.
+    """
+    query = replace(query or ImageQuery(), after=None, limit=batch_size)
+    while True:
+        with _OPERATION_SECONDS.labels("query").time():
+            records = _get_backend().query(query)
+        yield from records
+        if len(records) < batch_size:
+            return
+        query = replace(query, after=sort_key(records[-1], query.sort))
+
+
+def query_images(query: ImageQuery) -> tuple[list[ImageMetadata], Optional[tuple[Any, int]]]:
+    """Возвращает страницу записей по фильтрам и ключ для следующей страницы.
+
+    Args:
+        query: Фильтры, сортировка, курсор и размер страницы (limit).
+
+    Returns:
+        Записи страницы и ключ последней из них (None, если страница последняя).
+    """
+    if query.limit is None:
+        with _OPERATION_SECONDS.labels("query").time():
+            records = _get_backend().query(query)
+        return [ImageMetadata(**item) for item in records], None
+
+    with _OPERATION_SECONDS.labels("query").time():
+        records = _get_backend().query(replace(query, limit=query.limit + 1))
+    has_more = len(records) > query.limit
+    records = records[:query.limit]
+    next_key = sort_key(records[-1], query.sort) if has_more else None
+    return [ImageMetadata(**item) for item in records], next_key
+
+
+def iter_images(query: ImageQuery, batch_size: int = 500) -> Iterator[ImageMetadata]:
+    """Последовательно выдаёт все записи по фильтрам, читая их страницами.
+
+    Args:
+        query: Фильтры и сортировка (limit и after игнорируются).
+        batch_size: Размер страницы чтения из хранилища.
+    """
+    for record in iter_records(query, batch_size):
+        yield ImageMetadata(**record)
 
 
 def get_by_id(image_id: int) -> Optional[ImageMetadata]:
     """Возвращает метаданные по ID."""
-    data = _load_metadata()
-    for item in data:
-        if item["id"] == image_id:
-            return ImageMetadata(**item)
-    return None
+    item = _get_backend().get(image_id)
+    return ImageMetadata(**item) if item else None
+
+
+def get_many(image_ids: list[int]) -> list[ImageMetadata]:
+    """Возвращает найденные записи с данными ID (в порядке возрастания ID)."""
+    with _OPERATION_SECONDS.labels("get_many").time():
+        records = _get_backend().get_many(image_ids)
+    return [ImageMetadata(**item) for item in records]
+
+
+def select_ids(query: Optional[ImageQuery] = None) -> list[int]:
+    """Возвращает ID всех записей, удовлетворяющих фильтрам."""
+    return [record["id"] for record in iter_records(query)]
+
+
+def count_by_hash(sha256: str) -> int:
+    """Возвращает число записей, ссылающихся на содержимое с данным хешем."""
+    return _get_backend().count_by_hash(sha256)
+
+
+def get_by_hash(sha256: str) -> Optional[ImageMetadata]:
+    """Возвращает любую запись, ссылающуюся на содержимое с данным хешем."""
+    item = _get_backend().find_by_hash(sha256)
+    return ImageMetadata(**item) if item else None
+
+
+def get_results_by_hash(sha256: str) -> Optional[list[Prediction]]:
+    """Возвращает сохранённые результаты распознавания для содержимого с данным хешем."""
+    item = _get_backend().find_processed_by_hash(sha256)
+    if item is None:
+        return None
+    return [Prediction(**result) for result in item["results"]]
 
 
 def update_results(image_id: int, results: list[Prediction]) -> Optional[ImageMetadata]:
@@ -94,15 +286,16 @@ def update_results(image_id: int, results: list[Prediction]) -> Optional[ImageMe
     Returns:
         Обновлённые метаданные или None если не найдено.
     """
-    data = _load_metadata()
-    for item in data:
-        if item["id"] == image_id:
-            item["processed"] = True
-            item["results"] = [r.model_dump() for r in results]
-            _save_metadata(data)
-            logger.info("Обновлены результаты для id=%d", image_id)
-            return ImageMetadata(**item)
-    return None
+    with _OPERATION_SECONDS.labels("update").time():
+        item = _get_backend().update(image_id, {
+            "processed": True,
+            "results": [r.model_dump() for r in results],
+        })
+    if item is None:
+        return None
+    sync()
+    logger.info("Обновлены результаты для id=%d", image_id)
+    return ImageMetadata(**item)
 
 
 def delete_by_id(image_id: int) -> bool:
@@ -111,22 +304,75 @@ def delete_by_id(image_id: int) -> bool:
     Returns:
         True если запись была удалена, False если не найдена.
     """
-    data = _load_metadata()
-    new_data = [item for item in data if item["id"] != image_id]
-    if len(new_data) == len(data):
+    with _OPERATION_SECONDS.labels("delete").time():
+        deleted = _get_backend().delete(image_id)
+    if not deleted:
         return False
-    _save_metadata(new_data)
+    sync()
     logger.info("Удалена запись id=%d", image_id)
     return True
 
 
 def reset_results(image_id: int) -> Optional[ImageMetadata]:
     """Сбрасывает результаты распознавания (для повторной обработки)."""
-    data = _load_metadata()
-    for item in data:
-        if item["id"] == image_id:
-            item["processed"] = False
-            item["results"] = None
-            _save_metadata(data)
-            return ImageMetadata(**item)
-    return None
+    with _OPERATION_SECONDS.labels("update").time():
+        item = _get_backend().update(image_id, {"processed": False, "results": None})
+    if item is None:
+        return None
+    sync()
+    return ImageMetadata(**item)
+
+
+def set_phash(image_id: int, phash: str) -> Optional[ImageMetadata]:
+    """Сохраняет перцептивный хеш изображения (для записей, загруженных без него)."""
+    with _OPERATION_SECONDS.labels("update").time():
+        item = _get_backend().update(image_id, {"phash": phash})
+    if item is None:
+        return None
+    sync()
+    return ImageMetadata(**item)
+
+
+def update_results_many(results: dict[int, list[Prediction]]) -> list[ImageMetadata]:
+    """Сохраняет результаты распознавания нескольких изображений одной транзакцией.
+
+    Args:
+        results: ID изображения -> список предсказаний.
+
+    Returns:
+        Обновлённые записи (ненайденные ID пропускаются).
+    """
+    with _OPERATION_SECONDS.labels("update_many").time():
+        changes = _get_backend().set_results_many({
+            image_id: [r.model_dump() for r in predictions]
+            for image_id, predictions in results.items()
+        })
+    sync()
+    logger.info("Обновлены результаты для %d записей", len(changes))
+    return [ImageMetadata(**new) for _, new in changes]
+
+
+def reset_results_many(image_ids: list[int]) -> list[ImageMetadata]:
+    """Сбрасывает результаты распознавания нескольких изображений одной транзакцией.
+
+    Returns:
+        Обновлённые записи (ненайденные ID пропускаются).
+    """
+    with _OPERATION_SECONDS.labels("update_many").time():
+        changes = _get_backend().update_many(image_ids, {"processed": False, "results": None})
+    sync()
+    logger.info("Сброшены результаты для %d записей", len(changes))
+    return [ImageMetadata(**new) for _, new in changes]
+
+
+def delete_many(image_ids: list[int]) -> list[ImageMetadata]:
+    """Удаляет записи одной транзакцией.
+
+    Returns:
+        Удалённые записи (ненайденные ID пропускаются).
+    """
+    with _OPERATION_SECONDS.labels("delete_many").time():
+        deleted = _get_backend().delete_many(image_ids)
+    sync()
+    logger.info("Удалено записей: %d", len(deleted))
+    return [ImageMetadata(**record) for record in deleted]
@@ -0,0 +1,310 @@
+"""Метрики приложения в формате Prometheus.
+
+Небольшой реестр счётчиков, измерителей (gauge) и гистограмм с метками,
+которые используют роутеры и сервисы, и ASGI-middleware с задержкой
+обработки по маршрутам. Значения отдаются текстом на GET /metrics.
+
+При METRICS_ENABLED=false все операции с метриками сводятся к проверке
+флага, а эндпоинт /metrics отвечает 404.
+"""
+
+import bisect
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Границы корзин гистограмм задержек по умолчанию, секунды
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы корзин гистограмм размеров, байты
+SIZE_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Возвращает дочернюю метрику для значений меток."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with _lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        if METRICS_ENABLED:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        if METRICS_ENABLED:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        if METRICS_ENABLED:
+            self.value = value
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def get(self, *values: str) -> float:
+        """Текущее значение для значений меток (0, если ещё не было)."""
+        child = self._children.get(tuple(str(value) for value in values))
+        return child.value if child is not None else 0.0
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in sorted(self._children.items())
+        ]
+
+
+class Gauge(Counter):
+    """Измеритель текущего значения; может вычисляться при каждом опросе."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: tuple[str, ...] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.callback = callback
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def _samples(self) -> list[str]:
+        if self.callback is not None:
+            return [f"{self.name} {_format_value(self.callback())}"]
+        return super()._samples()
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        if METRICS_ENABLED:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        """Контекстный менеджер, измеряющий длительность блока."""
+        return _Timer(self)
+
+    def snapshot(self) -> dict:
+        """Значения для JSON-ответов: число, сумма, среднее и счётчики корзин."""
+        buckets = {_format_value(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class _Timer:
+    __slots__ = ("_target", "_start")
+
+    def __init__(self, target: _Buckets) -> None:
+        self._target = target
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        if METRICS_ENABLED:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if METRICS_ENABLED:
+            self._target.observe(time.perf_counter() - self._start)
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными верхними границами корзин."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, child in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+_registry: dict[str, _Metric] = {}
+
+
+def _register(metric: _Metric) -> _Metric:
+    with _lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, description: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    """Создаёт (или возвращает зарегистрированный) счётчик."""
+    return _register(Counter(name, description, labelnames))
+
+
+def gauge(
+    name: str,
+    description: str,
+    labelnames: tuple[str, ...] = (),
+    callback: Optional[Callable[[], float]] = None,
+) -> Gauge:
+    """Создаёт измеритель; callback вычисляет значение при каждом опросе."""
+    return _register(Gauge(name, description, labelnames, callback))
+
+
+def histogram(
+    name: str,
+    description: str,
+    labelnames: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = LATENCY_BUCKETS,
+) -> Histogram:
+    """Создаёт (или возвращает зарегистрированную) гистограмму."""
+    return _register(Histogram(name, description, labelnames, buckets))
+
+
+def render() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    with _lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "Длительность обработки HTTP-запросов по маршрутам",
+    ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "Обрабатываемые сейчас HTTP-запросы")
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка запросов по шаблону маршрута и число запросов в обработке.
+
+    Длительность включает отправку тела ответа, в том числе потокового.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if not METRICS_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # Шаблон маршрута вместо пути, чтобы ID не раздували число рядов
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, status).observe(
+                time.perf_counter() - start
+            )
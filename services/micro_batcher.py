@@ -0,0 +1,158 @@
+"""Динамический микробатчинг запросов к локальной модели.
+
+Конкурентные запросы на распознавание складываются в очередь; цикл
+батчера собирает их, пока не наберётся max_batch_size элементов или не
+истечёт max_wait_ms с момента прихода первого, и выполняет один пакетный
+прямой проход в рабочем потоке. Результат каждого элемента возвращается
+ожидающему его вызывающему коду.
+
+Гистограммы заполнения пакетов и задержки в очереди регистрируются в
+services.metrics и отдаются также на /metrics.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+_BATCH_FILL = metrics.histogram(
+    "local_batch_size", "Размер пакетов локального инференса", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+_QUEUE_DELAY = metrics.histogram(
+    "local_batch_queue_delay_seconds",
+    "Ожидание элемента в очереди микробатчера",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+class MicroBatcher:
+    """Собирает одиночные запросы в пакеты для векторизованного инференса.
+
+    Args:
+        run_batch: Синхронная функция обработки пакета; возвращает результаты
+            в порядке входных элементов.
+        max_batch_size: Максимальный размер пакета.
+        max_wait_ms: Максимальное ожидание добора пакета после первого элемента.
+        executor: Пул потоков, в котором выполняется run_batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[Any]], list[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.run_batch = run_batch
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max(max_wait_ms, 0.0) / 1000
+        self.executor = executor
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # Элементы, снятые с очереди в собираемый пакет, и выполняемый пакет
+        self._batch: list[tuple] = []
+        self._in_flight: Optional[asyncio.Future] = None
+        self.batch_fill = _BATCH_FILL.labels()
+        self.queue_delay = _QUEUE_DELAY.labels()
+        self.batches = 0
+
+    def start(self) -> None:
+        """Запускает цикл сборки пакетов в текущем event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает цикл.
+
+        Выполняемый пакет дорабатывает, и его элементы получают результаты;
+        элементы собираемого пакета и очереди завершаются ошибкой.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight is not None:
+            await self._in_flight
+            self._in_flight = None
+        pending = self._batch
+        self._batch = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Батчер остановлен."))
+
+    async def submit(self, item: Any) -> Any:
+        """Ставит элемент в очередь и ожидает его результат."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((item, future, loop.time()))
+        return await future
+
+    async def _collect(self) -> None:
+        """Собирает пакет в self._batch: ждёт первый элемент, затем добирает до лимита или таймаута."""
+        loop = asyncio.get_running_loop()
+        self._batch.append(await self._queue.get())
+        deadline = loop.time() + self.max_wait
+        while len(self._batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _complete(self, batch: list[tuple]) -> None:
+        """Выполняет пакет в пуле потоков и передаёт результаты ожидающим."""
+        loop = asyncio.get_running_loop()
+        items = [item for item, _, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, self.run_batch, items)
+        except Exception as e:
+            logger.error("Ошибка пакетного инференса (%d элементов): %s", len(batch), str(e))
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Ошибка пакетного инференса: {str(e)}"))
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._collect()
+            started = loop.time()
+            # Вызывающий код мог перестать ждать (отмена запроса)
+            batch = [entry for entry in self._batch if not entry[1].done()]
+            self._batch = []
+            if not batch:
+                continue
+            for _, _, enqueued_at in batch:
+                self.queue_delay.observe(started - enqueued_at)
+            self.batch_fill.observe(len(batch))
+            self.batches += 1
+
+            # Пакет дорабатывает и при остановке цикла: stop() дожидается его
+            self._in_flight = asyncio.ensure_future(self._complete(batch))
+            await asyncio.shield(self._in_flight)
+            self._in_flight = None
+
+    def get_stats(self) -> dict:
+        """Возвращает настройки и гистограммы заполнения пакетов и задержки в очереди."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "queue_size": self._queue.qsize(),
+            "batch_fill": self.batch_fill.snapshot(),
+            "queue_delay_seconds": self.queue_delay.snapshot(),
+        }
@@ -0,0 +1,249 @@
+"""Индекс перцептивных хешей для поиска почти одинаковых изображений.
+
+64-битные pHash записей хранятся в BK-дереве по расстоянию Хэмминга:
+поиск соседей в радиусе d обходит только поддеревья, рёбра которых
+лежат в [dist - d, dist + d], а не все хеши. Индекс обновляется
+слушателем изменений metadata_store, строится полным проходом при
+первом обращении и сбрасывается, только если часть изменений других
+процессов потеряна (см. metadata_store.sync).
+
+Удалённые хеши остаются в дереве без записей и пропускаются при поиске;
+когда таких становится больше, чем живых, дерево перестраивается.
+
+Заполнение хешей для записей, загруженных до их появления:
+    python -m services.phash_index
+"""
+
+import logging
+import threading
+from typing import Iterator, Optional
+
+from services import metadata_store
+
+logger = logging.getLogger(__name__)
+
+
+def hamming(a: int, b: int) -> int:
+    """Расстояние Хэмминга между 64-битными хешами."""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """BK-дерево целочисленных хешей по расстоянию Хэмминга."""
+
+    def __init__(self) -> None:
+        # Узел: (хеш, потомки по расстоянию до хеша узла)
+        self._root: Optional[tuple[int, dict[int, tuple]]] = None
+        self.size = 0
+
+    def add(self, value: int) -> None:
+        """Добавляет хеш (повторное добавление игнорируется)."""
+        if self._root is None:
+            self._root = (value, {})
+            self.size = 1
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> Iterator[tuple[int, int]]:
+        """Выдаёт хеши дерева в радиусе max_distance и расстояния до них."""
+        if self._root is None:
+            return
+        stack = [self._root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                yield node_value, distance
+            # Неравенство треугольника: вне [d - r, d + r] соседей нет
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+
+
+class PhashIndex:
+    """Записи по перцептивному хешу с поиском соседей через BK-дерево."""
+
+    def __init__(self) -> None:
+        self.tree = BKTree()
+        self.ids: dict[int, set[int]] = {}
+
+    def _add(self, record: dict) -> None:
+        value = int(record["phash"], 16)
+        if value not in self.ids:
+            self.ids[value] = set()
+            self.tree.add(value)
+        self.ids[value].add(record["id"])
+
+    def _remove(self, record: dict) -> None:
+        value = int(record["phash"], 16)
+        ids = self.ids.get(value)
+        if ids is None:
+            return
+        ids.discard(record["id"])
+        if not ids:
+            del self.ids[value]
+            # Хеш остаётся в дереве; перестраиваем, когда удалённых больше, чем живых
+            if self.tree.size > 2 * len(self.ids) + 64:
+                self.tree = BKTree()
+                for live in self.ids:
+                    self.tree.add(live)
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Учитывает изменение записи."""
+        old_hash = old.get("phash") if old is not None else None
+        new_hash = new.get("phash") if new is not None else None
+        if old_hash == new_hash:
+            return
+        if old_hash:
+            self._remove(old)
+        if new_hash:
+            self._add(new)
+
+    def search(self, value: int, max_distance: int) -> Iterator[tuple[int, int]]:
+        """Выдаёт живые хеши в радиусе max_distance и расстояния до них."""
+        for found, distance in self.tree.search(value, max_distance):
+            if found in self.ids:
+                yield found, distance
+
+
+_index: Optional[PhashIndex] = None
+_lock = threading.Lock()
+
+
+def _build(records: Iterator[dict]) -> PhashIndex:
+    index = PhashIndex()
+    for record in records:
+        index.apply(None, record)
+    return index
+
+
+def _on_change(old: Optional[dict], new: Optional[dict]) -> None:
+    with _lock:
+        # До первого обращения индекса нет: он будет построен полным проходом
+        if _index is not None:
+            _index.apply(old, new)
+
+
+def _on_reset() -> None:
+    global _index
+    with _lock:
+        _index = None
+
+
+metadata_store.add_listener(_on_change)
+metadata_store.add_reset_listener(_on_reset)
+
+
+def _get() -> PhashIndex:
+    global _index
+    metadata_store.sync()
+    with _lock:
+        if _index is not None:
+            return _index
+    with metadata_store.snapshot() as records, _lock:
+        if _index is None:
+            _index = _build(records)
+            logger.info("Построен индекс перцептивных хешей: %d хешей", len(_index.ids))
+        return _index
+
+
+def find_similar(phash: str, max_distance: int, exclude: Optional[int] = None) -> list[tuple[int, int]]:
+    """Находит изображения с перцептивным хешем в радиусе max_distance.
+
+    Args:
+        phash: Перцептивный хеш (16 шестнадцатеричных цифр).
+        max_distance: Максимальное расстояние Хэмминга (из 64 бит).
+        exclude: ID записи, которую не включать в результат.
+
+    Returns:
+        Пары (ID, расстояние), от ближайших к дальним.
+    """
+    index = _get()
+    with _lock:
+        matches = [
+            (image_id, distance)
+            for value, distance in index.search(int(phash, 16), max_distance)
+            for image_id in index.ids[value]
+            if image_id != exclude
+        ]
+    matches.sort(key=lambda match: (match[1], match[0]))
+    return matches
+
+
+def clusters(max_distance: int) -> list[list[int]]:
+    """Группирует изображения, связанные цепочками соседей в радиусе max_distance.
+
+    Returns:
+        Группы из двух и более ID (по возрастанию), крупные — первыми.
+    """
+    index = _get()
+    with _lock:
+        hashes = list(index.ids)
+        parent = {value: value for value in hashes}
+
+        def root(value: int) -> int:
+            while parent[value] != value:
+                parent[value] = parent[parent[value]]
+                value = parent[value]
+            return value
+
+        for value in hashes:
+            for neighbour, _ in index.search(value, max_distance):
+                parent[root(neighbour)] = root(value)
+
+        groups: dict[int, list[int]] = {}
+        for value in hashes:
+            groups.setdefault(root(value), []).extend(index.ids[value])
+    result = [sorted(ids) for ids in groups.values() if len(ids) > 1]
+    result.sort(key=lambda ids: (-len(ids), ids[0]))
+    return result
+
+
+def get_state() -> dict:
+    """Размер индекса для мониторинга."""
+    index = _get()
+    with _lock:
+        return {
+            "hashes": len(index.ids),
+            "images": sum(len(ids) for ids in index.ids.values()),
+            "tree_nodes": index.tree.size,
+        }
+
+
+def backfill() -> int:
+    """Вычисляет перцептивные хеши для записей без них.
+
+    Returns:
+        Количество записей, которым добавлен хеш.
+    """
+    from services import image_processor
+
+    missing = [record for record in metadata_store.iter_records() if not record.get("phash")]
+    filled = 0
+    for record in missing:
+        try:
+            phash = image_processor.perceptual_hash(record["path"])
+        except (OSError, ValueError) as e:
+            logger.warning("Пропущена запись id=%d: %s", record["id"], str(e))
+            continue
+        metadata_store.set_phash(record["id"], phash)
+        filled += 1
+    return filled
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    try:
+        print(f"Добавлено перцептивных хешей: {backfill()}")
+    finally:
+        metadata_store.close()
@@ -0,0 +1,289 @@
+"""Персистентный кеш предсказаний (второй уровень после in-memory LRU).
+
+Хранится в SQLite (режим WAL), поэтому переживает перезапуски и безопасно
+разделяется между несколькими воркерами uvicorn. Ключ — SHA-256 хеш файла
+и идентификатор модели; записи вытесняются по суммарному размеру (сначала
+давно не использовавшиеся). При смене модели кеш сбрасывается.
+
+Записи старше TTL не отдаются как попадания, но хранятся ещё
+PREDICTION_CACHE_STALE_SECONDS для ответа, пока API недоступен
+(serve-stale); такие записи удаляются периодически, а не при каждой записи.
+
+Event loop обращается к кешу через get_async/put_async: запросы к SQLite
+выполняются в отдельном потоке.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from models.schemas import Prediction
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_CACHE_DB = os.getenv("PREDICTION_CACHE_DB", "prediction_cache.db")
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 0 — записи не устаревают
+PREDICTION_CACHE_TTL_SECONDS = int(os.getenv("PREDICTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# Сколько записи хранятся после истечения TTL для ответа при недоступности API
+PREDICTION_CACHE_STALE_SECONDS = int(os.getenv("PREDICTION_CACHE_STALE_SECONDS", str(7 * 24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    file_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (file_hash, model)
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_accessed ON predictions(accessed_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_created ON predictions(created_at);
+CREATE TABLE IF NOT EXISTS cache_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Сколько самых старых записей удалять за один шаг вытеснения
+_EVICTION_BATCH = 64
+
+# Период удаления записей, устаревших окончательно (TTL + STALE), секунды
+PURGE_INTERVAL_SECONDS = 3600
+
+# Поток запросов к кешу из event loop: соединение всё равно используется под блокировкой
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prediction-cache")
+
+
+class PredictionCache:
+    """Кеш предсказаний в SQLite с вытеснением по размеру и TTL."""
+
+    def __init__(
+        self, path: str, model: str, max_bytes: int, ttl_seconds: int, stale_seconds: int = 0
+    ) -> None:
+        self.path = path
+        self.model = model
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = max(stale_seconds, 0)
+        self._purged_at = 0.0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._invalidate_other_models()
+
+    def _invalidate_other_models(self) -> None:
+        """Удаляет записи, вычисленные другой моделью."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM cache_meta WHERE key = 'model'"
+                ).fetchone()
+                if row is None or row[0] != self.model:
+                    removed = self._conn.execute(
+                        "DELETE FROM predictions WHERE model != ?", (self.model,)
+                    ).rowcount
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('model', ?)",
+                        (self.model,),
+                    )
+                    self._write_total(self._read_total_from_rows())
+                    if removed:
+                        self.stats["invalidations"] += removed
+                        logger.info("Модель изменилась: удалено %d записей кеша", removed)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _read_total(self) -> int:
+        row = self._conn.execute(
+            "SELECT value FROM cache_meta WHERE key = 'total_bytes'"
+        ).fetchone()
+        return int(row[0]) if row else self._read_total_from_rows()
+
+    def _read_total_from_rows(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+
+    def _write_total(self, total: int) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('total_bytes', ?)",
+            (str(total),),
+        )
+
+    def get(self, file_hash: str, allow_stale: bool = False) -> Optional[list[Prediction]]:
+        """Возвращает предсказания из кеша или None.
+
+        Args:
+            file_hash: SHA-256 хеш файла.
+            allow_stale: Возвращать и записи с истёкшим TTL (ещё не вытесненные) —
+                для ответа, пока API недоступен.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, created_at FROM predictions WHERE file_hash = ? AND model = ?",
+                (file_hash, self.model),
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            payload, created_at = row
+            if not allow_stale and self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute(
+                "UPDATE predictions SET accessed_at = ? WHERE file_hash = ? AND model = ?",
+                (now, file_hash, self.model),
+            )
+            self.stats["hits"] += 1
+        return [Prediction(**item) for item in json.loads(payload)]
+
+    def put(self, file_hash: str, predictions: list[Prediction]) -> None:
+        """Сохраняет предсказания, вытесняя давно не использовавшиеся записи.
+
+        Раз в PURGE_INTERVAL_SECONDS удаляются и записи старше TTL + STALE.
+        """
+        payload = json.dumps([p.model_dump() for p in predictions], ensure_ascii=False)
+        size = len(payload.encode("utf-8")) + len(file_hash)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._conn.execute(
+                    "SELECT size FROM predictions WHERE file_hash = ? AND model = ?",
+                    (file_hash, self.model),
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO predictions "
+                    "(file_hash, model, payload, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_hash, self.model, payload, size, now, now),
+                )
+                total = self._read_total() + size - (old[0] if old else 0)
+                if now - self._purged_at >= PURGE_INTERVAL_SECONDS:
+                    total -= self._purge_expired(now)
+                    self._purged_at = now
+                total = self._evict(total)
+                self._write_total(total)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _purge_expired(self, now: float) -> int:
+        """Удаляет записи, которые нельзя отдать даже как устаревшие; возвращает их объём."""
+        if not self.ttl_seconds:
+            return 0
+        expired = self._conn.execute(
+            "SELECT file_hash, model, size FROM predictions WHERE created_at < ?",
+            (now - self.ttl_seconds - self.stale_seconds,),
+        ).fetchall()
+        return self._delete_rows(expired)
+
+    def _evict(self, total: int) -> int:
+        """При превышении лимита размера удаляет самые старые по доступу записи."""
+        while total > self.max_bytes:
+            oldest = self._conn.execute(
+                "SELECT file_hash, model, size FROM predictions ORDER BY accessed_at LIMIT ?",
+                (_EVICTION_BATCH,),
+            ).fetchall()
+            if not oldest:
+                break
+            for file_hash, model, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                total -= self._delete_rows([(file_hash, model, size)])
+        return total
+
+    def _delete_rows(self, rows: list[tuple]) -> int:
+        self._conn.executemany(
+            "DELETE FROM predictions WHERE file_hash = ? AND model = ?",
+            [(file_hash, model) for file_hash, model, _ in rows],
+        )
+        self.stats["evictions"] += len(rows)
+        return sum(size for _, _, size in rows)
+
+    def clear(self) -> None:
+        """Удаляет все записи кеша."""
+        with self._lock:
+            self._conn.execute("DELETE FROM predictions")
+            self._write_total(0)
+
+    def get_stats(self) -> dict:
+        """Возвращает счётчики попаданий/промахов/вытеснений и объём кеша."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            total = self._read_total()
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": total,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "model": self.model,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_instance: Optional[PredictionCache] = None
+# Кеш открывают и event loop (статистика), и поток кеша
+_instance_lock = threading.Lock()
+
+
+def get_cache(model: str) -> PredictionCache:
+    """Возвращает персистентный кеш процесса, открывая его при первом обращении."""
+    global _instance
+    with _instance_lock:
+        if _instance is None or _instance.model != model:
+            if _instance is not None:
+                _instance.close()
+            _instance = PredictionCache(
+                PREDICTION_CACHE_DB, model, PREDICTION_CACHE_MAX_BYTES,
+                PREDICTION_CACHE_TTL_SECONDS, PREDICTION_CACHE_STALE_SECONDS,
+            )
+        return _instance
+
+
+def _get(model: str, file_hash: str, allow_stale: bool) -> Optional[list[Prediction]]:
+    return get_cache(model).get(file_hash, allow_stale)
+
+
+def _put(model: str, file_hash: str, predictions: list[Prediction]) -> None:
+    get_cache(model).put(file_hash, predictions)
+
+
+async def get_async(model: str, file_hash: str, allow_stale: bool = False) -> Optional[list[Prediction]]:
+    """PredictionCache.get в потоке кеша, не блокируя event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, _get, model, file_hash, allow_stale)
+
+
+async def put_async(model: str, file_hash: str, predictions: list[Prediction]) -> None:
+    """PredictionCache.put в потоке кеша, не блокируя event loop."""
+    await asyncio.get_running_loop().run_in_executor(_executor, _put, model, file_hash, predictions)
+
+
+def close() -> None:
+    """Закрывает персистентный кеш."""
+    global _instance
+    with _instance_lock:
+        if _instance is not None:
+            _instance.close()
+            _instance = None
@@ -0,0 +1,175 @@
+"""Распознавание изображений из хранилища с сохранением результатов.
+
+Общая логика для эндпоинтов распознавания и фоновых заданий.
+
+Перед обращением к модели переиспользуются результаты записей с тем же
+содержимым (SHA-256), а затем — почти одинаковых изображений: перцептивный
+хеш в радиусе PHASH_REUSE_DISTANCE бит (уменьшенные, перекодированные
+копии и копии без EXIF).
+"""
+
+import logging
+import os
+from typing import AsyncIterable, AsyncIterator, Callable, Optional
+
+from models.schemas import BatchInferenceItem, ImageMetadata, Prediction
+from services import batch_scheduler, classifier, metadata_store, metrics, phash_index
+
+logger = logging.getLogger(__name__)
+
+# Максимум одновременных запросов к модели при пакетном распознавании
+INFERENCE_MAX_IN_FLIGHT = int(os.getenv("INFERENCE_MAX_IN_FLIGHT", "8"))
+# Число повторов изображения после ответа 429
+INFERENCE_MAX_RETRIES = int(os.getenv("INFERENCE_MAX_RETRIES", "3"))
+# Максимальное расстояние Хэмминга pHash для переиспользования результатов (<0 — отключено)
+PHASH_REUSE_DISTANCE = int(os.getenv("PHASH_REUSE_DISTANCE", "4"))
+
+_REUSED = metrics.counter(
+    "recognition_reused_total", "Распознавания, взятые из результатов других записей", ("match",)
+)
+
+
+def _similar_results(image: ImageMetadata) -> Optional[list[Prediction]]:
+    """Результаты ближайшей обработанной записи с похожим перцептивным хешем."""
+    similar = phash_index.find_similar(image.phash, PHASH_REUSE_DISTANCE, exclude=image.id)
+    if not similar:
+        return None
+    candidates = {candidate.id: candidate for candidate in metadata_store.get_many([i for i, _ in similar])}
+    for image_id, distance in similar:
+        candidate = candidates.get(image_id)
+        if candidate is not None and candidate.processed and candidate.results:
+            logger.info(
+                "Использованы результаты id=%d для id=%d (pHash, расстояние %d)",
+                image_id, image.id, distance,
+            )
+            return candidate.results
+    return None
+
+
+async def classify(image: ImageMetadata, reuse_stored: bool = True) -> list[Prediction]:
+    """Распознаёт изображение, переиспользуя результаты для того же содержимого.
+
+    Args:
+        image: Метаданные изображения.
+        reuse_stored: Брать результаты записей с тем же SHA-256 или похожим
+            перцептивным хешем из хранилища (False — при повторном распознавании,
+            чтобы не вернуть прежний результат).
+    """
+    if reuse_stored and image.sha256:
+        stored = metadata_store.get_results_by_hash(image.sha256)
+        if stored:
+            logger.info("Использованы сохранённые результаты для id=%d (тот же SHA-256)", image.id)
+            _REUSED.labels("sha256").inc()
+            return stored
+    if reuse_stored and image.phash and PHASH_REUSE_DISTANCE >= 0:
+        similar = _similar_results(image)
+        if similar:
+            _REUSED.labels("phash").inc()
+            return similar
+    return await classifier.classify_image(image.path)
+
+
+async def recognize(image_id: int) -> BatchInferenceItem:
+    """Распознаёт одно изображение и сохраняет результат.
+
+    Raises:
+        LookupError: Если изображение не найдено.
+        RuntimeError: При ошибке распознавания.
+    """
+    image = metadata_store.get_by_id(image_id)
+    if not image:
+        raise LookupError("Изображение не найдено.")
+
+    predictions = await classify(image)
+    metadata_store.update_results(image_id, predictions)
+    return BatchInferenceItem(id=image.id, filename=image.filename, predictions=predictions)
+
+
+async def recognize_many(
+    image_ids: list[int],
+    on_result: Optional[Callable[[BatchInferenceItem], None]] = None,
+) -> list[BatchInferenceItem]:
+    """Распознаёт изображения конкурентно (не более INFERENCE_MAX_IN_FLIGHT одновременно).
+
+    Args:
+        image_ids: Список ID изображений.
+        on_result: Вызывается для каждого результата по мере готовности.
+
+    Returns:
+        Результаты в порядке входных ID; ошибки — в поле error элемента.
+    """
+    def to_item(image_id: int, outcome: batch_scheduler.BatchOutcome) -> BatchInferenceItem:
+        return outcome.value if outcome.ok else BatchInferenceItem(id=image_id, error=outcome.error)
+
+    callback = None
+    if on_result is not None:
+        def callback(index: int, outcome: batch_scheduler.BatchOutcome) -> None:
+            on_result(to_item(image_ids[index], outcome))
+
+    outcomes = await batch_scheduler.run_bounded(
+        image_ids,
+        recognize,
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT,
+        max_retries=INFERENCE_MAX_RETRIES,
+        on_result=callback,
+    )
+    return [to_item(image_id, outcome) for image_id, outcome in zip(image_ids, outcomes)]
+
+
+async def recognize_stream(image_ids: AsyncIterable[int]) -> AsyncIterator[BatchInferenceItem]:
+    """Распознаёт изображения по мере поступления их ID.
+
+    Args:
+        image_ids: Асинхронный источник ID (например, по мере сохранения загрузок).
+
+    Yields:
+        Результаты в порядке готовности; ошибки — в поле error элемента.
+    """
+    async for image_id, outcome in batch_scheduler.iter_bounded(
+        image_ids,
+        recognize,
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT,
+        max_retries=INFERENCE_MAX_RETRIES,
+    ):
+        yield outcome.value if outcome.ok else BatchInferenceItem(id=image_id, error=outcome.error)
+
+
+async def recognize_bulk(image_ids: list[int]) -> list[BatchInferenceItem]:
+    """Повторно распознаёт изображения и сохраняет все результаты одной транзакцией.
+
+    Сохранённые в хранилище результаты не переиспользуются. Изображения
+    распознаются конкурентно (не более INFERENCE_MAX_IN_FLIGHT одновременно).
+
+    Returns:
+        Результаты в порядке входных ID; ненайденные и нераспознанные
+        изображения — с ошибкой в поле error.
+    """
+    image_ids = list(dict.fromkeys(image_ids))
+    images = {image.id: image for image in metadata_store.get_many(image_ids)}
+    found = [images[image_id] for image_id in image_ids if image_id in images]
+
+    outcomes = await batch_scheduler.run_bounded(
+        found,
+        lambda image: classify(image, reuse_stored=False),
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT,
+        max_retries=INFERENCE_MAX_RETRIES,
+    )
+    by_id = {image.id: outcome for image, outcome in zip(found, outcomes)}
+    metadata_store.update_results_many(
+        {image_id: outcome.value for image_id, outcome in by_id.items() if outcome.ok}
+    )
+
+    items = []
+    for image_id in image_ids:
+        outcome = by_id.get(image_id)
+        if outcome is None:
+            items.append(BatchInferenceItem(id=image_id, error="Изображение не найдено."))
+        elif outcome.ok:
+            items.append(BatchInferenceItem(
+                id=image_id, filename=images[image_id].filename, predictions=outcome.value,
+            ))
+        else:
+            items.append(BatchInferenceItem(
+                id=image_id, filename=images[image_id].filename, error=outcome.error,
+            ))
+    return items
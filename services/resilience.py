@@ -0,0 +1,161 @@
+"""Политика повторов и автоматический выключатель (circuit breaker) для внешних API.
+
+RetryPolicy вычисляет паузы перед повторами: экспоненциальный рост с
+полным джиттером, ограниченный числом попыток и общим бюджетом времени;
+рекомендованная сервером пауза (Retry-After) имеет приоритет.
+
+CircuitBreaker отслеживает подряд идущие отказы вызовов. После порога
+он размыкается и сразу отклоняет вызовы, через reset_seconds пропускает
+одну пробную попытку (half-open): успех замыкает его, отказ — снова размыкает.
+"""
+
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetryPolicy:
+    """Параметры повторов.
+
+    Attributes:
+        max_attempts: Максимальное число попыток (включая первую).
+        base_seconds: Базовая пауза перед первым повтором.
+        max_seconds: Верхняя граница вычисленной паузы.
+        deadline_seconds: Бюджет времени на все попытки; 0 — без ограничения.
+    """
+    max_attempts: int = 4
+    base_seconds: float = 0.5
+    max_seconds: float = 20.0
+    deadline_seconds: float = 60.0
+    rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Пауза перед повтором после неудачной попытки attempt (с 1)."""
+        if retry_after is not None:
+            return retry_after
+        ceiling = min(self.max_seconds, self.base_seconds * 2 ** (attempt - 1))
+        return self.rng.uniform(0, ceiling)
+
+    def next_delay(
+        self, attempt: int, started: float, retry_after: Optional[float] = None
+    ) -> Optional[float]:
+        """Пауза перед следующей попыткой или None, если попытки или бюджет исчерпаны.
+
+        Args:
+            attempt: Номер завершившейся неудачей попытки (с 1).
+            started: Время начала первой попытки (time.monotonic()).
+            retry_after: Рекомендованная сервером пауза, секунды.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.delay(attempt, retry_after)
+        if self.deadline_seconds and time.monotonic() + delay - started > self.deadline_seconds:
+            return None
+        return delay
+
+
+class CircuitOpenError(RuntimeError):
+    """Выключатель разомкнут: вызов отклонён без обращения к API.
+
+    Attributes:
+        retry_in: Через сколько секунд будет разрешена пробная попытка.
+    """
+
+    def __init__(self, message: str, retry_in: float) -> None:
+        super().__init__(message)
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Автоматический выключатель по числу подряд идущих отказов."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.stats = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+        self._probing = False
+
+    def _retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.reset_seconds - time.monotonic(), 0.0)
+
+    def before_call(self) -> None:
+        """Проверяет, разрешён ли вызов.
+
+        Raises:
+            CircuitOpenError: Если выключатель разомкнут или пробная попытка уже идёт.
+        """
+        if self.state == self.OPEN and self._retry_in() <= 0:
+            self.state = self.HALF_OPEN
+            logger.info("Выключатель %s: пробная попытка", self.name)
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.stats["rejected"] += 1
+        raise CircuitOpenError(
+            f"Сервис {self.name} временно недоступен, повторите позже.", self._retry_in()
+        )
+
+    def record_success(self) -> None:
+        """Учитывает успешный вызов: выключатель замыкается."""
+        self.stats["successes"] += 1
+        self.consecutive_failures = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            logger.info("Выключатель %s замкнут", self.name)
+        self.state = self.CLOSED
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        """Учитывает отказ: после порога (или неудачной пробы) выключатель размыкается."""
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.stats["opened"] += 1
+                logger.warning(
+                    "Выключатель %s разомкнут после %d отказов подряд на %.1f с",
+                    self.name, self.consecutive_failures, self.reset_seconds,
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancel(self) -> None:
+        """Освобождает пробную попытку, если вызов не дал исхода (отмена)."""
+        self._probing = False
+
+    def reset(self) -> None:
+        """Принудительно замыкает выключатель."""
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def get_state(self) -> dict:
+        """Состояние выключателя для мониторинга."""
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "retry_in_seconds": round(self._retry_in(), 3) if self.state == self.OPEN else 0.0,
+            **self.stats,
+        }
@@ -0,0 +1,301 @@
+"""Поиск изображений по марке, модели и году из предсказаний.
+
+Метки Stanford Cars («BMW M3 Coupe 2012», «Aston Martin V8 Vantage
+Convertible 2012») разбираются на марку, модель и год. Индекс хранит
+для каждой метки список вхождений (уверенность, ID, место в top-k),
+отсортированный по убыванию уверенности, и обратный индекс «токен марки,
+модели или года → метки». Меток немного (сотни), поэтому запрос сводится
+к пересечению небольших множеств меток и слиянию их отсортированных
+списков до набора нужного числа результатов — без обхода всех записей.
+
+Индекс, как и агрегаты статистики, строится полным проходом при первом
+обращении, обновляется слушателем изменений metadata_store (в том числе
+при update_results, в том числе других процессов) и сбрасывается, только
+если часть изменений других процессов потеряна.
+"""
+
+import bisect
+import heapq
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from services import metadata_store
+
+logger = logging.getLogger(__name__)
+
+# Марки Stanford Cars из нескольких слов (остальные — первое слово метки)
+MULTI_WORD_MAKES = ("AM General", "Aston Martin", "Land Rover")
+
+_TOKEN_SPLIT = re.compile(r"[\s\-/]+")
+
+
+@dataclass(frozen=True)
+class CarLabel:
+    """Разобранная метка класса."""
+    label: str
+    make: str
+    model: str
+    year: Optional[int]
+
+
+def parse_label(label: str) -> CarLabel:
+    """Разбирает метку «<марка> <модель> <год>» (год в конце необязателен)."""
+    words = label.split()
+    year = None
+    if words and words[-1].isdigit() and len(words[-1]) == 4:
+        year = int(words[-1])
+        words = words[:-1]
+    rest = " ".join(words)
+    make = next(
+        (name for name in MULTI_WORD_MAKES if rest.lower().startswith(name.lower() + " ")),
+        words[0] if words else "",
+    )
+    return CarLabel(label=label, make=make, model=rest[len(make):].strip(), year=year)
+
+
+def tokenize(text: str) -> list[str]:
+    """Токены для поиска: слова в нижнем регистре (дефис и слеш — разделители)."""
+    return [token for token in _TOKEN_SPLIT.split(text.lower()) if token]
+
+
+def _label_tokens(parsed: CarLabel) -> set[str]:
+    tokens = set(tokenize(parsed.make)) | set(tokenize(parsed.model))
+    # Марка целиком: «mercedes-benz», «aston martin»
+    tokens.add(parsed.make.lower())
+    if parsed.year is not None:
+        tokens.add(str(parsed.year))
+    return tokens
+
+
+@dataclass
+class SearchHit:
+    """Найденное изображение и лучшее из совпавших предсказаний."""
+    id: int
+    label: CarLabel
+    confidence: float
+    rank: int
+
+
+class SearchIndex:
+    """Списки вхождений по меткам и обратный индекс токенов."""
+
+    def __init__(self) -> None:
+        # Метка -> [(-уверенность, ID, место в top-k)], по возрастанию (по убыванию уверенности)
+        self.postings: dict[str, list[tuple[float, int, int]]] = {}
+        self.labels: dict[str, CarLabel] = {}
+        # Число изображений, у которых метка — top-1
+        self.top1: dict[str, int] = {}
+        self.tokens: dict[str, set[str]] = {}
+        # Отсортированные токены для поиска по префиксу
+        self.sorted_tokens: list[str] = []
+
+    def _entries(self, record: dict) -> Iterator[tuple[str, tuple[float, int, int]]]:
+        if not record.get("processed"):
+            return
+        for rank, prediction in enumerate(record.get("results") or (), start=1):
+            yield prediction["label"], (-prediction["confidence"], record["id"], rank)
+
+    def _add_label(self, label: str) -> None:
+        parsed = parse_label(label)
+        self.labels[label] = parsed
+        self.postings[label] = []
+        self.top1[label] = 0
+        for token in _label_tokens(parsed):
+            if token not in self.tokens:
+                self.tokens[token] = set()
+                bisect.insort(self.sorted_tokens, token)
+            self.tokens[token].add(label)
+
+    def _remove_label(self, label: str) -> None:
+        parsed = self.labels.pop(label)
+        del self.postings[label]
+        del self.top1[label]
+        for token in _label_tokens(parsed):
+            labels = self.tokens[token]
+            labels.discard(label)
+            if not labels:
+                del self.tokens[token]
+                self.sorted_tokens.pop(bisect.bisect_left(self.sorted_tokens, token))
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Учитывает изменение записи: убирает вхождения старой версии и добавляет новые."""
+        if old is not None:
+            for label, entry in self._entries(old):
+                entries = self.postings.get(label)
+                if entries is None:
+                    continue
+                position = bisect.bisect_left(entries, entry)
+                if position < len(entries) and entries[position] == entry:
+                    entries.pop(position)
+                    if entry[2] == 1:
+                        self.top1[label] -= 1
+                if not entries:
+                    self._remove_label(label)
+        if new is not None:
+            for label, entry in self._entries(new):
+                if label not in self.postings:
+                    self._add_label(label)
+                bisect.insort(self.postings[label], entry)
+                if entry[2] == 1:
+                    self.top1[label] += 1
+
+    def prefixed(self, prefix: str) -> set[str]:
+        """Метки, у которых есть токен, начинающийся с prefix."""
+        labels: set[str] = set()
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            labels |= self.tokens[token]
+        return labels
+
+    def matching_labels(self, query: str) -> set[str]:
+        """Метки, содержащие все слова запроса; последнее слово — префикс."""
+        terms = tokenize(query)
+        if not terms:
+            return set(self.postings)
+        labels = self.prefixed(terms[-1])
+        for term in terms[:-1]:
+            labels &= self.tokens.get(term, set())
+        return labels
+
+    def search(
+        self,
+        query: str,
+        make: Optional[str],
+        year: Optional[int],
+        min_confidence: float,
+        max_rank: Optional[int],
+        limit: int,
+        offset: int,
+    ) -> list[SearchHit]:
+        """Запрос к индексу; параметры — как у функции search модуля."""
+        labels = self.matching_labels(query)
+        if make is not None:
+            labels = {label for label in labels if self.labels[label].make.lower() == make.lower()}
+        if year is not None:
+            labels = {label for label in labels if self.labels[label].year == year}
+
+        hits: list[SearchHit] = []
+        seen: set[int] = set()
+        needed = offset + limit
+        # Слияние отсортированных списков через кучу курсоров (вхождение, метка,
+        # позиция): уверенность убывает, поэтому перебор останавливается на пороге
+        # или после нужного числа результатов. Куча из кортежей дешевле heapq.merge
+        # по сотням итераторов, когда префикс из одной буквы подходит ко всем меткам.
+        heap = [(self.postings[label][0], label, 0) for label in labels]
+        heapq.heapify(heap)
+        while heap and len(seen) < needed:
+            (negative_confidence, image_id, rank), label, position = heap[0]
+            if -negative_confidence < min_confidence:
+                break
+            entries = self.postings[label]
+            if position + 1 < len(entries):
+                heapq.heapreplace(heap, (entries[position + 1], label, position + 1))
+            else:
+                heapq.heappop(heap)
+            if image_id in seen or (max_rank is not None and rank > max_rank):
+                continue
+            seen.add(image_id)
+            hits.append(SearchHit(
+                id=image_id, label=self.labels[label], confidence=-negative_confidence, rank=rank,
+            ))
+        return hits[offset:]
+
+
+_index: Optional[SearchIndex] = None
+_lock = threading.Lock()
+
+
+def _build(records: Iterator[dict]) -> SearchIndex:
+    index = SearchIndex()
+    for record in records:
+        index.apply(None, record)
+    return index
+
+
+def _on_change(old: Optional[dict], new: Optional[dict]) -> None:
+    with _lock:
+        # До первого обращения индекса нет: он будет построен полным проходом
+        if _index is not None:
+            _index.apply(old, new)
+
+
+def _on_reset() -> None:
+    global _index
+    with _lock:
+        _index = None
+
+
+metadata_store.add_listener(_on_change)
+metadata_store.add_reset_listener(_on_reset)
+
+
+def _get() -> SearchIndex:
+    global _index
+    metadata_store.sync()
+    with _lock:
+        if _index is not None:
+            return _index
+    with metadata_store.snapshot() as records, _lock:
+        if _index is None:
+            _index = _build(records)
+            logger.info("Построен поисковый индекс: %d меток", len(_index.labels))
+        return _index
+
+
+def search(
+    query: str = "",
+    make: Optional[str] = None,
+    year: Optional[int] = None,
+    min_confidence: float = 0.0,
+    max_rank: Optional[int] = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> list[SearchHit]:
+    """Ищет изображения по предсказанным меткам.
+
+    Args:
+        query: Слова марки, модели или года; последнее слово — префикс
+            («bmw m» найдёт BMW M3 и BMW M5).
+        make: Точная марка (без учёта регистра).
+        year: Год модели.
+        min_confidence: Минимальная уверенность совпавшего предсказания.
+        max_rank: Учитывать только первые max_rank предсказаний (1 — только top-1).
+        limit: Максимум результатов.
+        offset: Сколько первых результатов пропустить.
+
+    Returns:
+        Изображения по убыванию уверенности совпавшего предсказания; для
+        каждого — лучшее совпадение.
+    """
+    index = _get()
+    with _lock:
+        return index.search(query, make, year, min_confidence, max_rank, limit, offset)
+
+
+def suggest(prefix: str, limit: int = 10) -> list[tuple[CarLabel, int]]:
+    """Подсказки для автодополнения: метки, подходящие под начатый запрос.
+
+    Returns:
+        Метки и число изображений, у которых метка — top-1, от частых к редким.
+    """
+    index = _get()
+    with _lock:
+        labels = index.matching_labels(prefix)
+        ranked = sorted(labels, key=lambda label: (-index.top1[label], label))[:limit]
+        return [(index.labels[label], index.top1[label]) for label in ranked]
+
+
+def get_state() -> dict:
+    """Размер индекса для мониторинга."""
+    index = _get()
+    with _lock:
+        return {
+            "labels": len(index.labels),
+            "tokens": len(index.tokens),
+            "entries": sum(len(entries) for entries in index.postings.values()),
+        }
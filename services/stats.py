@@ -0,0 +1,168 @@
+"""Инкрементально поддерживаемые агрегаты статистики по изображениям.
+
+Агрегаты (всего и обработано, счётчики top-1 меток, гистограмма
+уверенности, число загрузок по дням) обновляются слушателем изменений
+metadata_store при каждом добавлении, обновлении и удалении записи,
+поэтому запрос статистики не читает хранилище. При первом обращении
+агрегаты строятся полным проходом по хранилищу; rebuild() перестраивает
+их заново и сообщает о расхождениях с поддерживаемыми значениями.
+Изменения других процессов применяются так же, как свои (metadata_store.sync);
+заново агрегаты строятся, только если часть этих изменений потеряна.
+"""
+
+import logging
+import threading
+from collections import Counter
+from typing import Iterator, Optional
+
+from services import metadata_store
+
+logger = logging.getLogger(__name__)
+
+# Число интервалов гистограммы уверенности top-1 на отрезке [0, 1]
+HISTOGRAM_BINS = 10
+
+
+def _top(record: dict) -> Optional[dict]:
+    results = record.get("results")
+    return results[0] if record.get("processed") and results else None
+
+
+def _count(counter: Counter, key: str, sign: int) -> None:
+    counter[key] += sign
+    # Нулевые счётчики не храним, чтобы размер агрегатов не рос от удалений
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _bin(confidence: float) -> int:
+    return min(max(int(confidence * HISTOGRAM_BINS), 0), HISTOGRAM_BINS - 1)
+
+
+class StatsAggregates:
+    """Агрегаты статистики, обновляемые по разнице записей."""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.processed = 0
+        self.labels: Counter = Counter()
+        self.confidence = [0] * HISTOGRAM_BINS
+        self.per_day: Counter = Counter()
+
+    def _apply(self, record: dict, sign: int) -> None:
+        self.total += sign
+        _count(self.per_day, record["upload_date"][:10], sign)
+        top = _top(record)
+        if top is not None:
+            self.processed += sign
+            _count(self.labels, top["label"], sign)
+            self.confidence[_bin(top["confidence"])] += sign
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Учитывает изменение записи: вычитает старую версию и добавляет новую."""
+        if old is not None:
+            self._apply(old, -1)
+        if new is not None:
+            self._apply(new, 1)
+
+    def snapshot(self) -> dict:
+        return {
+            "total": self.total,
+            "processed": self.processed,
+            "labels": dict(self.labels),
+            "confidence": list(self.confidence),
+            "per_day": dict(self.per_day),
+        }
+
+
+_aggregates: Optional[StatsAggregates] = None
+_lock = threading.Lock()
+
+
+def _build(records: Iterator[dict]) -> StatsAggregates:
+    aggregates = StatsAggregates()
+    for record in records:
+        aggregates.apply(None, record)
+    return aggregates
+
+
+def _on_change(old: Optional[dict], new: Optional[dict]) -> None:
+    with _lock:
+        # До первого обращения агрегатов нет: они будут построены полным проходом
+        if _aggregates is not None:
+            _aggregates.apply(old, new)
+
+
+def _on_reset() -> None:
+    global _aggregates
+    with _lock:
+        _aggregates = None
+
+
+metadata_store.add_listener(_on_change)
+metadata_store.add_reset_listener(_on_reset)
+
+
+def _get() -> StatsAggregates:
+    global _aggregates
+    metadata_store.sync()
+    with _lock:
+        if _aggregates is not None:
+            return _aggregates
+    with metadata_store.snapshot() as records, _lock:
+        if _aggregates is None:
+            _aggregates = _build(records)
+            logger.info("Построены агрегаты статистики: %d записей", _aggregates.total)
+        return _aggregates
+
+
+def get_summary(top_labels: int = 10) -> dict:
+    """Возвращает статистику из агрегатов.
+
+    Args:
+        top_labels: Число самых частых top-1 меток в ответе.
+    """
+    aggregates = _get()
+    with _lock:
+        step = 1 / HISTOGRAM_BINS
+        return {
+            "total_files": aggregates.total,
+            "processed_files": aggregates.processed,
+            "unprocessed_files": aggregates.total - aggregates.processed,
+            "top_brands": [
+                {"label": label, "count": count}
+                for label, count in aggregates.labels.most_common(top_labels)
+            ],
+            "distinct_labels": len(aggregates.labels),
+            "confidence_histogram": [
+                {"from": round(i * step, 2), "to": round((i + 1) * step, 2), "count": count}
+                for i, count in enumerate(aggregates.confidence)
+            ],
+            "uploads_per_day": [
+                {"date": day, "count": count}
+                for day, count in sorted(aggregates.per_day.items())
+            ],
+        }
+
+
+def rebuild() -> dict:
+    """Перестраивает агрегаты полным проходом по хранилищу.
+
+    Returns:
+        Признак согласованности и список агрегатов, значения которых
+        разошлись с построенными заново.
+    """
+    global _aggregates
+    # Снимок согласован с изменениями, уже учтёнными в агрегатах, поэтому сравнение точное
+    with metadata_store.snapshot() as records, _lock:
+        fresh = _build(records)
+        previous = _aggregates
+        _aggregates = fresh
+    if previous is None:
+        return {"consistent": True, "mismatched": []}
+
+    expected, actual = fresh.snapshot(), previous.snapshot()
+    mismatched = [key for key in expected if expected[key] != actual[key]]
+    if mismatched:
+        logger.warning("Агрегаты статистики расходились с хранилищем: %s", ", ".join(mismatched))
+    return {"consistent": not mismatched, "mismatched": mismatched}
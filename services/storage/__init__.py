@@ -0,0 +1,40 @@
+"""Подключаемые бэкенды хранилища метаданных изображений."""
+
+from services.storage.base import ImageQuery, MetadataBackend, sort_key
+from services.storage.json_backend import JsonMetadataBackend
+from services.storage.sqlite_backend import SqliteMetadataBackend
+
+BACKENDS: dict[str, type[MetadataBackend]] = {
+    JsonMetadataBackend.name: JsonMetadataBackend,
+    SqliteMetadataBackend.name: SqliteMetadataBackend,
+}
+
+
+def create_backend(name: str, path: str, **options) -> MetadataBackend:
+    """Создаёт бэкенд хранилища по имени.
+
+    Args:
+        name: Имя бэкенда (json или sqlite).
+        path: Путь к файлу хранилища.
+        **options: Дополнительные параметры конструктора бэкенда.
+
+    Raises:
+        ValueError: Если бэкенд с таким именем не зарегистрирован.
+    """
+    backend_cls = BACKENDS.get(name)
+    if backend_cls is None:
+        raise ValueError(
+            f"Неизвестный бэкенд метаданных: {name}. Допустимы: {', '.join(BACKENDS)}."
+        )
+    return backend_cls(path, **options)
+
+
+__all__ = [
+    "BACKENDS",
+    "ImageQuery",
+    "JsonMetadataBackend",
+    "MetadataBackend",
+    "SqliteMetadataBackend",
+    "create_backend",
+    "sort_key",
+]
@@ -0,0 +1,192 @@
+"""Базовый интерфейс бэкенда хранилища метаданных."""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, ContextManager, Iterator, Optional
+
+
+@dataclass
+class ImageQuery:
+    """Параметры выборки записей: фильтры, сортировка и позиция курсора.
+
+    Пагинация — по ключу (keyset): after содержит ключ сортировки
+    последней записи предыдущей страницы (см. sort_key).
+    """
+    processed: Optional[bool] = None
+    label: Optional[str] = None
+    uploaded_from: Optional[str] = None
+    uploaded_to: Optional[str] = None
+    min_confidence: Optional[float] = None
+    sort: str = "id"
+    descending: bool = False
+    after: Optional[tuple[Any, int]] = None
+    limit: Optional[int] = None
+    offset: int = 0
+
+    @property
+    def filtered(self) -> bool:
+        """Задан ли хотя бы один фильтр (без фильтров выборка — все записи)."""
+        return any(
+            value is not None
+            for value in (self.processed, self.label, self.uploaded_from, self.uploaded_to, self.min_confidence)
+        )
+
+
+def top_confidence(record: dict) -> float:
+    """Уверенность top-1 предсказания записи (-1 для необработанных)."""
+    results = record.get("results")
+    return results[0]["confidence"] if results else -1.0
+
+
+def sort_key(record: dict, sort: str) -> tuple[Any, int]:
+    """Ключ сортировки записи: значение поля сортировки и ID."""
+    if sort == "upload_date":
+        value = record["upload_date"]
+    elif sort == "confidence":
+        value = top_confidence(record)
+    elif sort == "size":
+        value = record["size_bytes"]
+    else:
+        value = record["id"]
+    return value, record["id"]
+
+
+class MetadataBackend:
+    """Абстрактный бэкенд хранилища метаданных изображений.
+
+    Бэкенд оперирует «сырыми» записями-словарями в том же формате,
+    что и исторический metadata.json; преобразование в Pydantic-модели
+    выполняет services.metadata_store.
+    """
+
+    name = "base"
+
+    def next_id(self) -> int:
+        """Возвращает следующий доступный ID."""
+        raise NotImplementedError
+
+    def add(self, record: dict) -> dict:
+        """Добавляет запись, присваивая ей ID.
+
+        Args:
+            record: Запись без поля id.
+
+        Returns:
+            Сохранённая запись с присвоенным id.
+        """
+        raise NotImplementedError
+
+    def get(self, image_id: int) -> Optional[dict]:
+        """Возвращает запись по ID или None."""
+        raise NotImplementedError
+
+    def get_many(self, image_ids: list[int]) -> list[dict]:
+        """Возвращает найденные записи с данными ID (в порядке возрастания ID)."""
+        raise NotImplementedError
+
+    def all(self) -> list[dict]:
+        """Возвращает все записи в порядке возрастания ID."""
+        raise NotImplementedError
+
+    def query(self, query: ImageQuery) -> list[dict]:
+        """Возвращает записи, удовлетворяющие фильтрам, в порядке сортировки.
+
+        Args:
+            query: Фильтры, сортировка, курсор и максимальное число записей.
+        """
+        raise NotImplementedError
+
+    def update(self, image_id: int, fields: dict) -> Optional[dict]:
+        """Обновляет поля записи.
+
+        Returns:
+            Обновлённая запись или None если не найдена.
+        """
+        raise NotImplementedError
+
+    def delete(self, image_id: int) -> bool:
+        """Удаляет запись по ID.
+
+        Returns:
+            True если запись была удалена, False если не найдена.
+        """
+        raise NotImplementedError
+
+    def update_many(self, image_ids: list[int], fields: dict) -> list[tuple[dict, dict]]:
+        """Обновляет одинаковые поля нескольких записей одной транзакцией.
+
+        Returns:
+            Пары (запись до изменения, запись после) для найденных ID.
+        """
+        raise NotImplementedError
+
+    def set_results_many(self, results: dict[int, list[dict]]) -> list[tuple[dict, dict]]:
+        """Сохраняет результаты распознавания нескольких записей одной транзакцией.
+
+        Args:
+            results: ID записи -> список предсказаний (словари).
+
+        Returns:
+            Пары (запись до изменения, запись после) для найденных ID.
+        """
+        raise NotImplementedError
+
+    def delete_many(self, image_ids: list[int]) -> list[dict]:
+        """Удаляет записи одной транзакцией.
+
+        Returns:
+            Удалённые записи (ненайденные ID пропускаются).
+        """
+        raise NotImplementedError
+
+    def count_by_hash(self, sha256: str) -> int:
+        """Возвращает число записей, ссылающихся на содержимое с данным хешем."""
+        raise NotImplementedError
+
+    def find_by_hash(self, sha256: str) -> Optional[dict]:
+        """Возвращает любую запись с данным хешем или None."""
+        raise NotImplementedError
+
+    def find_processed_by_hash(self, sha256: str) -> Optional[dict]:
+        """Возвращает любую обработанную запись с данным хешем или None."""
+        raise NotImplementedError
+
+    def consume_changes(
+        self, until: Optional[int] = None
+    ) -> Optional[list[tuple[Optional[dict], Optional[dict]]]]:
+        """Возвращает изменения записей, ещё не переданные производным структурам.
+
+        В поток попадают изменения этого и других процессов в порядке их
+        применения; каждое изменение возвращается один раз.
+
+        Args:
+            until: Позиция снимка (см. snapshot): более поздние изменения
+                остаются до следующего вызова.
+
+        Returns:
+            Пары (запись до изменения, запись после; None для добавления и
+            удаления соответственно) или None, если часть изменений других
+            процессов восстановить нельзя и производные структуры нужно
+            построить заново.
+        """
+        raise NotImplementedError
+
+    def snapshot(self) -> ContextManager[tuple[int, Iterator[dict]]]:
+        """Согласованный снимок всех записей для построения производных структур.
+
+        Returns:
+            Контекстный менеджер, выдающий позицию снимка в потоке изменений
+            (см. consume_changes) и итератор по записям снимка.
+        """
+        raise NotImplementedError
+
+    def version(self) -> tuple[str, datetime]:
+        """Возвращает версию данных и время последнего изменения (UTC).
+
+        Версия — непрозрачная строка, меняющаяся при каждом изменении
+        записей; используется для валидации HTTP-кешей.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Освобождает ресурсы бэкенда."""
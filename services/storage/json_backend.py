@@ -0,0 +1,491 @@
+"""JSON-бэкенд хранилища метаданных (исторический формат metadata.json).
+
+Все записи держатся в памяти в таблице по ID, поэтому чтения не обращаются
+к диску. Изменения дописываются в журнал (JSON Lines рядом со снимком) и
+периодически сворачиваются в атомарную перезапись снимка: временный файл +
+os.replace. При старте снимок загружается, а журнал проигрывается поверх,
+так что изменения, не попавшие в снимок до падения процесса, не теряются.
+
+Файлы могут использовать несколько процессов (воркеры uvicorn): изменения
+выполняются под эксклюзивной блокировкой файла <METADATA_FILE>.lock (flock),
+а перед каждой операцией процесс догоняет чужие изменения — дочитывает
+новые строки журнала или, если снимок перезаписан, загружает его заново.
+ID выдаются под той же блокировкой после догона, поэтому не повторяются.
+Догнанные изменения (а после перезагрузки снимка — разница со старой
+таблицей) попадают в поток изменений вместе с изменениями своего процесса.
+На платформах без fcntl межпроцессная блокировка отключена.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from services import metrics
+from services.storage.base import ImageQuery, MetadataBackend, sort_key, top_confidence
+
+logger = logging.getLogger(__name__)
+
+_LOAD_SECONDS = metrics.histogram(
+    "metadata_json_load_duration_seconds", "Загрузка снимка и проигрывание журнала JSON-бэкенда"
+)
+_FLUSH_SECONDS = metrics.histogram(
+    "metadata_json_flush_duration_seconds", "Запись снимка JSON-бэкенда"
+)
+_BYTES_WRITTEN = metrics.counter(
+    "metadata_json_bytes_written_total", "Байты, записанные JSON-бэкендом", ("file",)
+)
+
+
+def _file_id(path: str) -> Optional[tuple[int, int, int]]:
+    """Идентичность файла: inode, время и размер (None, если файла нет)."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _entry_ids(entry: dict) -> list[int]:
+    """ID записей, затронутых операцией журнала."""
+    if entry["op"] == "put":
+        return [entry["record"]["id"]]
+    if entry["op"] == "results_many":
+        return [int(image_id) for image_id in entry["results"]]
+    return entry["ids"] if "ids" in entry else [entry["id"]]
+
+
+class JsonMetadataBackend(MetadataBackend):
+    """Хранит записи в памяти с журналом изменений и JSON-снимком на диске."""
+
+    name = "json"
+
+    def __init__(self, path: str, flush_interval: float = 2.0) -> None:
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._table: dict[int, dict] = {}
+        # Индекс содержимого: SHA-256 -> ID записей, ссылающихся на него
+        self._by_hash: dict[str, set[int]] = {}
+        # Индекс top-1 меток: метка -> ID записей
+        self._by_label: dict[str, set[int]] = {}
+        self._next_id = 1
+        self._dirty = False
+        # Прочитанная часть общего журнала (байты) и снимок, поверх которого она применена
+        self._offset = 0
+        self._snapshot_id: Optional[tuple[int, int, int]] = None
+        # Ещё не переданные изменения (позиция, запись до, запись после)
+        self._changes: list[tuple[int, Optional[dict], Optional[dict]]] = []
+        self._position = 0
+        self._lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        with self._file_lock(exclusive=True):
+            self._load()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="metadata-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _load(self) -> None:
+        """Загружает снимок и проигрывает журнал поверх него (с нуля)."""
+        with _LOAD_SECONDS.time():
+            self._table.clear()
+            self._by_hash.clear()
+            self._by_label.clear()
+            self._snapshot_id = _file_id(self.path)
+            if self._snapshot_id is not None:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        for item in json.load(f):
+                            self._table[item["id"]] = item
+                except (json.JSONDecodeError, IOError):
+                    logger.error("Ошибка чтения файла метаданных")
+
+            self._offset = 0
+            replayed = 0
+            for entry in self._read_journal():
+                self._apply(entry)
+                replayed += 1
+            if replayed:
+                logger.info("Из журнала метаданных восстановлено операций: %d", replayed)
+            self._dirty = bool(replayed)
+
+            self._next_id = max(self._next_id, max(self._table, default=0) + 1)
+            for item in self._table.values():
+                self._index(item)
+
+    def _read_journal(self) -> Iterator[dict]:
+        """Выдаёт ещё не прочитанные операции журнала, сдвигая self._offset."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Читаем только завершённые строки: хвост без перевода строки дочитаем позже
+        complete = data.rfind(b"\n") + 1
+        self._offset += complete
+        for line in data[:complete].splitlines():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Повреждённая строка после аварийного завершения процесса
+                logger.warning("Пропущена повреждённая запись журнала")
+
+    def _sync(self) -> None:
+        """Догоняет изменения других процессов (вызывается под блокировкой файла)."""
+        if _file_id(self.path) != self._snapshot_id:
+            # Другой процесс перезаписал снимок и очистил журнал
+            previous = dict(self._table)
+            self._load()
+            for image_id in sorted(previous.keys() | self._table.keys()):
+                old, new = previous.get(image_id), self._table.get(image_id)
+                if old != new:
+                    self._record(old, dict(new) if new is not None else None)
+            return
+        applied = 0
+        for entry in self._read_journal():
+            ids = _entry_ids(entry)
+            olds = {}
+            for image_id in ids:
+                if image_id in self._table:
+                    olds[image_id] = dict(self._table[image_id])
+                    self._unindex(self._table[image_id])
+            self._apply(entry)
+            for image_id in ids:
+                new = self._table.get(image_id)
+                if new is not None:
+                    self._index(new)
+                if olds.get(image_id) != new:
+                    self._record(olds.get(image_id), dict(new) if new is not None else None)
+                self._next_id = max(self._next_id, image_id + 1)
+            applied += 1
+        if applied:
+            self._dirty = True
+
+    def _record(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Добавляет изменение записи в поток изменений (копии записей)."""
+        self._position += 1
+        self._changes.append((self._position, old, new))
+
+    def _changed_on_disk(self) -> bool:
+        journal = _file_id(self.journal_path)
+        return _file_id(self.path) != self._snapshot_id or (journal[2] if journal else 0) != self._offset
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _reading(self) -> Iterator[None]:
+        """Чтение: догоняет чужие изменения, если файлы изменились с прошлой операции."""
+        with self._lock:
+            if self._changed_on_disk():
+                with self._file_lock(exclusive=False):
+                    self._sync()
+            yield
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Изменение: эксклюзивная блокировка файла на время догона и записи в журнал."""
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            yield
+
+    def _apply(self, entry: dict) -> None:
+        """Применяет операцию журнала к таблице в памяти (идемпотентно)."""
+        op = entry["op"]
+        if op == "put":
+            record = entry["record"]
+            self._table[record["id"]] = record
+        elif op == "update":
+            item = self._table.get(entry["id"])
+            if item is not None:
+                item.update(entry["fields"])
+        elif op == "delete":
+            self._table.pop(entry["id"], None)
+        elif op == "update_many":
+            for image_id in entry["ids"]:
+                item = self._table.get(image_id)
+                if item is not None:
+                    item.update(entry["fields"])
+        elif op == "results_many":
+            for image_id, results in entry["results"].items():
+                item = self._table.get(int(image_id))
+                if item is not None:
+                    item.update(processed=True, results=results)
+        elif op == "delete_many":
+            for image_id in entry["ids"]:
+                self._table.pop(image_id, None)
+
+    @staticmethod
+    def _label(item: dict) -> Optional[str]:
+        results = item.get("results")
+        return results[0]["label"] if results else None
+
+    def _index(self, item: dict) -> None:
+        if item.get("sha256"):
+            self._by_hash.setdefault(item["sha256"], set()).add(item["id"])
+        label = self._label(item)
+        if label is not None:
+            self._by_label.setdefault(label, set()).add(item["id"])
+
+    def _unindex(self, item: dict) -> None:
+        for index, key in ((self._by_hash, item.get("sha256")), (self._by_label, self._label(item))):
+            ids = index.get(key or "")
+            if ids is not None:
+                ids.discard(item["id"])
+                if not ids:
+                    del index[key]
+
+    def _log(self, entry: dict) -> None:
+        """Дописывает операцию в журнал."""
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        encoded = line.encode("utf-8")
+        self._journal.write(line)
+        self._journal.flush()
+        _BYTES_WRITTEN.labels("journal").inc(len(encoded))
+        # Под эксклюзивной блокировкой журнал дочитан до конца, поэтому строка легла сразу за offset
+        self._offset += len(encoded)
+        self._dirty = True
+
+    def _flush_loop(self) -> None:
+        """Фоновый цикл периодической записи снимка."""
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error("Ошибка записи снимка метаданных: %s", str(e))
+
+    def flush(self) -> None:
+        """Атомарно перезаписывает снимок и очищает журнал, если были изменения."""
+        with self._writing():
+            if not self._dirty:
+                return
+            tmp_path = f"{self.path}.tmp"
+            with _FLUSH_SECONDS.time():
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(list(self._table.values()), f, ensure_ascii=False, indent=2, default=str)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    written = f.tell()
+                os.replace(tmp_path, self.path)
+            _BYTES_WRITTEN.labels("snapshot").inc(written)
+            self._journal.truncate(0)
+            self._journal.seek(0)
+            self._snapshot_id = _file_id(self.path)
+            self._offset = 0
+            self._dirty = False
+
+    def next_id(self) -> int:
+        with self._reading():
+            return self._next_id
+
+    def add(self, record: dict) -> dict:
+        with self._writing():
+            record = {"id": self._next_id, **record}
+            self._next_id += 1
+            self._table[record["id"]] = record
+            self._index(record)
+            self._log({"op": "put", "record": record})
+            self._record(None, dict(record))
+            return dict(record)
+
+    def get(self, image_id: int) -> Optional[dict]:
+        with self._reading():
+            item = self._table.get(image_id)
+            return dict(item) if item is not None else None
+
+    def get_many(self, image_ids: list[int]) -> list[dict]:
+        with self._reading():
+            return [
+                dict(self._table[image_id])
+                for image_id in sorted(set(image_ids)) if image_id in self._table
+            ]
+
+    def all(self) -> list[dict]:
+        with self._reading():
+            return [dict(item) for item in self._table.values()]
+
+    def query(self, query: ImageQuery) -> list[dict]:
+        after = None if query.after is None else tuple(query.after)
+        with self._reading():
+            if query.label is not None:
+                candidates = [self._table[i] for i in self._by_label.get(query.label, ())]
+            else:
+                candidates = self._table.values()
+            # Курсор отсекает записи до сортировки: страница не сортирует всю таблицу
+            keyed = []
+            for item in candidates:
+                if not self._matches(item, query):
+                    continue
+                key = sort_key(item, query.sort)
+                if after is not None and (key >= after if query.descending else key <= after):
+                    continue
+                keyed.append((key, item))
+
+            if query.limit is None:
+                keyed.sort(key=lambda pair: pair[0], reverse=query.descending)
+                selected = keyed[query.offset:]
+            else:
+                # Нужны только первые offset + limit записей — частичная сортировка кучей
+                select = heapq.nlargest if query.descending else heapq.nsmallest
+                selected = select(query.offset + query.limit, keyed, key=lambda pair: pair[0])[query.offset:]
+            return [dict(item) for _, item in selected]
+
+    @staticmethod
+    def _matches(item: dict, query: ImageQuery) -> bool:
+        if query.processed is not None and bool(item.get("processed")) != query.processed:
+            return False
+        if query.uploaded_from is not None and item["upload_date"] < query.uploaded_from:
+            return False
+        if query.uploaded_to is not None and item["upload_date"] > query.uploaded_to:
+            return False
+        if query.min_confidence is not None and top_confidence(item) < query.min_confidence:
+            return False
+        return True
+
+    def update(self, image_id: int, fields: dict) -> Optional[dict]:
+        with self._writing():
+            item = self._table.get(image_id)
+            if item is None:
+                return None
+            old = dict(item)
+            self._unindex(item)
+            item.update(fields)
+            self._index(item)
+            self._log({"op": "update", "id": image_id, "fields": fields})
+            self._record(old, dict(item))
+            return dict(item)
+
+    def delete(self, image_id: int) -> bool:
+        with self._writing():
+            item = self._table.pop(image_id, None)
+            if item is None:
+                return False
+            self._unindex(item)
+            self._log({"op": "delete", "id": image_id})
+            self._record(item, None)
+            return True
+
+    def _update_items(self, updates: dict[int, dict]) -> list[tuple[dict, dict]]:
+        """Обновляет поля записей в памяти; updates — ID -> новые значения полей."""
+        changes = []
+        for image_id in sorted(updates):
+            item = self._table.get(image_id)
+            if item is None:
+                continue
+            old = dict(item)
+            self._unindex(item)
+            item.update(updates[image_id])
+            self._index(item)
+            changes.append((old, dict(item)))
+            self._record(old, dict(item))
+        return changes
+
+    def update_many(self, image_ids: list[int], fields: dict) -> list[tuple[dict, dict]]:
+        with self._writing():
+            changes = self._update_items({image_id: fields for image_id in image_ids})
+            if changes:
+                # Одна запись журнала на всю операцию: она применяется целиком или не применяется
+                self._log({"op": "update_many", "ids": [old["id"] for old, _ in changes], "fields": fields})
+            return changes
+
+    def set_results_many(self, results: dict[int, list[dict]]) -> list[tuple[dict, dict]]:
+        with self._writing():
+            changes = self._update_items({
+                image_id: {"processed": True, "results": predictions}
+                for image_id, predictions in results.items()
+            })
+            if changes:
+                self._log({
+                    "op": "results_many",
+                    "results": {str(old["id"]): results[old["id"]] for old, _ in changes},
+                })
+            return changes
+
+    def delete_many(self, image_ids: list[int]) -> list[dict]:
+        with self._writing():
+            deleted = []
+            for image_id in sorted(set(image_ids)):
+                item = self._table.pop(image_id, None)
+                if item is not None:
+                    self._unindex(item)
+                    deleted.append(item)
+            if deleted:
+                self._log({"op": "delete_many", "ids": [item["id"] for item in deleted]})
+                for item in deleted:
+                    self._record(item, None)
+            return deleted
+
+    def count_by_hash(self, sha256: str) -> int:
+        with self._reading():
+            return len(self._by_hash.get(sha256, ()))
+
+    def find_by_hash(self, sha256: str) -> Optional[dict]:
+        with self._reading():
+            for image_id in self._by_hash.get(sha256, ()):
+                return dict(self._table[image_id])
+        return None
+
+    def find_processed_by_hash(self, sha256: str) -> Optional[dict]:
+        with self._reading():
+            for image_id in self._by_hash.get(sha256, ()):
+                item = self._table[image_id]
+                if item.get("processed") and item.get("results"):
+                    return dict(item)
+        return None
+
+    def consume_changes(self, until: Optional[int] = None) -> Optional[list[tuple[Optional[dict], Optional[dict]]]]:
+        with self._reading():
+            if until is None:
+                taken, self._changes = self._changes, []
+            else:
+                taken = [change for change in self._changes if change[0] <= until]
+                self._changes = [change for change in self._changes if change[0] > until]
+        return [(old, new) for _, old, new in taken]
+
+    @contextmanager
+    def snapshot(self) -> Iterator[tuple[int, Iterator[dict]]]:
+        with self._reading():
+            position = self._position
+            records = [dict(item) for item in self._table.values()]
+        yield position, iter(records)
+
+    def version(self) -> tuple[str, datetime]:
+        # Версия — снимок и прочитанная длина общего журнала, поэтому совпадает во всех процессах
+        with self._reading():
+            snapshot = self._snapshot_id or (0, 0, 0)
+            journal = _file_id(self.journal_path)
+            modified_ns = max(snapshot[1], journal[1] if journal else 0)
+            version = f"{snapshot[0]:x}{snapshot[1]:x}-{self._offset}"
+        return version, datetime.fromtimestamp(modified_ns / 1e9, tz=timezone.utc)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._lock:
+            self._journal.close()
+            os.close(self._lock_fd)
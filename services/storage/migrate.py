@@ -0,0 +1,111 @@
+"""Одноразовый перенос metadata.json в SQLite-хранилище.
+
+Запуск:
+    python -m services.storage.migrate [metadata.json] [metadata.db]
+
+При старте с SQLite-бэкендом перенос выполняется автоматически
+(migrate_if_needed), если база пуста, а metadata.json существует.
+"""
+
+import logging
+import os
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from services.storage.base import ImageQuery
+from services.storage.json_backend import JsonMetadataBackend
+from services.storage.sqlite_backend import SqliteMetadataBackend
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_json_to_sqlite(json_path: str, db_path: str) -> int:
+    """Импортирует записи из JSON-файла в SQLite с сохранением ID.
+
+    Повторный запуск безопасен: записи с совпадающими ID перезаписываются.
+
+    Args:
+        json_path: Путь к исходному metadata.json.
+        db_path: Путь к файлу базы SQLite.
+
+    Returns:
+        Количество перенесённых записей.
+
+    Raises:
+        FileNotFoundError: Если исходный файл не найден.
+    """
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"Файл метаданных не найден: {json_path}")
+
+    source = JsonMetadataBackend(json_path, flush_interval=0)
+    try:
+        records = source.all()
+    finally:
+        source.close()
+    backend = SqliteMetadataBackend(db_path)
+    try:
+        count = backend.import_records(records)
+    finally:
+        backend.close()
+    logger.info("Перенесено записей: %d (%s -> %s)", count, json_path, db_path)
+    return count
+
+
+# Без fcntl блокировка переноса действует только внутри процесса
+_local_lock = threading.Lock()
+
+
+def migrate_if_needed(json_path: str, db_path: str) -> int:
+    """Переносит metadata.json в пустую базу SQLite при первом запуске.
+
+    Воркеры стартуют одновременно, поэтому проверка и перенос выполняются
+    под файловой блокировкой рядом с базой. После переноса файл
+    переименовывается в <json_path>.migrated, чтобы не импортировать его
+    повторно; если база уже содержит записи, файл не трогается.
+
+    Returns:
+        Количество перенесённых записей (0, если перенос не требовался).
+    """
+    if not os.path.exists(json_path):
+        return 0
+    fd = os.open(f"{db_path}.migrate.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            _local_lock.acquire()
+        try:
+            if not os.path.exists(json_path):
+                return 0  # перенесён другим воркером
+            backend = SqliteMetadataBackend(db_path)
+            try:
+                empty = not backend.query(ImageQuery(limit=1))
+            finally:
+                backend.close()
+            if not empty:
+                logger.warning(
+                    "Найден %s, но база %s уже содержит записи — автоматический перенос пропущен",
+                    json_path, db_path,
+                )
+                return 0
+            count = migrate_json_to_sqlite(json_path, db_path)
+            os.replace(json_path, f"{json_path}.migrated")
+            return count
+        finally:
+            if fcntl is None:
+                _local_lock.release()
+    finally:
+        # Закрытие файла снимает flock
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    source = sys.argv[1] if len(sys.argv) > 1 else os.getenv("METADATA_FILE", "metadata.json")
+    target = sys.argv[2] if len(sys.argv) > 2 else os.getenv("METADATA_DB", "metadata.db")
+    migrate_json_to_sqlite(source, target)
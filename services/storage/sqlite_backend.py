@@ -0,0 +1,489 @@
+"""SQLite-бэкенд хранилища метаданных (режим WAL, индексы по ключевым полям и полям сортировки)."""
+
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from services.storage.base import ImageQuery, MetadataBackend
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    upload_date TEXT NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    results TEXT,
+    top_label TEXT,
+    top_confidence REAL,
+    mime_type TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    sha256 TEXT,
+    phash TEXT
+);
+"""
+
+# Столбцы, добавленные после первой версии схемы (для баз, созданных раньше)
+_ADDED_COLUMNS = {
+    "sha256": "TEXT",
+    "phash": "TEXT",
+}
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_images_processed ON images(processed);
+CREATE INDEX IF NOT EXISTS idx_images_top_label ON images(top_label);
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images(sha256);
+CREATE INDEX IF NOT EXISTS idx_images_upload_date ON images(upload_date, id);
+CREATE INDEX IF NOT EXISTS idx_images_size ON images(size_bytes, id);
+CREATE INDEX IF NOT EXISTS idx_images_confidence ON images(COALESCE(top_confidence, -1.0), id);
+"""
+
+# Версия данных: счётчик и время изменения (Unix, UTC) обновляются триггерами
+# в той же транзакции, что и изменение, в том числе из других процессов
+_VERSIONING = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+INSERT OR IGNORE INTO meta (key, value)
+    VALUES ('modified_at', (julianday('now') - 2440587.5) * 86400.0);
+""" + "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS images_version_{event.lower()} AFTER {event} ON images
+BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+    UPDATE meta SET value = (julianday('now') - 2440587.5) * 86400.0 WHERE key = 'modified_at';
+END;
+"""
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+
+_COLUMNS = (
+    "id", "filename", "path", "upload_date", "processed",
+    "results", "mime_type", "size_bytes", "sha256", "phash",
+)
+
+
+def _record_json(row: str) -> str:
+    """SQL-выражение: строка OLD или NEW в виде JSON-записи."""
+    values = (f"json({row}.{key})" if key == "results" else f"{row}.{key}" for key in _COLUMNS)
+    return "json_object(" + ", ".join(f"'{key}', {value}" for key, value in zip(_COLUMNS, values)) + ")"
+
+
+# Журнал изменений: записи до и после каждого изменения, в том числе из других
+# процессов. По нему процессы обновляют свои производные структуры (агрегаты,
+# индексы), не перестраивая их; хранятся последние CHANGELOG_SIZE изменений
+_CHANGELOG = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    old TEXT,
+    new TEXT
+);
+""" + "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS images_changes_{event.lower()} AFTER {event} ON images
+BEGIN
+    INSERT INTO changes (old, new) VALUES ({old}, {new});
+END;
+"""
+    for event, old, new in (
+        ("INSERT", "NULL", _record_json("NEW")),
+        ("UPDATE", _record_json("OLD"), _record_json("NEW")),
+        ("DELETE", _record_json("OLD"), "NULL"),
+    )
+)
+
+# Выражения сортировки; для каждого есть составной индекс (выражение, id)
+_SORT_EXPRESSIONS = {
+    "id": "id",
+    "upload_date": "upload_date",
+    "confidence": "COALESCE(top_confidence, -1.0)",
+    "size": "size_bytes",
+}
+
+# Предел числа параметров в одном выражении IN (...)
+_IN_CHUNK = 500
+
+# Ожидание блокировки записи, удерживаемой другим процессом, секунды
+BUSY_TIMEOUT_SECONDS = 30
+
+# Число последних изменений, хранимых в журнале изменений
+CHANGELOG_SIZE = 10000
+
+Change = tuple[int, Optional[dict], Optional[dict]]
+
+
+def _statements(script: str) -> list[str]:
+    """Разбивает SQL-скрипт на отдельные выражения (executescript завершил бы транзакцию)."""
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    return [statement for statement in statements if statement]
+
+
+def _to_row(record: dict) -> dict:
+    """Преобразует запись в набор значений столбцов таблицы."""
+    row = dict(record)
+    results = row.get("results")
+    row["processed"] = int(bool(row.get("processed")))
+    row["results"] = json.dumps(results, ensure_ascii=False) if results is not None else None
+    row["top_label"] = results[0]["label"] if results else None
+    row["top_confidence"] = results[0]["confidence"] if results else None
+    return row
+
+
+def _from_row(row: sqlite3.Row) -> dict:
+    """Преобразует строку таблицы в запись-словарь."""
+    record = {key: row[key] for key in _COLUMNS}
+    record["processed"] = bool(record["processed"])
+    if record["results"] is not None:
+        record["results"] = json.loads(record["results"])
+    return record
+
+
+def _from_json(value: Optional[str]) -> Optional[dict]:
+    """Преобразует запись из журнала изменений в запись-словарь."""
+    if value is None:
+        return None
+    record = json.loads(value)
+    record["processed"] = bool(record["processed"])
+    return record
+
+
+class SqliteMetadataBackend(MetadataBackend):
+    """Хранит записи в таблице SQLite с индексами по id, processed, top-1 метке и хешу.
+
+    Базу могут одновременно использовать несколько процессов (воркеры uvicorn):
+    ID выдаёт AUTOINCREMENT, каждое изменение выполняется транзакцией
+    BEGIN IMMEDIATE, а изменения всех процессов попадают в журнал изменений
+    (таблица changes), который каждый процесс дочитывает со своей позиции.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=BUSY_TIMEOUT_SECONDS
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Схема создаётся под блокировкой записи: воркеры стартуют одновременно
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in _statements(_SCHEMA):
+                self._conn.execute(statement)
+            self._migrate()
+            for statement in _statements(_INDEXES + _VERSIONING + _CHANGELOG):
+                self._conn.execute(statement)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        # Прочитанная часть журнала изменений и ещё не переданные изменения
+        self._seen_seq = self._read_seq(self._conn)
+        self._changes: list[Change] = []
+        self._changes_lost = False
+
+    @staticmethod
+    def _read_seq(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def _read_changes(self) -> tuple[list[sqlite3.Row], int]:
+        """Изменения журнала после прочитанной позиции и последний номер в журнале."""
+        last = self._read_seq(self._conn)
+        if last == self._seen_seq:
+            return [], last
+        rows = self._conn.execute(
+            "SELECT seq, old, new FROM changes WHERE seq > ? ORDER BY seq", (self._seen_seq,)
+        ).fetchall()
+        return rows, last
+
+    def _accept_changes(self, rows: list[sqlite3.Row], last: int) -> None:
+        """Добавляет прочитанные изменения к ещё не переданным."""
+        if last > self._seen_seq and (not rows or rows[0]["seq"] != self._seen_seq + 1):
+            # Процесс долго не читал журнал, и начало его изменений уже удалено
+            self._changes_lost = True
+        self._changes.extend((row["seq"], _from_json(row["old"]), _from_json(row["new"])) for row in rows)
+        self._seen_seq = max(last, rows[-1]["seq"] if rows else last)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Транзакция записи, дочитывающая журнал изменений.
+
+        В конце транзакции читаются изменения после прочитанной позиции:
+        изменения других процессов, сделанные до неё, и её собственные.
+        Они принимаются только после успешного COMMIT.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                rows, last = self._read_changes()
+                if last > CHANGELOG_SIZE:
+                    self._conn.execute("DELETE FROM changes WHERE seq <= ?", (last - CHANGELOG_SIZE,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._accept_changes(rows, last)
+
+    def consume_changes(self, until: Optional[int] = None) -> Optional[list[tuple[Optional[dict], Optional[dict]]]]:
+        with self._lock:
+            self._accept_changes(*self._read_changes())
+            if until is None:
+                taken, self._changes = self._changes, []
+            else:
+                taken = [change for change in self._changes if change[0] <= until]
+                self._changes = [change for change in self._changes if change[0] > until]
+            if self._changes_lost:
+                self._changes_lost = False
+                return None
+        return [(old, new) for _, old, new in taken]
+
+    @contextmanager
+    def snapshot(self) -> Iterator[tuple[int, Iterator[dict]]]:
+        # Отдельное соединение: его транзакция чтения видит один снимок базы
+        # и не мешает операциям через основное соединение
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=BUSY_TIMEOUT_SECONDS)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN")
+            position = self._read_seq(conn)
+            yield position, (_from_row(row) for row in conn.execute("SELECT * FROM images ORDER BY id"))
+        finally:
+            conn.close()
+
+    def _migrate(self) -> None:
+        """Добавляет в существующую таблицу столбцы из новых версий схемы."""
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(images)")}
+        for column, definition in _ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE images ADD COLUMN {column} {definition}")
+                logger.info("Схема метаданных: добавлен столбец %s", column)
+
+    def next_id(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'images'"
+            ).fetchone()
+        return (row["seq"] if row else 0) + 1
+
+    def add(self, record: dict) -> dict:
+        row = _to_row(record)
+        row.pop("id", None)
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{key}" for key in row)
+        with self._transaction() as conn:
+            cursor = conn.execute(f"INSERT INTO images ({columns}) VALUES ({placeholders})", row)
+        return {"id": cursor.lastrowid, **record}
+
+    def get(self, image_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM images WHERE id = ?", (image_id,)
+            ).fetchone()
+        return _from_row(row) if row else None
+
+    def _select_many(self, image_ids: list[int]) -> list[dict]:
+        records = []
+        for start in range(0, len(image_ids), _IN_CHUNK):
+            chunk = image_ids[start:start + _IN_CHUNK]
+            rows = self._conn.execute(
+                f"SELECT * FROM images WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            records.extend(_from_row(row) for row in rows)
+        records.sort(key=lambda record: record["id"])
+        return records
+
+    def get_many(self, image_ids: list[int]) -> list[dict]:
+        with self._lock:
+            return self._select_many(list(dict.fromkeys(image_ids)))
+
+    def all(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM images ORDER BY id").fetchall()
+        return [_from_row(row) for row in rows]
+
+    def query(self, query: ImageQuery) -> list[dict]:
+        conditions: list[str] = []
+        params: list = []
+        if query.processed is not None:
+            conditions.append("processed = ?")
+            params.append(int(query.processed))
+        if query.label is not None:
+            conditions.append("top_label = ?")
+            params.append(query.label)
+        if query.uploaded_from is not None:
+            conditions.append("upload_date >= ?")
+            params.append(query.uploaded_from)
+        if query.uploaded_to is not None:
+            conditions.append("upload_date <= ?")
+            params.append(query.uploaded_to)
+        if query.min_confidence is not None:
+            conditions.append("top_confidence >= ?")
+            params.append(query.min_confidence)
+
+        expression = _SORT_EXPRESSIONS[query.sort]
+        direction = "DESC" if query.descending else "ASC"
+        if query.after is not None:
+            if query.sort == "id":
+                conditions.append(f"id {'<' if query.descending else '>'} ?")
+                params.append(query.after[1])
+            else:
+                conditions.append(f"({expression}, id) {'<' if query.descending else '>'} (?, ?)")
+                params.extend(query.after)
+
+        sql = "SELECT * FROM images"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {expression} {direction}"
+        if query.sort != "id":
+            sql += f", id {direction}"
+        if query.limit is not None or query.offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend((query.limit if query.limit is not None else -1, query.offset))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [_from_row(row) for row in rows]
+
+    def update(self, image_id: int, fields: dict) -> Optional[dict]:
+        row = _to_row(fields)
+        if "results" not in fields:
+            row.pop("results")
+            row.pop("top_label")
+            row.pop("top_confidence")
+        if "processed" not in fields:
+            row.pop("processed")
+        assignments = ", ".join(f"{key} = :{key}" for key in row)
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE images SET {assignments} WHERE id = :image_id",
+                {**row, "image_id": image_id},
+            )
+            updated = conn.execute("SELECT * FROM images WHERE id = ?", (image_id,)).fetchone()
+        return _from_row(updated) if updated else None
+
+    def delete(self, image_id: int) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM images WHERE id = ?", (image_id,))
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _assignments(fields: dict) -> tuple[dict, str]:
+        """Значения столбцов и SET-выражение для обновления полей записи."""
+        row = _to_row(fields)
+        columns = [key for key in row if key in fields]
+        if "results" in fields:
+            columns += ["top_label", "top_confidence"]
+        return {key: row[key] for key in columns}, ", ".join(f"{key} = :{key}" for key in columns)
+
+    def update_many(self, image_ids: list[int], fields: dict) -> list[tuple[dict, dict]]:
+        values, assignments = self._assignments(fields)
+        with self._transaction():
+            changed = self._select_many(list(dict.fromkeys(image_ids)))
+            ids = [record["id"] for record in changed]
+            for start in range(0, len(ids), _IN_CHUNK):
+                chunk = ids[start:start + _IN_CHUNK]
+                placeholders = ", ".join(f":id{i}" for i in range(len(chunk)))
+                self._conn.execute(
+                    f"UPDATE images SET {assignments} WHERE id IN ({placeholders})",
+                    {**values, **{f"id{i}": image_id for i, image_id in enumerate(chunk)}},
+                )
+        return [(old, {**old, **fields}) for old in changed]
+
+    def set_results_many(self, results: dict[int, list[dict]]) -> list[tuple[dict, dict]]:
+        changes = []
+        with self._transaction():
+            rows = []
+            for old in self._select_many(list(results)):
+                fields = {"processed": True, "results": results[old["id"]]}
+                values, assignments = self._assignments(fields)
+                rows.append({**values, "image_id": old["id"]})
+                changes.append((old, {**old, **fields}))
+            if rows:
+                self._conn.executemany(
+                    f"UPDATE images SET {assignments} WHERE id = :image_id", rows
+                )
+        return changes
+
+    def delete_many(self, image_ids: list[int]) -> list[dict]:
+        with self._transaction():
+            deleted = self._select_many(list(dict.fromkeys(image_ids)))
+            ids = [record["id"] for record in deleted]
+            for start in range(0, len(ids), _IN_CHUNK):
+                chunk = ids[start:start + _IN_CHUNK]
+                self._conn.execute(
+                    f"DELETE FROM images WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+        return deleted
+
+    def count_by_hash(self, sha256: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM images WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        return row[0]
+
+    def find_by_hash(self, sha256: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM images WHERE sha256 = ? LIMIT 1", (sha256,)
+            ).fetchone()
+        return _from_row(row) if row else None
+
+    def find_processed_by_hash(self, sha256: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM images WHERE sha256 = ? AND processed = 1 "
+                "AND results IS NOT NULL LIMIT 1",
+                (sha256,),
+            ).fetchone()
+        return _from_row(row) if row else None
+
+    def version(self) -> tuple[str, datetime]:
+        with self._lock:
+            values = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        modified_at = datetime.fromtimestamp(values["modified_at"], tz=timezone.utc)
+        return str(values["version"]), modified_at
+
+    def import_records(self, records: list[dict]) -> int:
+        """Импортирует записи с сохранением их ID одной транзакцией.
+
+        Args:
+            records: Записи в формате metadata.json.
+
+        Returns:
+            Количество импортированных записей.
+        """
+        rows = [_to_row({"sha256": None, "phash": None, **record}) for record in records]
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO images "
+                "(id, filename, path, upload_date, processed, results, "
+                "top_label, top_confidence, mime_type, size_bytes, sha256, phash) "
+                "VALUES (:id, :filename, :path, :upload_date, :processed, :results, "
+                ":top_label, :top_confidence, :mime_type, :size_bytes, :sha256, :phash)",
+                rows,
+            )
+            # Замена записей не попадает в журнал изменений целиком: процессы,
+            # не увидевшие начала журнала, строят производные структуры заново
+            self._conn.execute("DELETE FROM changes")
+        return len(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,160 @@
+"""Миниатюры загруженных изображений.
+
+Миниатюры фиксированных размеров (THUMBNAIL_SIZES, по длинной стороне)
+создаются в фоновом пуле потоков после загрузки и хранятся рядом с
+оригиналом: <blob>.<размер>.<webp|jpg>. Блобы адресуются по SHA-256,
+поэтому содержимое миниатюры по пути не меняется. Если миниатюры ещё нет
+(загрузка до появления миниатюр или фоновая задача не успела), она
+создаётся по первому запросу.
+
+Оригинал декодируется один раз (для JPEG — в draft-режиме под самый
+большой размер), миниатюры уменьшаются последовательно от большей
+к меньшей и записываются атомарно: временный файл + os.replace.
+Оригинал могут удалить во время генерации: после переименования
+миниатюра проверяет, что оригинал на месте, и иначе удаляет себя.
+file_storage удаляет миниатюры после оригинала, поэтому миниатюра,
+записанная во время удаления, не остаётся на диске.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image, features
+
+from services import image_processor, metrics
+
+logger = logging.getLogger(__name__)
+
+# Размеры миниатюр: имя -> длинная сторона, пиксели
+THUMBNAIL_SIZES = {"small": 160, "medium": 480, "large": 1024}
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp").lower()
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_THREADS = int(os.getenv("THUMBNAIL_THREADS", "2"))
+
+if THUMBNAIL_FORMAT == "webp" and not features.check("webp"):
+    logger.warning("Pillow собран без WebP: миниатюры сохраняются в JPEG")
+    THUMBNAIL_FORMAT = "jpeg"
+
+_EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg"}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_THREADS, thread_name_prefix="thumbnails")
+# Оригиналы, миниатюры которых уже создаются: повторные запросы ждут ту же задачу
+_pending: dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+_GENERATE_SECONDS = metrics.histogram(
+    "thumbnail_generation_duration_seconds", "Создание миниатюр одного изображения"
+)
+_GENERATED = metrics.counter("thumbnails_generated_total", "Созданные миниатюры по размеру", ("size",))
+
+
+def media_type() -> str:
+    """MIME-тип миниатюр."""
+    return MEDIA_TYPES[THUMBNAIL_FORMAT]
+
+
+def thumbnail_path(original: str, size: str) -> str:
+    """Путь миниатюры размера size рядом с оригиналом."""
+    return f"{os.path.splitext(original)[0]}.{size}{_EXTENSIONS[THUMBNAIL_FORMAT]}"
+
+
+def _save(img: Image.Image, path: str, original: str) -> bool:
+    """Записывает миниатюру; возвращает False, если оригинал уже удалён."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        img.save(tmp_path, format=THUMBNAIL_FORMAT.upper(), quality=THUMBNAIL_QUALITY)
+        if not os.path.exists(original):
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Оригинал могли удалить между проверкой и переименованием
+    if not os.path.exists(original):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return False
+    return True
+
+
+def generate(original: str) -> list[str]:
+    """Создаёт недостающие миниатюры изображения.
+
+    Returns:
+        Пути созданных миниатюр.
+
+    Raises:
+        OSError: Если оригинал не читается или не декодируется.
+    """
+    missing = [
+        size for size in sorted(THUMBNAIL_SIZES, key=THUMBNAIL_SIZES.get, reverse=True)
+        if not os.path.exists(thumbnail_path(original, size))
+    ]
+    if not missing:
+        return []
+    created = []
+    with _GENERATE_SECONDS.time():
+        img = image_processor.open_image(original, THUMBNAIL_SIZES[missing[0]])
+        for size in missing:
+            side = THUMBNAIL_SIZES[size]
+            # Уменьшаем предыдущую (большую) миниатюру, а не оригинал
+            img.thumbnail((side, side), Image.LANCZOS, reducing_gap=2.0)
+            path = thumbnail_path(original, size)
+            if not _save(img, path, original):
+                logger.info("Оригинал удалён во время создания миниатюр: %s", original)
+                break
+            _GENERATED.labels(size).inc()
+            created.append(path)
+    return created
+
+
+def _generate_quietly(original: str) -> None:
+    try:
+        generate(original)
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось создать миниатюры %s: %s", original, str(e))
+    finally:
+        with _pending_lock:
+            _pending.pop(original, None)
+
+
+def schedule(original: str) -> Future:
+    """Ставит создание миниатюр изображения в фоновый пул (без повторной постановки)."""
+    with _pending_lock:
+        future = _pending.get(original)
+        if future is None:
+            future = _pool.submit(_generate_quietly, original)
+            _pending[original] = future
+        return future
+
+
+async def ensure(original: str, size: str) -> str:
+    """Возвращает путь миниатюры, при необходимости дожидаясь её создания.
+
+    Raises:
+        FileNotFoundError: Если миниатюру не удалось создать.
+    """
+    path = thumbnail_path(original, size)
+    if not await asyncio.to_thread(os.path.exists, path):
+        await asyncio.wrap_future(schedule(original))
+        if not await asyncio.to_thread(os.path.exists, path):
+            raise FileNotFoundError(path)
+    return path
+
+
+def derived_paths(original: str) -> list[str]:
+    """Пути всех возможных миниатюр оригинала (для удаления вместе с ним)."""
+    base = os.path.splitext(original)[0]
+    return [
+        f"{base}.{size}{extension}"
+        for size in THUMBNAIL_SIZES for extension in _EXTENSIONS.values()
+    ]
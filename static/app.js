@@ -33,6 +33,7 @@ document.querySelectorAll('.nav-btn').forEach(btn => {
     btn.classList.add('active');
     document.getElementById('tab-' + btn.dataset.tab).classList.add('active');
     if (btn.dataset.tab === 'workspace') loadFiles();
+    if (btn.dataset.tab === 'gallery') loadGallery();
     if (btn.dataset.tab === 'results') loadStats();
   });
 });
@@ -260,10 +261,10 @@ async function recognizeSingle() {
 async function recognizeBatch() {
   log('Loading unprocessed files...');
   try {
-    const filesRes = await fetch(API + '/files/');
+    const filesRes = await fetch(API + '/files/?processed=false&fields=id');
     if (!filesRes.ok) throw new Error(filesRes.statusText);
     const files = await filesRes.json();
-    const ids = files.filter(f => !f.processed).map(f => f.id);
+    const ids = files.map(f => f.id);
     if (!ids.length) { log('No unprocessed files.', 'info'); return; }
     log(`Recognizing ${ids.length} file(s)...`);
     const res = await fetch(API + '/inference/batch', {
@@ -273,8 +274,10 @@ async function recognizeBatch() {
     });
     if (!res.ok) throw new Error((await res.json()).detail || res.statusText);
     const data = await res.json();
-    log(`Batch inference complete: ${data.length} result(s).`, 'ok');
-    renderInferenceResults(data);
+    const failed = data.filter(r => r.error);
+    failed.forEach(r => log(`File #${r.id}: ${r.error}`, 'err'));
+    log(`Batch inference complete: ${data.length - failed.length} result(s), ${failed.length} error(s).`, 'ok');
+    renderInferenceResults(data.filter(r => !r.error));
     loadFiles();
   } catch (e) {
     log('Batch inference failed: ' + e.message, 'err');
@@ -296,6 +299,43 @@ function renderInferenceResults(results) {
     }).join('') + '</tbody></table>';
 }
 
+// --- Gallery ---
+const GALLERY_PAGE = 60;
+let galleryCursor = null;
+let galleryCount = 0;
+
+function imageUrl(f, size) {
+  // With the content version (SHA-256 prefix) the response is cached as immutable
+  const version = f.sha256 ? `&v=${f.sha256.slice(0, 16)}` : '';
+  return `${API}/files/${f.id}/image?size=${size}${version}`;
+}
+
+async function loadGallery(more = false) {
+  const el = document.getElementById('gallery');
+  if (!more) { el.innerHTML = ''; galleryCursor = null; galleryCount = 0; }
+  try {
+    let url = `${API}/files/?limit=${GALLERY_PAGE}&sort=id&order=desc&fields=id,filename,sha256,results`;
+    if (galleryCursor) url += '&cursor=' + encodeURIComponent(galleryCursor);
+    const res = await fetch(url);
+    if (!res.ok) throw new Error(res.statusText);
+    const page = await res.json();
+    el.insertAdjacentHTML('beforeend', page.items.map(f => {
+      const label = f.results && f.results.length ? f.results[0].label : 'pending';
+      return `<div class="gallery-item" onclick="window.open('${imageUrl(f, 'large')}', '_blank')">
+        <img src="${imageUrl(f, 'small')}" alt="${esc(f.filename)}" loading="lazy" decoding="async">
+        <div class="caption">#${f.id} ${esc(label)}</div>
+      </div>`;
+    }).join(''));
+    galleryCount += page.items.length;
+    galleryCursor = page.next_cursor;
+    document.getElementById('galleryMore').style.display = galleryCursor ? 'inline-block' : 'none';
+    document.getElementById('galleryHint').textContent =
+      galleryCount ? `${galleryCount} image(s) shown` : 'No files uploaded yet.';
+  } catch (e) {
+    log('Failed to load gallery: ' + e.message, 'err');
+  }
+}
+
 // --- Stats ---
 async function loadStats() {
   try {
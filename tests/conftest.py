@@ -0,0 +1,40 @@
+"""Общая настройка тестов: хранилища и загрузки во временном каталоге.
+
+Сервисы читают настройки из окружения при импорте, поэтому переменные
+задаются здесь, до импорта модулей приложения.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_WORKDIR = tempfile.mkdtemp(prefix="cars-tests-")
+os.environ.update(
+    METADATA_BACKEND="sqlite",
+    METADATA_DB=os.path.join(_WORKDIR, "metadata.db"),
+    METADATA_FILE=os.path.join(_WORKDIR, "metadata.json"),
+    UPLOAD_DIR=os.path.join(_WORKDIR, "uploads"),
+    JOBS_DIR=os.path.join(_WORKDIR, "jobs"),
+    JOBS_FILE=os.path.join(_WORKDIR, "jobs.json"),
+    PREDICTION_CACHE_DB=os.path.join(_WORKDIR, "prediction_cache.db"),
+    CLASSIFIER_BACKEND="dummy",
+    JOB_QUEUE_BACKEND="memory",
+)
+
+
+@pytest.fixture
+def client():
+    """Клиент приложения с пустым хранилищем."""
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as test_client:
+        test_client.delete("/files/")
+        yield test_client
+        test_client.delete("/files/")
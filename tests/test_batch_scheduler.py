@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from services import batch_scheduler
+from services.hf_client import RateLimitError
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_run_bounded_keeps_order_and_errors():
+    async def worker(item: int) -> int:
+        await asyncio.sleep(0)
+        if item % 5 == 0:
+            raise ValueError(f"bad {item}")
+        return item * 2
+
+    outcomes = _run(batch_scheduler.run_bounded(list(range(20)), worker, max_in_flight=4))
+
+    assert [o.value for o in outcomes if o.ok] == [i * 2 for i in range(20) if i % 5]
+    assert [o.error for o in outcomes if not o.ok] == [f"bad {i}" for i in range(0, 20, 5)]
+
+
+def test_run_bounded_respects_max_in_flight():
+    in_flight = 0
+    peak = 0
+
+    async def worker(item: int) -> None:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+
+    _run(batch_scheduler.run_bounded(list(range(200)), worker, max_in_flight=8))
+
+    assert peak == 8
+
+
+def test_run_bounded_reports_each_result_once():
+    seen: list[int] = []
+
+    async def worker(item: int) -> int:
+        return item
+
+    _run(batch_scheduler.run_bounded(
+        list(range(50)), worker, max_in_flight=3, on_result=lambda index, outcome: seen.append(index),
+    ))
+
+    assert sorted(seen) == list(range(50))
+
+
+def test_run_bounded_retries_rate_limited_items():
+    attempts: dict[int, int] = {}
+
+    async def worker(item: int) -> int:
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 3 and attempts[item] == 1:
+            raise RateLimitError("429", retry_after=0.01)
+        return item
+
+    outcomes = _run(batch_scheduler.run_bounded(list(range(6)), worker, max_in_flight=4))
+
+    assert all(o.ok for o in outcomes)
+    assert attempts[3] == 2
+
+
+def test_limiter_halves_limit_on_rate_limit():
+    async def scenario() -> int:
+        limiter = batch_scheduler.AdaptiveLimiter(8)
+        await limiter.acquire()
+        await limiter.release(rate_limited=True, retry_after=0)
+        return limiter.limit
+
+    assert _run(scenario()) == 4
+
+
+def test_scheduler_overhead_is_linear():
+    async def worker(item: int) -> int:
+        # Уступаем цикл, чтобы остальные элементы действительно ждали слот
+        await asyncio.sleep(0)
+        return item
+
+    def elapsed(count: int) -> float:
+        started = time.perf_counter()
+        _run(batch_scheduler.run_bounded(list(range(count)), worker, max_in_flight=8))
+        return time.perf_counter() - started
+
+    elapsed(1000)  # прогрев
+    small = elapsed(2000)
+    large = elapsed(16000)
+
+    # 8x элементов: при линейной стоимости ~8x времени, при квадратичной ~64x
+    assert large < max(small, 0.01) * 24
+    assert large < 5.0
+
+
+def test_iter_bounded_yields_every_item():
+    async def source():
+        for item in range(100):
+            yield item
+
+    async def worker(item: int) -> int:
+        await asyncio.sleep(0)
+        return item
+
+    async def collect() -> list[int]:
+        return [outcome.value async for _, outcome in batch_scheduler.iter_bounded(source(), worker, 4)]
+
+    assert sorted(_run(collect())) == list(range(100))
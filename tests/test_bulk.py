@@ -0,0 +1,79 @@
+import io
+
+import pytest
+from PIL import Image
+
+
+def _upload(client, count: int) -> list[int]:
+    ids = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (32 + index, 32), (index * 40 % 256, 80, 120)).save(buffer, "JPEG")
+        response = client.post("/upload/", files={"file": (f"{index}.jpg", buffer.getvalue(), "image/jpeg")})
+        ids.append(response.json()["files"][0]["id"])
+    return ids
+
+
+def _ids(client) -> list[int]:
+    return [image["id"] for image in client.get("/files/").json()]
+
+
+@pytest.mark.parametrize("operation", ["delete", "reprocess", "recognize"])
+@pytest.mark.parametrize("body", [None, {}, {"all": False}])
+def test_bulk_without_selection_is_rejected(client, operation, body):
+    ids = _upload(client, 2)
+
+    response = client.post(f"/files/bulk/{operation}", json=body)
+
+    assert response.status_code == 400
+    assert _ids(client) == ids
+
+
+def test_bulk_delete_by_ids(client):
+    ids = _upload(client, 3)
+
+    result = client.post("/files/bulk/delete", json={"ids": [ids[0], ids[0], 999]}).json()
+
+    assert result["requested"] == 2
+    assert result["succeeded"] == 1
+    assert [item["status"] for item in result["items"]] == ["deleted", "not_found"]
+    assert _ids(client) == ids[1:]
+
+
+def test_empty_id_list_selects_nothing(client):
+    ids = _upload(client, 2)
+
+    result = client.post("/files/bulk/delete", json={"ids": []}).json()
+
+    assert result["requested"] == 0
+    assert _ids(client) == ids
+
+
+def test_bulk_delete_by_filter(client):
+    ids = _upload(client, 3)
+    client.post("/inference/batch", json=ids[:1])
+
+    result = client.post("/files/bulk/delete?processed=false").json()
+
+    assert sorted(item["id"] for item in result["items"]) == ids[1:]
+    assert _ids(client) == ids[:1]
+
+
+def test_bulk_delete_all_requires_explicit_flag(client):
+    _upload(client, 3)
+
+    result = client.post("/files/bulk/delete", json={"all": True}).json()
+
+    assert result["succeeded"] == 3
+    assert _ids(client) == []
+
+
+def test_bulk_reprocess_by_ids(client):
+    ids = _upload(client, 2)
+    client.post("/inference/batch", json=ids)
+
+    result = client.post("/files/bulk/reprocess", json={"ids": ids[:1]}).json()
+
+    assert result["succeeded"] == 1
+    processed = {image["id"]: image["processed"] for image in client.get("/files/").json()}
+    assert processed == {ids[0]: False, ids[1]: True}
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from routers import upload
+from services import file_storage, metadata_store
+
+
+def _png(size: tuple[int, int], mode: str = "RGB") -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _blobs() -> list[str]:
+    return [name for _, _, names in os.walk(upload.UPLOAD_DIR) for name in names]
+
+
+def test_upload_stores_blob_with_phash(client):
+    response = client.post("/upload/", files={"file": ("car.png", _png((64, 48)), "image/png")})
+
+    assert response.status_code == 200
+    record = client.get(f"/files/{response.json()['files'][0]['id']}").json()
+    assert record["phash"] is not None
+    assert os.path.exists(record["path"])
+    assert not [name for name in _blobs() if name.endswith(".part")]
+
+
+def test_decompression_bomb_upload_is_stored_without_phash(client):
+    # 14000×14000 больше двойного лимита Pillow: Image.open выбрасывает DecompressionBombError
+    response = client.post("/upload/", files={"file": ("bomb.png", _png((14000, 14000), "1"), "image/png")})
+
+    assert response.status_code == 200
+    record = client.get(f"/files/{response.json()['files'][0]['id']}").json()
+    assert record["phash"] is None
+    assert os.path.exists(record["path"])
+
+
+def test_failed_processing_leaves_no_blob(client, monkeypatch):
+    async def broken_phash(path: str):
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(file_storage, "_phash", broken_phash)
+    content = _png((64, 48))
+
+    with pytest.raises(RuntimeError):
+        client.post("/upload/", files={"file": ("car.png", content, "image/png")})
+
+    path = file_storage.blob_path(upload.UPLOAD_DIR, hashlib.sha256(content).hexdigest(), ".png")
+    assert not os.path.exists(path)
+    assert not [name for name in _blobs() if name.endswith(".part")]
+    assert client.get("/files/").json() == []
+
+
+def test_duplicate_upload_reuses_stored_phash(client, monkeypatch):
+    content = _png((64, 48))
+    first = client.post("/upload/", files={"file": ("a.png", content, "image/png")}).json()["files"][0]
+
+    async def no_phash(path: str):
+        raise AssertionError("дубликат декодирован заново")
+
+    scheduled = []
+    monkeypatch.setattr(file_storage, "_phash", no_phash)
+    monkeypatch.setattr(file_storage.thumbnails, "schedule", scheduled.append)
+    second = client.post("/upload/", files={"file": ("b.png", content, "image/png")}).json()["files"][0]
+
+    assert second["phash"] == first["phash"] is not None
+    assert second["path"] == first["path"]
+    assert scheduled == []
+
+
+def test_release_waits_for_upload_of_same_content(client):
+    content = _png((64, 48))
+    first = client.post("/upload/", files={"file": ("a.png", content, "image/png")}).json()["files"][0]
+    # Последняя ссылка удалена, но блоб ещё не освобождён
+    metadata_store.delete_by_id(first["id"])
+    pool = ThreadPoolExecutor(max_workers=1)
+
+    def register(stored: file_storage.StoredFile):
+        releasing = pool.submit(file_storage._release, stored.path, stored.sha256)
+        time.sleep(0.2)
+        # Удаление ждёт блокировку блоба, пока запись не добавлена
+        assert not releasing.done()
+        image = metadata_store.add_image("b.png", stored.path, "image/png", stored.size_bytes, stored.sha256, stored.phash)
+        return image, releasing
+
+    upload_file = UploadFile(io.BytesIO(content), filename="b.png")
+    image, releasing = asyncio.run(file_storage.save_upload(upload_file, upload.UPLOAD_DIR, register))
+
+    assert releasing.result(timeout=5) is False
+    assert os.path.exists(image.path)
+    pool.shutdown()
+
+
+def test_original_is_served_with_type_of_blob_content(client):
+    response = client.post("/upload/", files={"file": ("car.jpg", _png((64, 48)), "image/jpeg")})
+    image_id = response.json()["files"][0]["id"]
+
+    image = client.get(f"/files/{image_id}/image")
+
+    assert image.status_code == 200
+    assert image.headers["content-type"] == "image/png"
+    assert image.headers["x-content-type-options"] == "nosniff"
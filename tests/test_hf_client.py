@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from services import hf_client
+from services.resilience import CircuitBreaker, RetryPolicy
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Заглушка HF API: отвечает заданными статусом, телом и типом содержимого."""
+    state = {"status": 503, "body": "<html><body>Bad gateway</body></html>", "type": "text/html", "hits": 0}
+    monkeypatch.setattr(hf_client, "API_TOKEN", "test")
+    monkeypatch.setattr(hf_client, "_retry_policy", RetryPolicy(max_attempts=2, base_seconds=0.001))
+    monkeypatch.setattr(hf_client, "_breaker", CircuitBreaker("test", failure_threshold=1))
+    return state
+
+
+def _call(api: dict, monkeypatch) -> Exception | list:
+    async def handler(request: web.Request) -> web.Response:
+        api["hits"] += 1
+        return web.Response(status=api["status"], text=api["body"], content_type=api["type"])
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(hf_client, "API_URL", f"http://127.0.0.1:{port}/")
+        try:
+            return await hf_client._fetch_predictions(b"data")
+        except Exception as e:
+            return e
+        finally:
+            await hf_client.shutdown()
+            await runner.cleanup()
+
+    return asyncio.run(scenario())
+
+
+def test_html_503_is_retried_and_opens_breaker(api, monkeypatch):
+    result = _call(api, monkeypatch)
+
+    assert isinstance(result, hf_client.UpstreamError)
+    assert result.reason == "unavailable"
+    assert api["hits"] == 2
+    assert hf_client._breaker.state == CircuitBreaker.OPEN
+
+
+def test_json_503_loading_uses_estimated_time(api, monkeypatch):
+    api.update(body='{"error": "Model is currently loading", "estimated_time": 0.001}', type="application/json")
+
+    result = _call(api, monkeypatch)
+
+    assert isinstance(result, hf_client.UpstreamError)
+    assert result.reason == "loading"
+    assert result.retry_after == 0.001
+
+
+def test_malformed_success_body_is_transient(api, monkeypatch):
+    api.update(status=200, body="not json", type="application/json")
+
+    result = _call(api, monkeypatch)
+
+    assert isinstance(result, hf_client.UpstreamError)
+    assert result.reason == "bad_response"
+    assert hf_client._breaker.state == CircuitBreaker.OPEN
+
+
+def test_success_returns_top3(api, monkeypatch):
+    api.update(
+        status=200, type="application/json",
+        body='[{"label": "a", "score": 0.1}, {"label": "b", "score": 0.5},'
+             ' {"label": "c", "score": 0.3}, {"label": "d", "score": 0.05}]',
+    )
+
+    result = _call(api, monkeypatch)
+
+    assert [prediction.label for prediction in result] == ["b", "c", "a"]
+
+
+@pytest.mark.parametrize("body", ['{"error": "x"}', '[{"label": "a"}]', '[{"label": "a", "score": "high"}]'])
+def test_half_open_probe_with_wrong_shape_body_reopens_breaker(api, monkeypatch, body):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    monkeypatch.setattr(hf_client, "_breaker", breaker)
+    api.update(status=200, body=body, type="application/json")
+
+    result = _call(api, monkeypatch)
+
+    assert isinstance(result, hf_client.UpstreamError)
+    assert result.reason == "bad_response"
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker._probing
+
+
+def test_unexpected_error_finishes_half_open_probe(api, monkeypatch):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    monkeypatch.setattr(hf_client, "_breaker", breaker)
+
+    async def broken(data: bytes):
+        raise KeyError("score")
+
+    monkeypatch.setattr(hf_client, "_request_predictions", broken)
+
+    with pytest.raises(KeyError):
+        asyncio.run(hf_client._fetch_predictions(b"data"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker._probing
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+from models.schemas import BatchInferenceItem, JobStatus
+from services import job_queue
+from services.job_store import FileJobStore
+
+
+def _upload(client, count: int) -> list[int]:
+    ids = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (32 + index, 40), (10, index * 50 % 256, 90)).save(buffer, "JPEG")
+        response = client.post("/upload/", files={"file": (f"{index}.jpg", buffer.getvalue(), "image/jpeg")})
+        ids.append(response.json()["files"][0]["id"])
+    return ids
+
+
+def _wait(client, job_id: str) -> dict:
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = client.get(f"/inference/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Задание {job_id} не завершилось")
+
+
+def _job(image_ids: list[int], status: str = "queued", updated_at: datetime | None = None) -> JobStatus:
+    now = datetime.now()
+    return JobStatus(
+        id=uuid.uuid4().hex, status=status, created_at=now, updated_at=updated_at or now,
+        image_ids=image_ids, total=len(image_ids),
+    )
+
+
+def test_job_runs_and_keeps_results_out_of_summary(client):
+    ids = _upload(client, 4)
+
+    job_id = client.post("/inference/jobs", json={"image_ids": ids}).json()["id"]
+    job = _wait(client, job_id)
+
+    assert job["status"] == "completed"
+    assert job["completed"] == 4
+    assert [item["id"] for item in job["results"]] == ids
+    with open(os.path.join(job_queue.JOBS_DIR, f"{job_id}.json"), encoding="utf-8") as f:
+        assert "results" not in json.load(f)
+    with open(os.path.join(job_queue.JOBS_DIR, f"{job_id}.results.jsonl"), encoding="utf-8") as f:
+        assert len(f.readlines()) == 4
+
+
+def test_job_created_by_another_process_is_visible_and_processed(client):
+    ids = _upload(client, 2)
+    # Другой процесс сохранил задание в общем хранилище и поставил его в свою очередь
+    other = FileJobStore(job_queue.JOBS_DIR)
+    job = _job(ids)
+    asyncio.run(other.save(job))
+
+    assert client.get(f"/inference/jobs/{job.id}").json()["status"] == "queued"
+
+    client.portal.call(job_queue._queue.put, job.id)
+
+    assert _wait(client, job.id)["completed"] == 2
+
+
+def test_job_claimed_elsewhere_is_not_run(client):
+    ids = _upload(client, 1)
+    other = FileJobStore(job_queue.JOBS_DIR)
+    job = _job(ids)
+
+    async def claim() -> bool:
+        await other.save(job)
+        return await other.claim(job.id)
+
+    assert asyncio.run(claim())
+    client.portal.call(job_queue._queue.put, job.id)
+    time.sleep(0.2)
+
+    assert client.get(f"/inference/jobs/{job.id}").json()["status"] == "queued"
+    asyncio.run(other.release(job.id))
+
+
+def test_unknown_or_malformed_job_id_is_404(client):
+    assert client.get(f"/inference/jobs/{uuid.uuid4().hex}").status_code == 404
+    assert client.get("/inference/jobs/..%2F..%2Fjobs").status_code == 404
+
+
+def test_resumed_job_counts_come_from_results(tmp_path):
+    store = FileJobStore(str(tmp_path))
+    job = _job([1, 2, 3], status="running")
+
+    async def scenario() -> JobStatus:
+        await store.save(job)
+        await store.append_results(job.id, [
+            BatchInferenceItem(id=3, error="нет файла"),
+            BatchInferenceItem(id=1, predictions=[]),
+        ])
+        return await store.load(job.id)
+
+    loaded = asyncio.run(scenario())
+
+    assert [item.id for item in loaded.results] == [1, 3]
+    assert (loaded.completed, loaded.failed) == (1, 1)
+
+
+def test_purge_removes_only_old_finished_jobs(tmp_path):
+    store = FileJobStore(str(tmp_path))
+    old = datetime.now() - timedelta(days=2)
+    finished = _job([1], status="completed", updated_at=old)
+    running = _job([2], status="running", updated_at=old)
+    recent = _job([3], status="completed")
+
+    async def scenario() -> int:
+        for job in (finished, running, recent):
+            await store.save(job)
+        await store.append_results(finished.id, [BatchInferenceItem(id=1, predictions=[])])
+        return await store.purge(datetime.now() - timedelta(days=1))
+
+    assert asyncio.run(scenario()) == 1
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{running.id}.json", f"{recent.id}.json"])
+
+
+def test_claim_is_exclusive_between_stores(tmp_path):
+    first, second = FileJobStore(str(tmp_path)), FileJobStore(str(tmp_path))
+    job_id = uuid.uuid4().hex
+
+    async def scenario() -> list[bool]:
+        results = [await first.claim(job_id), await second.claim(job_id), await second.is_claimed(job_id)]
+        await first.release(job_id)
+        results += [await second.is_claimed(job_id), await second.claim(job_id)]
+        await second.close()
+        return results
+
+    assert asyncio.run(scenario()) == [True, False, True, False, True]
+
+
+def test_claim_cuts_partial_line_left_by_crashed_writer(tmp_path):
+    store = FileJobStore(str(tmp_path))
+    job = _job([1, 2, 3], status="running")
+
+    async def scenario() -> JobStatus:
+        await store.save(job)
+        await store.append_results(job.id, [BatchInferenceItem(id=1, predictions=[])])
+        with open(tmp_path / f"{job.id}.results.jsonl", "a", encoding="utf-8") as f:
+            f.write('{"id": 2, "predi')
+        assert await store.claim(job.id)
+        await store.append_results(job.id, [BatchInferenceItem(id=3, predictions=[])])
+        await store.release(job.id)
+        return await store.load(job.id)
+
+    loaded = asyncio.run(scenario())
+
+    assert [item.id for item in loaded.results] == [1, 3]
+
+
+def test_corrupted_result_lines_are_skipped(tmp_path):
+    store = FileJobStore(str(tmp_path))
+    job = _job([1, 2], status="running")
+    asyncio.run(store.save(job))
+    with open(tmp_path / f"{job.id}.results.jsonl", "w", encoding="utf-8") as f:
+        f.write('{"id": 1, "predictions": []}\n{"id": 2, "predi{"id": 2\n')
+
+    loaded = asyncio.run(store.load(job.id))
+    items, position = asyncio.run(store.read_results(job.id, 0))
+
+    assert [item.id for item in loaded.results] == [1]
+    assert [item.id for item in items] == [1]
+    assert position == os.path.getsize(tmp_path / f"{job.id}.results.jsonl")
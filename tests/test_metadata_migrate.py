@@ -0,0 +1,47 @@
+import os
+from datetime import datetime
+
+from services import metadata_store
+from services.storage import JsonMetadataBackend
+from services.storage.migrate import migrate_if_needed
+
+
+def _populate(path: str, count: int) -> list[dict]:
+    backend = JsonMetadataBackend(path, flush_interval=0)
+    records = [
+        backend.add({
+            "filename": f"{index}.jpg", "path": f"/tmp/{index}.jpg",
+            "upload_date": datetime.now().isoformat(), "processed": False, "results": None,
+            "mime_type": "image/jpeg", "size_bytes": 10, "sha256": None, "phash": None,
+        })
+        for index in range(count)
+    ]
+    backend.close()
+    return records
+
+
+def test_existing_metadata_json_is_migrated_on_first_start(tmp_path, monkeypatch):
+    json_path, db_path = str(tmp_path / "metadata.json"), str(tmp_path / "metadata.db")
+    records = _populate(json_path, 3)
+    monkeypatch.setattr(metadata_store, "METADATA_FILE", json_path)
+    monkeypatch.setattr(metadata_store, "METADATA_DB", db_path)
+    monkeypatch.setattr(metadata_store, "_backend", None)
+
+    try:
+        images = metadata_store.get_all()
+    finally:
+        metadata_store.close()
+
+    assert [image.id for image in images] == [record["id"] for record in records]
+    assert not os.path.exists(json_path)
+    assert os.path.exists(json_path + ".migrated")
+
+
+def test_migration_skips_non_empty_database(tmp_path):
+    json_path, db_path = str(tmp_path / "metadata.json"), str(tmp_path / "metadata.db")
+    _populate(json_path, 2)
+    assert migrate_if_needed(json_path, db_path) == 2
+    _populate(json_path, 5)
+
+    assert migrate_if_needed(json_path, db_path) == 0
+    assert os.path.exists(json_path)
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+from services import metadata_store, phash_index, stats
+from services.storage import JsonMetadataBackend, SqliteMetadataBackend, sqlite_backend
+
+
+def _record(name: str, phash: str = "0f0f0f0f0f0f0f0f") -> dict:
+    return {
+        "filename": name, "path": f"/tmp/{name}", "upload_date": datetime.now().isoformat(),
+        "processed": False, "results": None, "mime_type": "image/jpeg", "size_bytes": 10,
+        "sha256": None, "phash": phash,
+    }
+
+
+def _results(label: str) -> list[dict]:
+    return [{"label": label, "confidence": 0.9}]
+
+
+def _forbid_rebuild(monkeypatch) -> None:
+    def build(records):
+        raise AssertionError("производная структура перестроена")
+
+    monkeypatch.setattr(stats, "_build", build)
+    monkeypatch.setattr(phash_index, "_build", build)
+
+
+def test_changes_of_other_process_are_replayed_without_rebuild(client, monkeypatch):
+    metadata_store.add_image("own.jpg", "/tmp/own.jpg", "image/jpeg", 10)
+    assert stats.get_summary()["total_files"] == 1
+    assert phash_index.find_similar("0f0f0f0f0f0f0f0f", 0) == []
+    _forbid_rebuild(monkeypatch)
+    other = SqliteMetadataBackend(metadata_store.METADATA_DB)
+
+    added = other.add(_record("other.jpg"))
+    other.set_results_many({added["id"]: _results("BMW M3 Coupe 2012")})
+    removed = other.add(_record("removed.jpg", phash="ffffffffffffffff"))
+    other.delete(removed["id"])
+    other.close()
+
+    summary = stats.get_summary()
+    assert (summary["total_files"], summary["processed_files"]) == (2, 1)
+    assert summary["top_brands"] == [{"label": "BMW M3 Coupe 2012", "count": 1}]
+    assert phash_index.find_similar("0f0f0f0f0f0f0f0f", 0) == [(added["id"], 0)]
+
+
+def test_lost_changes_rebuild_derived_structures(client, monkeypatch):
+    assert stats.get_summary()["total_files"] == 0
+    monkeypatch.setattr(sqlite_backend, "CHANGELOG_SIZE", 2)
+    other = SqliteMetadataBackend(metadata_store.METADATA_DB)
+    for index in range(5):
+        other.add(_record(f"{index}.jpg"))
+    other.close()
+
+    assert stats.get_summary()["total_files"] == 5
+    assert stats.rebuild()["consistent"]
+
+
+def test_snapshot_position_splits_pending_changes(tmp_path):
+    path = str(tmp_path / "metadata.db")
+    backend, other = SqliteMetadataBackend(path), SqliteMetadataBackend(path)
+    first = backend.add(_record("first.jpg"))
+    with backend.snapshot() as (position, records):
+        ids = [record["id"] for record in records]
+        second = other.add(_record("second.jpg"))
+
+        assert ids == [first["id"]]
+        assert backend.consume_changes(until=position) == [(None, first)]
+    assert backend.consume_changes() == [(None, second)]
+    assert backend.consume_changes() == []
+    backend.close()
+    other.close()
+
+
+def test_json_backend_reports_changes_after_foreign_snapshot_rewrite(tmp_path):
+    path = str(tmp_path / "metadata.json")
+    backend = JsonMetadataBackend(path, flush_interval=0)
+    other = JsonMetadataBackend(path, flush_interval=0)
+    kept = backend.add(_record("kept.jpg"))
+    removed = backend.add(_record("removed.jpg"))
+    backend.consume_changes()
+
+    other.set_results_many({kept["id"]: _results("Audi A4 Sedan 2012")})
+    other.delete(removed["id"])
+    other.flush()
+
+    changes = backend.consume_changes()
+    assert [(old and old["id"], new and new["processed"]) for old, new in changes] == [
+        (kept["id"], True), (removed["id"], None),
+    ]
+    other.close()
+    backend.close()
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import metrics
+from services.micro_batcher import MicroBatcher
+
+
+def _blocking_batcher(started: threading.Event, release: threading.Event, executor) -> MicroBatcher:
+    def run_batch(items: list[int]) -> list[int]:
+        started.set()
+        release.wait(5)
+        return [item * 10 for item in items]
+
+    return MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=50, executor=executor)
+
+
+def test_stop_lets_in_flight_batch_finish_and_fails_queued():
+    started, release = threading.Event(), threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        batcher = _blocking_batcher(started, release, executor)
+        batcher.start()
+        running = [asyncio.ensure_future(batcher.submit(item)) for item in (1, 2)]
+        await asyncio.to_thread(started.wait, 5)
+        queued = asyncio.ensure_future(batcher.submit(3))
+        await asyncio.sleep(0)
+
+        stopping = asyncio.ensure_future(batcher.stop())
+        await asyncio.sleep(0.05)
+        assert not stopping.done()
+        release.set()
+        await asyncio.wait_for(stopping, 5)
+
+        assert await asyncio.wait_for(asyncio.gather(*running), 1) == [10, 20]
+        with pytest.raises(RuntimeError, match="остановлен"):
+            await asyncio.wait_for(queued, 1)
+
+    asyncio.run(scenario())
+    executor.shutdown()
+
+
+def test_stop_fails_partially_collected_batch():
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=4, max_wait_ms=5000, executor=executor)
+        batcher.start()
+        waiting = asyncio.ensure_future(batcher.submit(1))
+        await asyncio.sleep(0.05)
+
+        await batcher.stop()
+
+        with pytest.raises(RuntimeError, match="остановлен"):
+            await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(scenario())
+    executor.shutdown()
+
+
+def test_histograms_are_registered_metrics():
+    async def scenario():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=4, max_wait_ms=1)
+        batcher.start()
+        before = batcher.get_stats()["batch_fill"]["count"]
+        assert await asyncio.gather(*(batcher.submit(item) for item in range(3))) == [0, 1, 2]
+        stats = batcher.get_stats()
+        await batcher.stop()
+        return before, stats
+
+    before, stats = asyncio.run(scenario())
+
+    assert stats["batch_fill"]["count"] > before
+    assert "local_batch_size_bucket" in metrics.render()
+    assert "local_batch_queue_delay_seconds_count" in metrics.render()
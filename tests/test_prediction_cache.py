@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+from models.schemas import Prediction
+from services import prediction_cache
+from services.prediction_cache import PredictionCache
+
+_PREDICTIONS = [Prediction(label="BMW M3 Coupe 2012", confidence=0.9)]
+
+
+def _cache(tmp_path, monkeypatch, clock: list[float], ttl: int = 100, stale: int = 50) -> PredictionCache:
+    monkeypatch.setattr(prediction_cache.time, "time", lambda: clock[0])
+    return PredictionCache(str(tmp_path / "cache.db"), "model", 1024 * 1024, ttl, stale)
+
+
+def test_expired_entry_is_kept_for_serve_stale(tmp_path, monkeypatch):
+    clock = [1000.0]
+    cache = _cache(tmp_path, monkeypatch, clock)
+    cache.put("old", _PREDICTIONS)
+
+    clock[0] += 120
+    cache.put("new", _PREDICTIONS)
+
+    assert cache.get("old") is None
+    assert cache.get("old", allow_stale=True) == _PREDICTIONS
+    assert cache.stats["evictions"] == 0
+    cache.close()
+
+
+def test_entries_past_stale_window_are_purged_periodically(tmp_path, monkeypatch):
+    clock = [1000.0]
+    cache = _cache(tmp_path, monkeypatch, clock)
+    cache.put("old", _PREDICTIONS)
+
+    # Окно устаревших записей прошло, но период очистки — ещё нет
+    clock[0] += 200
+    cache.put("other", _PREDICTIONS)
+    assert cache.get("old", allow_stale=True) == _PREDICTIONS
+
+    clock[0] += prediction_cache.PURGE_INTERVAL_SECONDS
+    cache.put("new", _PREDICTIONS)
+
+    assert cache.get("old", allow_stale=True) is None
+    assert cache.get_stats()["entries"] == 1
+    cache.close()
+
+
+def test_async_access_runs_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(prediction_cache, "PREDICTION_CACHE_DB", str(tmp_path / "cache.db"))
+    prediction_cache.close()
+    threads = []
+    get = PredictionCache.get
+
+    def recording_get(self, *args, **kwargs):
+        threads.append(threading.current_thread())
+        return get(self, *args, **kwargs)
+
+    monkeypatch.setattr(PredictionCache, "get", recording_get)
+
+    async def scenario():
+        await prediction_cache.put_async("model", "hash", _PREDICTIONS)
+        return await prediction_cache.get_async("model", "hash")
+
+    assert asyncio.run(scenario()) == _PREDICTIONS
+    assert threads and threads[0] is not threading.main_thread()
+    prediction_cache.close()
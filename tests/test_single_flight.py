@@ -0,0 +1,100 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from models.schemas import Prediction
+from services import hf_client
+
+PREDICTIONS = [Prediction(label="BMW M3 Coupe 2012", confidence=0.9)]
+
+
+class _Cache:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.items: dict = {}
+
+    def get(self, key, allow_stale=False):
+        return self.items.get(key)
+
+    def put(self, key, value) -> None:
+        if self.fail:
+            raise sqlite3.OperationalError("database is locked")
+        self.items[key] = value
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Заглушка API: считает запросы, отвечает после паузы или ошибкой."""
+    state = {"calls": 0, "error": None, "cache": _Cache()}
+
+    async def fetch(data: bytes):
+        state["calls"] += 1
+        await asyncio.sleep(0.01)
+        if state["error"] is not None:
+            raise state["error"]
+        return PREDICTIONS
+
+    async def compact(data: bytes) -> bytes:
+        return data
+
+    monkeypatch.setattr(hf_client, "_fetch_predictions", fetch)
+    monkeypatch.setattr(hf_client, "_compact", compact)
+    monkeypatch.setattr(hf_client.prediction_cache, "get_cache", lambda model: state["cache"])
+    hf_client.clear_cache()
+    yield state
+    hf_client.clear_cache()
+
+
+async def _concurrent(count: int) -> list:
+    results = await asyncio.gather(
+        *(asyncio.wait_for(hf_client._single_flight("hash", b"data"), timeout=1) for _ in range(count)),
+        return_exceptions=True,
+    )
+    return results
+
+
+def test_concurrent_calls_share_one_request(upstream):
+    results = asyncio.run(_concurrent(3))
+
+    assert upstream["calls"] == 1
+    assert [coalesced for _, coalesced in results] == [False, True, True]
+    assert all(predictions == PREDICTIONS for predictions, _ in results)
+    assert upstream["cache"].items["hash"] == PREDICTIONS
+
+
+def test_upstream_error_reaches_every_caller(upstream):
+    upstream["error"] = hf_client.UpstreamError("API недоступен", "503")
+
+    results = asyncio.run(_concurrent(3))
+
+    assert upstream["calls"] == 1
+    assert [type(result) for result in results] == [hf_client.UpstreamError] * 3
+    assert not hf_client._inflight
+
+
+def test_cache_write_failure_does_not_block_followers(upstream):
+    upstream["cache"] = _Cache(fail=True)
+
+    results = asyncio.run(_concurrent(3))
+
+    assert [predictions for predictions, _ in results] == [PREDICTIONS] * 3
+    assert not hf_client._inflight
+
+
+def test_cancelled_leader_fails_followers(upstream):
+    async def scenario() -> list:
+        leader = asyncio.create_task(hf_client._single_flight("hash", b"data"))
+        await asyncio.sleep(0)
+        followers = [
+            asyncio.create_task(asyncio.wait_for(hf_client._single_flight("hash", b"data"), timeout=1))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.gather(*followers, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert [type(result) for result in results] == [RuntimeError] * 2
+    assert not hf_client._inflight
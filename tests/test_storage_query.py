@@ -0,0 +1,53 @@
+import random
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.storage import ImageQuery, JsonMetadataBackend, SqliteMetadataBackend, sort_key
+
+
+def _fill(backend, seed: int = 7) -> None:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for index in range(60):
+        backend.add({
+            "filename": f"{index}.jpg", "path": f"/tmp/{index}.jpg",
+            "upload_date": (start + timedelta(hours=rng.randint(0, 20))).isoformat(),
+            "processed": False, "results": None, "mime_type": "image/jpeg",
+            "size_bytes": rng.choice([10, 20, 30]), "sha256": None, "phash": None,
+        })
+    labels = ["Audi A4 Sedan 2012", "BMW M3 Coupe 2012"]
+    backend.set_results_many({
+        record_id: [{"label": rng.choice(labels), "confidence": rng.choice([0.5, 0.7, 0.9])}]
+        for record_id in range(1, 61, 2)
+    })
+
+
+def _pages(backend, query: ImageQuery) -> list[int]:
+    ids: list[int] = []
+    query = replace(query, limit=7)
+    while True:
+        records = backend.query(query)
+        ids.extend(record["id"] for record in records)
+        if len(records) < query.limit:
+            return ids
+        query = replace(query, after=sort_key(records[-1], query.sort))
+
+
+@pytest.mark.parametrize("sort", ["id", "upload_date", "confidence", "size"])
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("label", [None, "BMW M3 Coupe 2012"])
+def test_json_keyset_pages_match_sqlite(tmp_path, sort, descending, label):
+    json_backend = JsonMetadataBackend(str(tmp_path / "metadata.json"), flush_interval=0)
+    sqlite_backend = SqliteMetadataBackend(str(tmp_path / "metadata.db"))
+    _fill(json_backend)
+    _fill(sqlite_backend)
+    query = ImageQuery(sort=sort, descending=descending, label=label)
+
+    expected = [record["id"] for record in sqlite_backend.query(query)]
+    assert _pages(json_backend, query) == expected
+    assert [r["id"] for r in json_backend.query(replace(query, offset=5, limit=4))] == expected[5:9]
+    assert [r["id"] for r in json_backend.query(replace(query, offset=5))] == expected[5:]
+    json_backend.close()
+    sqlite_backend.close()
@@ -0,0 +1,58 @@
+import os
+
+from PIL import Image
+
+from services import file_storage, image_processor, thumbnails
+
+
+def _original(tmp_path) -> str:
+    path = str(tmp_path / "blob.jpg")
+    Image.new("RGB", (1200, 800), (200, 30, 30)).save(path, "JPEG")
+    return path
+
+
+def _leftovers(tmp_path) -> list[str]:
+    return sorted(name for name in os.listdir(tmp_path) if name != "blob.jpg")
+
+
+def test_generate_creates_every_size(tmp_path):
+    original = _original(tmp_path)
+
+    created = thumbnails.generate(original)
+
+    assert sorted(created) == sorted(thumbnails.thumbnail_path(original, size) for size in thumbnails.THUMBNAIL_SIZES)
+    with Image.open(thumbnails.thumbnail_path(original, "small")) as img:
+        assert max(img.size) == thumbnails.THUMBNAIL_SIZES["small"]
+
+
+def test_original_deleted_during_generation_leaves_no_thumbnails(tmp_path, monkeypatch):
+    original = _original(tmp_path)
+    open_image = image_processor.open_image
+
+    def open_then_delete(source, min_side):
+        img = open_image(source, min_side)
+        # Запись удаляют, пока миниатюры ещё создаются
+        file_storage._remove_if_exists(original)
+        return img
+
+    monkeypatch.setattr(thumbnails.image_processor, "open_image", open_then_delete)
+
+    assert thumbnails.generate(original) == []
+    assert _leftovers(tmp_path) == []
+
+
+def test_thumbnail_renamed_before_delete_is_removed_with_original(tmp_path, monkeypatch):
+    original = _original(tmp_path)
+    replace = os.replace
+
+    def replace_then_delete(source, destination):
+        replace(source, destination)
+        # Удаление успевает пройти целиком между переименованием и проверкой оригинала
+        if destination.endswith(".large" + os.path.splitext(destination)[1]):
+            file_storage._remove_if_exists(original)
+
+    monkeypatch.setattr(thumbnails.os, "replace", replace_then_delete)
+
+    thumbnails.generate(original)
+
+    assert _leftovers(tmp_path) == []
@@ -0,0 +1,96 @@
+"""Локальная заглушка Hugging Face Inference API для проверки и нагрузочных тестов.
+
+Отвечает на POST /models/{model} списком предсказаний в формате HF API.
+Умеет имитировать задержку, случайные ошибки и ограничение частоты (429).
+
+Запуск:
+    python -m tools.stub_hf_server --port 8081 --latency 0.2 --max-concurrent 4
+
+Затем указать сервису адрес заглушки:
+    HF_API_URL=http://127.0.0.1:8081/models/stub HF_API_TOKEN=stub uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import random
+
+from aiohttp import web
+
+LABELS = [
+    "BMW M3 Coupe 2012",
+    "Audi R8 Coupe 2012",
+    "Tesla Model S Sedan 2012",
+    "Ford Mustang Convertible 2007",
+    "Chevrolet Corvette ZR1 2012",
+]
+
+
+def build_app(
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    max_concurrent: int = 0,
+    retry_after: float = 1.0,
+) -> web.Application:
+    """Создаёт приложение заглушки.
+
+    Args:
+        latency: Задержка ответа в секундах.
+        error_rate: Доля запросов, завершающихся ответом 500.
+        max_concurrent: Лимит одновременных запросов; сверх него — 429 (0 — без лимита).
+        retry_after: Значение заголовка Retry-After для ответов 429.
+    """
+    state = {"in_flight": 0, "requests": 0, "rate_limited": 0}
+
+    async def classify(request: web.Request) -> web.Response:
+        state["requests"] += 1
+        if max_concurrent and state["in_flight"] >= max_concurrent:
+            state["rate_limited"] += 1
+            return web.json_response(
+                {"error": "Rate limit reached"},
+                status=429,
+                headers={"Retry-After": str(retry_after)},
+            )
+        state["in_flight"] += 1
+        try:
+            data = await request.read()
+            if latency:
+                await asyncio.sleep(latency)
+            if error_rate and random.random() < error_rate:
+                return web.json_response({"error": "Internal error"}, status=500)
+        finally:
+            state["in_flight"] -= 1
+
+        # Детерминированные «предсказания» по содержимому файла
+        seed = int.from_bytes(hashlib.sha256(data).digest()[:8], "big")
+        rng = random.Random(seed)
+        scores = [rng.random() for _ in LABELS]
+        total = sum(scores)
+        return web.json_response([
+            {"label": label, "score": score / total}
+            for label, score in zip(LABELS, scores)
+        ])
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(state)
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/models/{model:.*}", classify)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Hugging Face Inference API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    web.run_app(
+        build_app(args.latency, args.error_rate, args.max_concurrent, args.retry_after),
+        host=args.host,
+        port=args.port,
+    )